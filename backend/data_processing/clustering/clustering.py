@@ -7,7 +7,6 @@
 # Note : le dossier de save par défaut est ../Images
 
 import os
-import json
 from typing import List, Optional, Tuple, Union
 
 import matplotlib.pyplot as plt
@@ -19,6 +18,7 @@ import pandas as pd
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
 from preprocessing.useData import Choose_Open
+from preprocessing.jsonParser import load_json
 
 """
 	Charge les données JSON pour le mois/année donnés et trace un graphique de clustering.
@@ -49,7 +49,7 @@ def plot_clustering(year: int,
 	month_str = str(int(month))
 
 	try:
-		df = Choose_Open(year, month, (data_type,))
+		df = Choose_Open(year, month, (data_type,), columns=metrics)
 		
 		# Convertir le DataFrame en liste de dictionnaires pour compatibilité avec le code existant
 		# Si l'index est @timestamp, le réinitialiser pour l'inclure comme colonne
@@ -105,32 +105,16 @@ def plot_clustering(year: int,
 		if not os.path.isfile(filepath):
 			raise FileNotFoundError(f"Fichier inexistant à {filepath}")
 
-		# Ouverture et import du fichier JSON
-		with open(filepath, 'r', encoding='utf-8') as f:
-			content = f.read().strip()
-			
-		# Essayer de parser comme JSON standard
-		try:
-			data = json.loads(content)
-		except json.JSONDecodeError:
-			# Si échec, essayer comme JSON Lines (une ligne = un objet JSON)
-			entries = []
-			for line in content.splitlines():
-				line = line.strip()
-				if not line:
-					continue
-				try:
-					entries.append(json.loads(line))
-				except json.JSONDecodeError:
-					continue
+		# Ouverture et import du fichier JSON (json standard ou JSON Lines, rendu sous forme de liste)
+		data = load_json(filepath)
+
+		# Extraction des entrées du fichier
+		if isinstance(data, dict):
+			entries = list(data.values())
+		elif isinstance(data, list):
+			entries = data
 		else:
-			# Extraction des entrées du fichier
-			if isinstance(data, dict):
-				entries = list(data.values())
-			elif isinstance(data, list):
-				entries = data
-			else:
-				raise ValueError("Format invalide")
+			raise ValueError("Format invalide")
 
     # Validation des paramètres
 	if n_metrics not in (1, 2, 3):
@@ -18,8 +18,9 @@ from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
 
 # Import de la fonction centralisée pour charger les données
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'preprocessing'))
-from useData import Choose_Open
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..')) #backend/: le paquet preprocessing
+from preprocessing.useData import Choose_Open
+from preprocessing.jsonParser import load_json
 
 
 # ======================
@@ -51,52 +52,9 @@ def load_packets(json_file_or_dir):
             return pd.DataFrame()
         return pd.concat(dfs, ignore_index=True)
 
-    with open(json_file_or_dir, 'r', encoding='utf-8') as f:
-        content = f.read().strip()
-    
-    # Essayer de parser comme JSON standard
-    try:
-        raw = json.loads(content)
-    except json.JSONDecodeError:
-        # Si échec, essayer comme JSON Lines (une ligne = un objet JSON)
-        packets = []
-        for line in content.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                entry = json.loads(line)
-                if not isinstance(entry, dict):
-                    continue
-                
-                rx = {}
-                raw_pckt = entry.get('Raw_pckt') or entry.get('raw_pckt')
-                if isinstance(raw_pckt, str):
-                    try:
-                        parsed = json.loads(raw_pckt)
-                        if isinstance(parsed, dict) and 'rxpk' in parsed and isinstance(parsed['rxpk'], list) and len(parsed['rxpk'])>0:
-                            rx = parsed['rxpk'][0]
-                    except Exception:
-                        rx = {}
-                
-                packets.append({
-                    'Dev_Add': entry.get('Dev_Add') or entry.get('dev_add'),
-                    'Dev_EUI': entry.get('Dev_EUI') or entry.get('Dev_EUI'.lower()) or entry.get('Dev_EUI'),
-                    'SF': entry.get('SF'),
-                    'Bandwidth': entry.get('Bandwidth'),
-                    'BitRate': entry.get('BitRate'),
-                    'Coding_rate': entry.get('Coding_rate') or entry.get('codr'),
-                    'Airtime': entry.get('Airtime'),
-                    'freq': entry.get('freq') or rx.get('freq'),
-                    'rssi': entry.get('rssi') or rx.get('rssi'),
-                    'lsnr': entry.get('lsnr') or rx.get('lsnr'),
-                    'size': entry.get('size') or rx.get('size'),
-                    'Type': entry.get('Type')
-                })
-            except json.JSONDecodeError:
-                continue
-        
-        return pd.DataFrame(packets)
+    # json entier ou JSON Lines (une ligne = un objet JSON, rendu sous forme de liste)
+    # avec le parseur le plus rapide disponible
+    raw = load_json(json_file_or_dir)
 
     packets = []
 
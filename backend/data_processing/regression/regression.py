@@ -75,7 +75,8 @@ def run_signal_models(
     """
 
     # LOAD DATA
-    df = Choose_Open(year, month, (data_type,))
+    df = Choose_Open(year, month, (data_type,),
+                     columns=["Bandwidth", "SF", "size", "freq", "Coding_rate", "Dev_Add", "GW_EUI", "Type", "rssi", "lsnr"])
 
     # TIME FEATURES
     df["time"] = pd.to_datetime(df.index)
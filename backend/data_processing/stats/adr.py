@@ -20,7 +20,7 @@ def _proportion_ADR(df:pd.DataFrame,repartitions:list,annee:int|None=None,mois:i
     """
     if categorie is not None:
         df=df[df["Type"]==categorie]
-    taux=df["adr"].mean() #déjà entre 0 et 1 (true/false) donc ça fonctionnera
+    taux=df["adr"].astype("float64").mean() #déjà entre 0 et 1 (true/false) donc ça fonctionnera, NaN et pas pd.NA si aucun paquet n'a l'adr
     if categorie is None:
         categorie="Global"
     repartitions.append({"categorie":categorie,"adr":taux})
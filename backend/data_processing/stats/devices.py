@@ -25,12 +25,12 @@ from numpy import ndarray
 categories=["Confirmed Data Up","Confirmed Data Down","Join Accept","Join Request","Proprietary","RFU","Unconfirmed Data Up","Unconfirmed Data Down"]
 
 def nombreDevices(annee:int=None,mois:int=None)->int:
-    df=Choose_Open(annee,mois, ("Join Request",))
+    df=Choose_Open(annee,mois, ("Join Request",),columns=["Dev_EUI"])
     nombre=df["Dev_EUI"].nunique(dropna=True)
     return nombre
 def Devices(annee:int=None,mois:int=None)->ndarray:
-    df=Choose_Open(annee,mois, ("Join Request",))
-    devices=df["Dev_EUI"].unique()
+    df=Choose_Open(annee,mois, ("Join Request",),columns=["Dev_EUI"])
+    devices=df["Dev_EUI"].unique().to_numpy() #Dev_EUI est catégoriel
     return devices
 
 def trackDevices(annee:int=None,mois:int=None,categories:list=None):
@@ -14,7 +14,7 @@
 """
 Docstring for backend.data_processing.stats.paquets
 """
-from preprocessing.useData import Choose_Open #pour executer ce fichier or du serveur, rajouter ... devant le module
+from preprocessing.useData import Choose_Open,Colonnes #pour executer ce fichier or du serveur, rajouter ... devant le module
 import pandas as pd
 import matplotlib
 matplotlib.use("Agg")
@@ -31,7 +31,7 @@ plot_dir=os.path.join(backend_dir,"Images","Stats")
 
 def GatewayList(df:pd.DataFrame,annee:int=None,mois:int=None)->ndarray:
     df=df[df["Type"]=="Join Request"]
-    gateway=df["GW_EUI"].unique()
+    gateway=df["GW_EUI"].unique().to_numpy() #GW_EUI est catégoriel
     return gateway
 
 def GetListValues(df:pd.DataFrame,caracteristique:str,annee:int=None,mois:int=None)->ndarray:
@@ -117,8 +117,7 @@ def _proportionCaraCat(df:pd.DataFrame,caracteristique:str,valeurCaracteristique
     repartitions.append({"categorie":categorie,alias:taux})
 
 def ColumnsList(annee:int=None,mois:int=None)->list:
-    df=Choose_Open(annee,mois)
-    return df.columns.values.tolist()
+    return Colonnes(annee,mois) #catalogue des partitions, sans lire les données
 
 def RepartitionCaracteristiqueParCategorie(dftot:pd.DataFrame,caracteristique:str,alias:str,annee:int=None,mois:int=None)->dict:
     """
@@ -342,7 +341,7 @@ def packetMain(columnList,year,month):
              }
     files={}
     histogrammes=set(["BitRate","Airtime","lsnr","rssi","size"])#métriques qui doivent être analysées par histogramme
-    df=Choose_Open(year,month)
+    df=Choose_Open(year,month,columns=set(columnList)|{"Type"}) #seulement les colonnes tracées
     for column in columnList:
             dictionnaireCat={}
             alias=aliases[column] #pas de gestion pour voir s'il envoit un truc dedans ou pas, pas le temps, personne va modifier le javascript pour un projet comme ça
@@ -249,7 +249,7 @@ def trends(year:int=None,month:int=None,categories:tuple|None=None,hop_interval:
     #dftot=Choose_Open(year,month)
     #subdf=dftot[dftot["Type"].isin(categories)]
     files={}
-    df=Choose_Open(year,month,categories)
+    df=Choose_Open(year,month,categories,columns=["Type"]) #seuls @timestamp (index) et Type servent
     files["Saisonnalite globale"]=plotTimeSerie(df,freq,hop_interval,hop_value)#plot UNIQUEMENT les catégories sélectionnées
     files["Saisonnalite detaillée par type"]=plotMultipleTimeSeries(df,freq,hop_interval,hop_value)
     files["Saisonnalité avec statistiques"]=plotTimeSerieStats(df,freq,hop_interval,hop_value)
@@ -17,13 +17,27 @@ Docstring for backend.preprocessing.RawParsing
 Fonctions qui servent globalement à parser les données raw
 Fonctions: 
 ADR(data:str)->bool: récupère l'ADR depuis une payload
-addColAdr(df:pd.DataFrame)->pd.Dataframe: ajoute le champ ADR au Dataframe
+decode_phy_payload(data:pd.Series)->pd.DataFrame: décode l'en-tête LoRaWAN de toute une colonne de payloads d'un coup (numpy)
+addColAdr(df:pd.DataFrame)->pd.Dataframe: ajoute le champ ADR (et les autres champs de l'en-tête) au Dataframe
+string_buffer(data:pd.Series)->tuple: une colonne de chaînes en un seul buffer d'octets + offsets (décodages vectorisés, cf netId)
 
 By Charles Bouquet
 """
 
 import base64
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+
+_B64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_B64_LUT = np.full(256, 255, dtype=np.uint8) #255: caractère invalide
+_B64_LUT[np.frombuffer(_B64_ALPHABET, dtype=np.uint8)] = np.arange(64, dtype=np.uint8)
+_B64_LUT[ord("=")] = 64 #padding
+_HEX = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+
+FHDR_CHARS = 12 #les 12 premiers caractères base64 donnent les 9 premiers octets: MHDR, DevAddr, FCtrl, FCnt (+1)
+MIC_BYTES = 4
+#MType 2 à 5: Unconfirmed/Confirmed Data Up/Down, les seuls à avoir un FHDR (pair: montant, impair: descendant)
 def ADR(data:str)->bool:
     """
     Docstring for ADR
@@ -54,6 +68,100 @@ def ADR(data:str)->bool:
     #rq fctrl>>7 fonctionne aussi normalement
     return adr
 
+def string_buffer(data:pd.Series)->tuple:
+    """
+    la colonne sous forme d'un seul buffer d'octets contigu + offsets (représentation arrow)
+    renvoie (valeur présente ou non, offsets (n+1), buffer uint8): la ligne i occupe buf[offsets[i]:offsets[i+1]]
+    """
+    try:
+        arr=pa.array(data,type=pa.large_string(),from_pandas=True)
+    except (pa.ArrowInvalid,pa.ArrowTypeError):
+        arr=pa.array(data.astype("string"),type=pa.large_string(),from_pandas=True)
+    if isinstance(arr,pa.ChunkedArray):
+        arr=arr.combine_chunks()
+    _,offsets,buf=arr.buffers()
+    offsets=np.frombuffer(offsets,dtype=np.int64)[arr.offset:arr.offset+len(arr)+1]
+    buf=np.frombuffer(buf,dtype=np.uint8) if buf is not None and buf.size else np.zeros(0,dtype=np.uint8)
+    valid=arr.is_valid().to_numpy(zero_copy_only=False)
+    return valid,offsets,buf
+
+def _decode_chars(buf:np.ndarray,positions:np.ndarray,restants:np.ndarray,nb_chars:int):
+    """
+    décode nb_chars caractères base64 (multiple de 4) à partir de positions (une par ligne) dans buf
+    restants: nombre de caractères de la ligne à partir de sa position (au delà: ignorés)
+    renvoie (octets (n,3*nb_chars//4), ligne contenant un caractère invalide)
+    """
+    n=len(positions)
+    fenetres=np.lib.stride_tricks.sliding_window_view(buf,nb_chars) #une ligne = nb_chars octets consécutifs, sans copie
+    codes=_B64_LUT[fenetres[np.clip(positions,0,len(fenetres)-1)]]
+    inside=np.arange(nb_chars)<restants[:,None]
+    invalide=((codes==255)&inside).any(axis=1)
+    codes=np.where(inside&(codes<64),codes,0).reshape(n,nb_chars//4,4).astype(np.uint32)
+    v=(codes[:,:,0]<<18)|(codes[:,:,1]<<12)|(codes[:,:,2]<<6)|codes[:,:,3]
+    octets=np.stack([v>>16,v>>8,v],axis=2).astype(np.uint8).reshape(n,3*nb_chars//4)
+    return octets,invalide
+
+def decode_phy_payload(data:pd.Series)->pd.DataFrame:
+    """
+    Docstring for decode_phy_payload
+
+    :param data: payloads LoRaWAN (PHYPayload) en base64, champ data de rxpk
+    :type data: pd.Series
+    :return: DataFrame (même index que data) avec les colonnes
+        MType, DevAddr (hex, octets dans l'ordre d'affichage), adr, ADRACKReq, ACK, FPending, FOptsLen, FCnt, FPort
+    :rtype: DataFrame
+
+    Toute la colonne est décodée avec des opérations numpy, sans boucle python par paquet:
+    seuls les caractères base64 de l'en-tête sont lus, directement dans le buffer arrow de la colonne
+    cf LoRaWAN 1.0.3: MHDR | DevAddr (4, little endian) | FCtrl | FCnt (2, little endian) | FOpts | FPort | ... | MIC (4)
+    adr garde la même définition que ADR (bit 7 du 6e octet dès que la payload fait au moins 6 octets, quel que soit le type)
+    les autres champs du FHDR ne sont renseignés que pour les paquets de données (NA sinon),
+    ADRACKReq seulement en montant et FPending seulement en descendant
+    une payload absente ou qui n'est pas du base64 valide donne NA partout
+    """
+    valid,offsets,buf=string_buffer(data)
+    n=len(data)
+    buf=np.concatenate([buf,np.zeros(FHDR_CHARS,dtype=np.uint8)]) #les fenêtres de fin de buffer restent dans le tableau
+    starts=offsets[:-1]
+    ends=offsets[1:]
+    lengths=ends-starts
+    ok=valid&(lengths>0)&(lengths%4==0)
+    pad=(ok&(buf[np.maximum(ends-1,0)]==ord("="))).astype(np.int64)+(ok&(lengths>=2)&(buf[np.maximum(ends-2,0)]==ord("="))).astype(np.int64)
+
+    octets,invalide=_decode_chars(buf,starts,np.where(ok,lengths,0),FHDR_CHARS)
+    ok&=~invalide
+    nbytes=np.where(ok,lengths//4*3-pad,0)
+
+    mtype=octets[:,0]>>5
+    fctrl=octets[:,5]
+    is_data=ok&(mtype>=2)&(mtype<=5)&(nbytes>=1+7+MIC_BYTES)
+    montant=(mtype&1)==0
+    foptslen=fctrl&0x0F
+    port_pos=(8+foptslen).astype(np.int64)
+    has_port=is_data&(nbytes>port_pos+MIC_BYTES)
+    port_chars=port_pos//3*4
+    port_octets,_=_decode_chars(buf,starts+port_chars,np.where(has_port,lengths-port_chars,0),4)
+    fport=port_octets[np.arange(n),port_pos%3]
+
+    devaddr=octets[:,[4,3,2,1]]
+    chars=np.empty((n,8),dtype=np.uint8)
+    chars[:,0::2]=_HEX[devaddr>>4]
+    chars[:,1::2]=_HEX[devaddr&0x0F]
+    devaddr=pa.Array.from_buffers(pa.string(),n,[pa.py_buffer(np.packbits(is_data,bitorder="little")),
+                                                 pa.py_buffer(np.arange(0,8*n+1,8,dtype=np.int32)),pa.py_buffer(chars)])
+
+    return pd.DataFrame({
+        "MType":pd.arrays.IntegerArray(mtype,~(ok&(nbytes>=1))),
+        "DevAddr":pd.array(devaddr,dtype="string"),
+        "adr":pd.arrays.BooleanArray((fctrl&0x80)!=0,~(ok&(nbytes>=6))),
+        "ADRACKReq":pd.arrays.BooleanArray((fctrl&0x40)!=0,~(is_data&montant)),
+        "ACK":pd.arrays.BooleanArray((fctrl&0x20)!=0,~is_data),
+        "FPending":pd.arrays.BooleanArray((fctrl&0x10)!=0,~(is_data&~montant)),
+        "FOptsLen":pd.arrays.IntegerArray(foptslen,~is_data),
+        "FCnt":pd.arrays.IntegerArray(octets[:,6].astype(np.uint16)|(octets[:,7].astype(np.uint16)<<8),~is_data),
+        "FPort":pd.arrays.IntegerArray(fport,~has_port),
+    },index=data.index)
+
 def addColAdr(df:pd.DataFrame)->pd.DataFrame:
     """
     Docstring for addColAdr
@@ -63,9 +171,12 @@ def addColAdr(df:pd.DataFrame)->pd.DataFrame:
     :return: Dataframe avec la colonne ADR
     :rtype: DataFrame
 
-    affecte la valeur de l'ADR à chaque paquet dans le dataframe
+    affecte la valeur de l'ADR à chaque paquet dans le dataframe,
+    ainsi que les autres champs de l'en-tête MAC (cf decode_phy_payload)
     """
-    df["adr"]=df["data"].apply(ADR)
+    entete=decode_phy_payload(df["data"])
+    for column in entete.columns:
+        df[column]=entete[column]
     
     return df
 
@@ -14,4 +14,4 @@
 """
 Docstring for preprocessing
 """
-from .preprocessing_utils import prepare_data
\ No newline at end of file
+from .preprocessing_utils import prepare_data,prepare_stream
\ No newline at end of file
@@ -1,33 +1,90 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.agrege
+
+Agrège plusieurs exports bruts (par exemple un fichier par jour) directement dans Data/year=<année>/month=<mois>/Type=<Type>
+Les fichiers sont applatis en parallèle (un processus par fichier) et répartis par partition au fil de l'eau,
+sans passer par un gros json intermédiaire ni par flattened/flat.parquet
+
+Utilisation (EN TANT QUE MODULE depuis backend/):
+python -m preprocessing.agrege "chemin/2023-12" --rolling 30 --attrs rssi lsnr
+python -m preprocessing.agrege "chemin/2023-12/*.json.gz" --workers 4 --append
+"""
 import os
-import json
-import ijson
-from decimal import Decimal
-
-script_dir = os.path.dirname(os.path.abspath(__file__))
-fileDirectory = os.path.join(script_dir, "2023-12")
-output_path = os.path.join(script_dir, "tout.json")
-
-def json_default(obj):
-    if isinstance(obj, Decimal):
-        return float(obj)   # ou str(obj) si tu veux zéro perte
-    raise TypeError
-
-with open(output_path, "w") as out:
-    out.write("{\n")
-    first = True
-
-    for file in os.listdir(fileDirectory):
-        if not file.endswith(".json"):
-            continue
-
-        with open(os.path.join(fileDirectory, file), "rb") as f:
-            for key, value in ijson.kvitems(f, ""):
-                if not first:
-                    out.write(",\n")
-                first = False
-
-                out.write(
-                    f'"{key}": {json.dumps(value, default=json_default)}'
-                )
-
-    out.write("\n}")
+import glob
+import argparse
+import tempfile
+from concurrent.futures import as_completed
+from .spill import flatten_to_spill
+from .preprocessing_utils import prepare_spilled
+from .workers import process_pool
+
+EXTENSIONS = (".json", ".json.gz", ".json.zst", ".json.xz", ".json.bz2")
+
+def list_raw_files(source: str) -> list:
+    """
+    Docstring for list_raw_files
+
+    :param source: répertoire (tous les json, compressés ou non, qu'il contient) ou motif glob
+    :type source: str
+    :return: liste triée des fichiers
+    :rtype: list
+    """
+    if os.path.isdir(source):
+        files = [os.path.join(source, f) for f in os.listdir(source) if f.endswith(EXTENSIONS)]
+    else:
+        files = [f for f in glob.glob(source) if os.path.isfile(f)]
+    return sorted(files)
+
+def agrege(source: str, rolling_interval=30, attrList: list = ["Airtime", "BitRate", "rssi", "lsnr"], nb_workers: int = None, append: bool = False, memory_budget: int = None):
+    """
+    Docstring for agrege
+    Applatit tous les fichiers de source en parallèle puis range les paquets par année, mois et type
+
+    :param source: répertoire ou motif glob des exports bruts
+    :type source: str
+    :param rolling_interval: fenêtre glissante pour les outliers (nombre de points ou durée)
+    :param attrList: attributs utilisés pour les outliers
+    :type attrList: list
+    :param nb_workers: nombre de processus pour l'applatissement et pour les partitions (nombre de coeurs par défaut)
+    :type nb_workers: int
+    :param append: ajoute aux partitions existantes au lieu de les remplacer
+    :type append: bool
+    :param memory_budget: mode hors mémoire, mémoire totale (octets) pour le nettoyage des partitions
+    :type memory_budget: int
+    """
+    files = list_raw_files(source)
+    if not files:
+        raise FileNotFoundError(f"Aucun fichier json trouvé pour {source}")
+
+    with tempfile.TemporaryDirectory(prefix="spill_") as spill_dir:
+        with process_pool(nb_workers or os.cpu_count() or 1) as executor:
+            futures = {executor.submit(flatten_to_spill, file, spill_dir, f"{i:05d}"): file for i, file in enumerate(files)}
+            for nb, future in enumerate(as_completed(futures), start=1):
+                print(f"[{nb}/{len(files)}] {futures[future]}: {future.result()} paquets")
+        prepare_spilled(rolling_interval, attrList, spill_dir, append, nb_workers, memory_budget)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agrège des exports bruts dans Data/year=<année>/month=<mois>/Type=<Type>")
+    parser.add_argument("source", help="répertoire ou motif glob des fichiers json (éventuellement compressés)")
+    parser.add_argument("--rolling", default="30", help="fenêtre glissante: nombre de points (30) ou durée (7d)")
+    parser.add_argument("--attrs", nargs="+", default=["Airtime", "BitRate", "rssi", "lsnr"], help="attributs pour les outliers")
+    parser.add_argument("--workers", type=int, default=None, help="nombre de processus")
+    parser.add_argument("--append", action="store_true", help="ajoute aux partitions existantes")
+    parser.add_argument("--memory-budget", type=int, default=None, help="mode hors mémoire: mémoire totale en Mio pour le nettoyage")
+    args = parser.parse_args()
+    rolling = int(args.rolling) if args.rolling.isdigit() else args.rolling
+    budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+    agrege(args.source, rolling, args.attrs, args.workers, args.append, budget)
@@ -0,0 +1,116 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.datasetCache
+
+Cache des DataFrames lus dans le dataset (cf useData.py):
+- budget en octets mesuré sur les buffers des colonnes (memory_usage(deep=True)), les entrées les moins récemment utilisées partent en premier
+- chaque entrée garde la signature des fichiers lus (chemin et hash du pied de page, tirés du catalogue Data/_manifest.json): un prétraitement
+  qui réécrit une partition rend obsolètes immédiatement toutes les entrées qui l'ont lue, sans durée d'expiration
+- une entrée est mémorisée avec ses colonnes (projection): une demande de moins de colonnes est servie par une entrée plus large
+- les appelants reçoivent une copie superficielle (copy-on-write avec pandas >= 3): ajouter ou modifier une colonne
+  ne touche pas le DataFrame mémorisé, une route ne peut plus polluer les données d'une autre
+  (copie complète avec une version plus ancienne de pandas sans copy-on-write activé)
+
+Classes:
+DatasetCache:
+    cache LRU à budget mémoire
+"""
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+def _copy_on_write() -> bool:
+    if int(pd.__version__.split(".")[0]) >= 3:
+        return True
+    return pd.options.mode.copy_on_write is True #pandas 2: activé par option ("warn" ne protège rien)
+
+def _copy(df: pd.DataFrame) -> pd.DataFrame:
+    return df.copy(deep=not _copy_on_write()) #sans copy-on-write une copie superficielle partage les colonnes modifiables en place
+
+def _nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True, index=True).sum()) #buffers numpy/arrow, codes et catégories des Categorical
+
+class DatasetCache:
+    """
+    Docstring for DatasetCache
+    Cache LRU de DataFrames limité à max_bytes octets, utilisable depuis plusieurs threads (routes synchrones de FastAPI)
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() #(clé, colonnes) -> (signature, DataFrame, octets), du moins récent au plus récent
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def _remove(self, key):
+        _, _, taille = self.entries.pop(key)
+        self.nbytes -= taille
+
+    def _stale(self, signature: tuple) -> list:
+        """
+        Entrées qui ont lu un des fichiers de signature dans une autre version (autre hash), quelle que soit leur clé
+        """
+        hashes = dict(signature)
+        return [entree for entree, (sign, _, _) in self.entries.items()
+                if any(chemin in hashes and hashes[chemin] != h for chemin, h in sign)]
+
+    def _find(self, key, columns: frozenset | None, signature: tuple):
+        for (cle, colonnes), (sign, df, _) in self.entries.items():
+            if cle == key and sign == signature and (colonnes is None or (columns is not None and columns <= colonnes)):
+                return (cle, colonnes), df
+        return None, None
+
+    def get(self, key, columns: frozenset | None, signature: tuple, load) -> pd.DataFrame:
+        """
+        Docstring for get
+
+        :param key: paramètres de la lecture (hashables)
+        :param columns: colonnes demandées, None pour toutes
+        :type columns: frozenset | None
+        :param signature: état des fichiers lus ((chemin, hash) tirés du catalogue), une entrée avec une autre signature est relue
+            et toutes les entrées qui ont lu une autre version d'un de ces fichiers sont oubliées
+        :type signature: tuple
+        :param load: fonction sans argument qui lit les données (colonnes demandées)
+        :return: copie superficielle des données mémorisées (ou lues), réduite aux colonnes demandées
+        :rtype: DataFrame
+        """
+        with self.lock:
+            trouve, df = self._find(key, columns, signature)
+            if trouve is not None:
+                self.entries.move_to_end(trouve)
+                if columns is None or trouve[1] == columns:
+                    return _copy(df)
+                return df[[colonne for colonne in df.columns if colonne in columns]] #sélection par liste: nouvelles colonnes, même sans copy-on-write
+        df = load() #hors du verrou: une lecture longue ne bloque pas les autres routes
+        taille = _nbytes(df)
+        with self.lock:
+            for entree in self._stale(signature):
+                self._remove(entree)
+            for entree in [entree for entree in self.entries if entree[0] == key]:
+                if self.entries[entree][0] != signature or entree[1] == columns or entree[1] is not None and (columns is None or entree[1] <= columns):
+                    self._remove(entree) #obsolète, remplacée ou contenue dans la nouvelle entrée
+            if taille <= self.max_bytes:
+                self.entries[(key, columns)] = (signature, df, taille)
+                self.nbytes += taille
+                while self.nbytes > self.max_bytes:
+                    self._remove(next(iter(self.entries)))
+        return _copy(df)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,188 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.externalSort
+
+Tri externe par @timestamp pour le mode hors mémoire: les données sont lues par morceaux,
+chaque morceau est trié puis écrit dans un fichier run, puis les runs sont fusionnés en flux
+Le résultat est le même que pd.concat(...).sort_index(kind="stable"): à date égale, l'ordre d'entrée est conservé
+
+Fonctions:
+rows_for_budget:
+    nombre de lignes par morceau pour tenir dans un budget mémoire
+iter_tables:
+    lit des fichiers parquet par morceaux
+sort_runs:
+    écrit les runs triés
+merge_runs:
+    fusionne les runs en morceaux triés
+external_sort:
+    sort_runs puis merge_runs
+"""
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SORT_KEY = "_ts"
+ROW_FACTOR = 4 #copies d'un morceau pendant son traitement (fenêtre des quartiles, masques, colonnes décodées)
+
+def rows_for_budget(files: list, memory_budget: int, minimum: int = 1_000) -> int:
+    """
+    Docstring for rows_for_budget
+    La taille d'une ligne est mesurée en pandas sur le début du premier fichier
+
+    :param files: fichiers parquet à traiter
+    :type files: list
+    :param memory_budget: mémoire disponible pour un morceau (octets)
+    :type memory_budget: int
+    :return: nombre de lignes par morceau
+    :rtype: int
+    """
+    batch = next(pq.ParquetFile(files[0]).iter_batches(batch_size=10_000), None)
+    if batch is None or batch.num_rows == 0:
+        return minimum
+    par_ligne = batch.to_pandas().memory_usage(deep=True).sum() / batch.num_rows
+    return max(minimum, int(memory_budget // (par_ligne * ROW_FACTOR)))
+
+def iter_tables(files: list, batch_size: int, columns: list | None = None):
+    """
+    Docstring for iter_tables
+
+    :param columns: colonnes à lire, None pour toutes
+    :return: générateur de pa.Table d'au plus batch_size lignes, dans l'ordre des fichiers
+    """
+    for file in files:
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=batch_size, columns=columns):
+            if batch.num_rows:
+                yield pa.Table.from_batches([batch])
+
+def _sort_key(table: pa.Table) -> np.ndarray:
+    timestamps = pd.to_datetime(table.column("@timestamp").to_pandas(), errors="coerce", utc=True)
+    return timestamps.dt.as_unit("ns").to_numpy(dtype="int64", na_value=np.iinfo(np.int64).max) #dates invalides à la fin, comme sort_index
+
+def _write_run(tables: list, path: str) -> str:
+    table = pa.concat_tables(tables, promote_options="permissive")
+    key = _sort_key(table)
+    ordre = np.argsort(key, kind="stable")
+    table = table.take(ordre).append_column(SORT_KEY, pa.array(key[ordre]))
+    pq.write_table(table, path, compression="lz4")
+    return path
+
+def sort_runs(tables, run_dir: str, rows_per_run: int) -> list:
+    """
+    Docstring for sort_runs
+
+    :param tables: pa.Table dans l'ordre d'entrée (mêmes colonnes)
+    :param run_dir: répertoire des runs
+    :type run_dir: str
+    :param rows_per_run: nombre de lignes d'un run (doit tenir en mémoire)
+    :type rows_per_run: int
+    :return: fichiers des runs, dans l'ordre d'entrée, chacun trié avec sa clé dans la colonne _ts
+    :rtype: list
+    """
+    runs = []
+    courant = []
+    nb = 0
+    for table in tables:
+        courant.append(table)
+        nb += table.num_rows
+        if nb >= rows_per_run:
+            runs.append(_write_run(courant, os.path.join(run_dir, f"run-{len(runs):05d}.parquet")))
+            courant = []
+            nb = 0
+    if courant:
+        runs.append(_write_run(courant, os.path.join(run_dir, f"run-{len(runs):05d}.parquet")))
+    return runs
+
+def merge_runs(runs: list, rows_per_chunk: int):
+    """
+    Docstring for merge_runs
+    Fusion des runs par blocs: on ne garde en mémoire qu'un bloc (rows_per_chunk / nombre de runs lignes) par run
+    À chaque tour, toutes les lignes strictement avant la plus petite des dernières dates chargées sont sûres d'être complètes:
+    elles sont triées (à date égale: ordre des runs puis ordre dans le run) et rendues
+
+    :param runs: fichiers produits par sort_runs
+    :type runs: list
+    :param rows_per_chunk: taille visée des morceaux rendus
+    :type rows_per_chunk: int
+    :return: générateur de pa.Table triés (colonne _ts comprise)
+    """
+    bloc = max(1, rows_per_chunk // max(len(runs), 1))
+    lecteurs = [pq.ParquetFile(run).iter_batches(batch_size=bloc) for run in runs]
+    buffers = [None] * len(runs)
+    finis = [False] * len(runs)
+
+    def charge(i):
+        batch = next(lecteurs[i], None)
+        if batch is None:
+            finis[i] = True
+            return
+        table = pa.Table.from_batches([batch])
+        buffers[i] = table if buffers[i] is None else pa.concat_tables([buffers[i], table])
+
+    def dernier(i):
+        return buffers[i].column(SORT_KEY)[-1].as_py()
+
+    def trie(pieces):
+        table = pa.concat_tables(pieces, promote_options="permissive") #runs de sources différentes (mode ajout)
+        return table.take(np.argsort(table.column(SORT_KEY).to_numpy(), kind="stable"))
+
+    en_attente = []
+    nb_attente = 0
+    while True:
+        for i in range(len(runs)):
+            if not finis[i] and (buffers[i] is None or buffers[i].num_rows == 0):
+                charge(i)
+        actifs = [i for i in range(len(runs)) if not finis[i]]
+        if not actifs:
+            break
+        borne = min(dernier(i) for i in actifs)
+        pieces = []
+        for i in range(len(runs)):
+            if buffers[i] is None or buffers[i].num_rows == 0:
+                continue
+            k = int(np.searchsorted(buffers[i].column(SORT_KEY).to_numpy(), borne, side="left"))
+            if k:
+                pieces.append(buffers[i].slice(0, k))
+                buffers[i] = buffers[i].slice(k)
+        if pieces:
+            en_attente.append(trie(pieces))
+            nb_attente += en_attente[-1].num_rows
+            if nb_attente >= rows_per_chunk:
+                yield pa.concat_tables(en_attente, promote_options="permissive")
+                en_attente = []
+                nb_attente = 0
+        for i in actifs:
+            if buffers[i].num_rows and dernier(i) == borne:
+                charge(i) #ses lignes restantes sont toutes à la borne: il faut le bloc suivant pour avancer
+    pieces = [buffer for buffer in buffers if buffer is not None and buffer.num_rows]
+    if pieces:
+        en_attente.append(trie(pieces))
+    if en_attente:
+        yield pa.concat_tables(en_attente, promote_options="permissive")
+
+def external_sort(tables, run_dir: str, rows_per_chunk: int):
+    """
+    Docstring for external_sort
+
+    :param tables: pa.Table dans l'ordre d'entrée
+    :param run_dir: répertoire temporaire des runs
+    :type run_dir: str
+    :param rows_per_chunk: lignes par run et par morceau rendu
+    :type rows_per_chunk: int
+    :return: générateur de pa.Table triés par @timestamp (colonne _ts comprise)
+    """
+    return merge_runs(sort_runs(tables, run_dir, rows_per_chunk), rows_per_chunk)
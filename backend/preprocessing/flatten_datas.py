@@ -1,4 +1,3 @@
-
 # Copyright 2025 Titouan Verdier, Charles Bouquet
 #
 # Licensed under the Apache License, Version 2.0 (the "License");
@@ -14,99 +13,342 @@
 # limitations under the License.
 """
 Functions:
-flatten_datas:
-applatit le json en entrée et en crée un en sortie
+iter_flattened_batches:
+    applatit un flux et rend les paquets par RecordBatch (rangés par partition dans spill.py)
+find_shard_offsets:
+    découpe le json en plages d'octets indépendantes (une plage = une suite de clés de premier niveau),
+    une plage par processus dans spill.flatten_to_spill_parallel
+ShardReader:
+    présente une de ces plages comme un objet json autonome (flux lisible par iter_flattened_batches)
+RxpkBatchBuilder:
+    construit les RecordBatch arrow au schéma RXPK_SCHEMA à partir des paquets applatis
+present_columns:
+    colonnes de RXPK_SCHEMA qui ont au moins une valeur dans des fichiers applatis
 """
 
 
 import os
-import ijson
-import pandas as pd
+import re
+import json
+import numpy as np
 import pyarrow as pa
 import pyarrow.parquet as pq
-from decimal import Decimal
-def flatten_datas(file: str, output_dir: str, chunk_size=100_000):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
+from .jsonParser import iter_packets
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+def flatten_packet(packet) -> dict | None:
+    """
+    Docstring for flatten_packet
+    Applatit un paquet (rxpk et stat remontés au premier niveau)
+
+    :param packet: paquet tel que lu dans le json
+    :return: dictionnaire applati ou None si le paquet n'a pas de rxpk
+    :rtype: dict | None
+    """
+    if not isinstance(packet, dict):
+        return None
+    # Vérifier si rxpk existe et n'est pas vide
+    has_rxpk = "rxpk" in packet and isinstance(packet["rxpk"], list) and len(packet["rxpk"]) > 0
+    if not has_rxpk:
+        return None
+
+    flat = {}
+    for k, v in packet.items():
+        if k == "rxpk":
+            for rk, rv in packet["rxpk"][0].items():
+                flat[rk] = rv
+        elif k == "stat" and isinstance(v, dict):
+            for sk, sv in v.items():
+                flat[sk] = sv
+        elif k != "stat":
+            flat[k] = v
+    return flat
+
+# Schéma déclaré des paquets applatis (champs ELK + rxpk + stat de la gateway)
+# les types sont fixés une fois pour toutes: le schéma du ParquetWriter ne dépend plus du premier chunk
+# les clés inconnues sont regroupées en json dans la colonne "extra"
+# une colonne toujours vide (clé absente de tout le json) n'est pas rangée dans les partitions (cf present_columns)
+RXPK_SCHEMA = pa.schema(sorted([
+    # champs ajoutés par le serveur / ELK
+    pa.field("@timestamp", pa.string()),
+    pa.field("GW_EUI", pa.string()),
+    pa.field("Type", pa.string()),
+    pa.field("Dev_Add", pa.string()),
+    pa.field("Dev_EUI", pa.string()),
+    pa.field("SF", pa.int64()),
+    pa.field("Bandwidth", pa.int64()),
+    pa.field("BitRate", pa.float64()),
+    pa.field("Coding_rate", pa.string()),
+    pa.field("Airtime", pa.float64()),
+    pa.field("Raw_pckt", pa.string()),
+    # rxpk (protocole Semtech UDP)
+    pa.field("time", pa.string()),
+    pa.field("tmst", pa.int64()),
+    pa.field("tmms", pa.int64()),
+    pa.field("chan", pa.int64()),
+    pa.field("rfch", pa.int64()),
+    pa.field("freq", pa.float64()),
+    pa.field("stat", pa.int64()),
+    pa.field("modu", pa.string()),
+    pa.field("datr", pa.string()), #"SF7BW125" en LoRa mais un entier en FSK
+    pa.field("codr", pa.string()),
+    pa.field("rssi", pa.int64()),
+    pa.field("rssis", pa.int64()),
+    pa.field("lsnr", pa.float64()),
+    pa.field("foff", pa.int64()),
+    pa.field("size", pa.int64()),
+    pa.field("data", pa.string()),
+    pa.field("brd", pa.int64()),
+    pa.field("ant", pa.int64()),
+    # stat de la gateway
+    pa.field("lati", pa.float64()),
+    pa.field("long", pa.float64()),
+    pa.field("alti", pa.int64()),
+    pa.field("rxnb", pa.int64()),
+    pa.field("rxok", pa.int64()),
+    pa.field("rxfw", pa.int64()),
+    pa.field("ackr", pa.float64()),
+    pa.field("dwnb", pa.int64()),
+    pa.field("txnb", pa.int64()),
+    pa.field("extra", pa.string()),
+], key=lambda field: field.name))
+
+def _as_int(v):
+    if type(v) is int:
+        return v
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return None
+    return int(v) if v.is_integer() else None #pas d'arrondi: une valeur non entière (ex: 7.5) est manquante
+
+def _as_float(v):
+    try:
+        return v if type(v) is float else float(v)
+    except (TypeError, ValueError):
+        return None
+
+def _as_str(v):
+    return v if type(v) is str else json.dumps(v, default=float)
+
+_CONVERTERS = {pa.int64(): _as_int, pa.float64(): _as_float, pa.string(): _as_str}
+
+def present_columns(files: list, keep=()) -> list:
+    """
+    Docstring for present_columns
+    Le schéma déclaré sert à typer les clés du json, pas à en ajouter: une colonne nulle dans tous les fichiers
+    (clé absente du json brut) est écartée, les données rangées ont les mêmes colonnes qu'avant le schéma déclaré
+    D'après les statistiques parquet: aucune donnée n'est lue
+
+    :param files: fichiers parquet au schéma RXPK_SCHEMA
+    :type files: list
+    :param keep: colonnes gardées même vides (attributs du nettoyage, dont les paquets sans valeur sont retirés)
+    :return: colonnes avec au moins une valeur, dans l'ordre du schéma (@timestamp, Type et keep toujours comprises)
+    :rtype: list
+    """
+    remplies = {"@timestamp", "Type", *keep}
+    for file in files:
+        metadata = pq.read_metadata(file)
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            for j in range(row_group.num_columns):
+                column = row_group.column(j)
+                stats = column.statistics
+                if stats is None or not stats.has_null_count or stats.null_count < column.num_values:
+                    remplies.add(column.path_in_schema)
+    return [name for name in RXPK_SCHEMA.names if name in remplies]
+
+class RxpkBatchBuilder:
+    """
+    Docstring for RxpkBatchBuilder
+    Accumule les paquets applatis colonne par colonne (une liste typée par champ de RXPK_SCHEMA)
+    et les rend sous forme de RecordBatch arrow, sans passer par pandas
+    """
+    def __init__(self, schema: pa.Schema = RXPK_SCHEMA):
+        self.schema = schema
+        self._fields = [(field.name, _CONVERTERS[field.type]) for field in schema if field.name != "extra"]
+        self._columns = {name: [] for name in schema.names}
+        self._extra = self._columns["extra"]
+
+    def __len__(self):
+        return len(self._extra)
+
+    def append(self, flat: dict):
+        for name, convert in self._fields:
+            v = flat.pop(name, None)
+            self._columns[name].append(None if v is None else convert(v))
+        # ce qui reste n'est pas dans le schéma
+        self._extra.append(json.dumps(flat, default=float) if flat else None)
+
+    def flush(self) -> pa.RecordBatch:
+        arrays = [pa.array(self._columns[field.name], type=field.type) for field in self.schema]
+        for column in self._columns.values():
+            column.clear()
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+def iter_flattened_batches(f, chunk_size: int = 100_000, ndjson: bool | None = None):
+    """
+    Docstring for iter_flattened_batches
+    Applatit les paquets lus dans le flux f et les rend par RecordBatch de chunk_size lignes au plus
+
+    :param f: flux (objet avec read)
+    :param chunk_size: nombre de paquets par batch
+    :type chunk_size: int
+    :param ndjson: format du flux (None: détecté, voir jsonParser.iter_packets)
+    :type ndjson: bool | None
+    :return: générateur de RecordBatch au schéma RXPK_SCHEMA
+    """
+    builder = RxpkBatchBuilder()
+    for packet in iter_packets(f, ndjson):
+        flat = flatten_packet(packet)
+        if flat is None:
+            continue
+        builder.append(flat)
+
+        if len(builder) >= chunk_size:
+            yield builder.flush()
+
+    # flush final
+    if len(builder):
+        yield builder.flush()
+
+class ShardReader:
+    """
+    Flux binaire qui présente la plage [start,end) du fichier comme un objet json autonome: {plage}
+    """
+    def __init__(self, file_path: str, start: int, end: int):
+        self.f = open(file_path, "rb")
+        self.f.seek(start)
+        self.remaining = end - start
+        self.prefix = b"{"
+        self.suffix = b"}"
+
+    def read(self, size=-1):
+        if size == 0: #ijson appelle read(0) pour savoir si le flux est binaire
+            return b""
+        if size is None or size < 0:
+            size = self.remaining + 2
+        out = b""
+        if self.prefix:
+            out, self.prefix = self.prefix, b""
+            size -= 1
+        if size > 0 and self.remaining > 0:
+            data = self.f.read(min(size, self.remaining))
+            self.remaining -= len(data)
+            if not data: #fichier tronqué
+                self.remaining = 0
+            out += data
+            size -= len(data)
+        if size > 0 and self.remaining == 0 and self.suffix:
+            out += self.suffix
+            self.suffix = b""
+        return out
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_BACKSLASHES = re.compile(rb'\\+')
+
+def find_shard_offsets(file: str, nb_shards: int, block_size: int = 16 * 1024 * 1024) -> list:
+    """
+    Docstring for find_shard_offsets
+    Découpe l'objet json de premier niveau du fichier en plages d'octets qui contiennent chacune
+    une suite de paires "clé": valeur complètes (donc parsables indépendamment une fois entourées d'accolades)
+
+    Le fichier est parcouru une fois par blocs, avec numpy pour suivre l'état (dans une chaîne ou non, profondeur)
+    sans passer par un vrai parseur json
+
+    :param file: chemin du json brut
+    :type file: str
+    :param nb_shards: nombre de plages voulues (on peut en obtenir moins si le fichier est petit)
+    :type nb_shards: int
+    :param block_size: taille des blocs lus
+    :type block_size: int
+    :return: liste de (debut, fin) en octets, fin exclue
+    :rtype: list
+    """
     file_path = os.path.join(script_dir, file)
+    size = os.path.getsize(file_path)
+    targets = [size * i // nb_shards for i in range(1, nb_shards)]
+
+    in_string = False
+    depth = 0
+    escape_carry = False #le dernier octet du bloc précédent est un backslash non échappé
+    start = None #position juste après l'accolade ouvrante
+    end = None #position de l'accolade fermante
+    cuts = []
+    offset = 0
+
+    with open(file_path, "rb") as f:
+        while end is None:
+            block = f.read(block_size)
+            if not block:
+                break
+            n = len(block)
+            # caractères échappés (les backslash n'existent que dans des chaînes en json)
+            escaped = set()
+            next_carry = False
+            for m in _BACKSLASHES.finditer(block):
+                longueur = m.end() - m.start()
+                if m.start() == 0 and escape_carry:
+                    longueur += 1
+                if longueur % 2 == 1:
+                    if m.end() < n:
+                        escaped.add(m.end())
+                    else:
+                        next_carry = True
+            if escape_carry and not block.startswith(b"\\"):
+                escaped.add(0)
+            escape_carry = next_carry
+
+            arr = np.frombuffer(block, dtype=np.uint8)
+            pos = np.flatnonzero(np.isin(arr, np.frombuffer(b'{}[],"', dtype=np.uint8)))
+            if escaped:
+                pos = pos[~np.isin(pos, np.fromiter(escaped, dtype=np.int64))]
+            chars = arr[pos]
+            is_quote = chars == ord('"')
+            # nombre de guillemets vus avant chaque caractère (inclus) => dans une chaîne si impair
+            quotes = np.cumsum(is_quote) + (1 if in_string else 0)
+            outside = (quotes % 2 == 0) & ~is_quote
+            pos = pos[outside]
+            chars = chars[outside]
+            delta = np.zeros(len(chars), dtype=np.int64)
+            delta[(chars == ord('{')) | (chars == ord('['))] = 1
+            delta[(chars == ord('}')) | (chars == ord(']'))] = -1
+            depths = depth + np.cumsum(delta) #profondeur après chaque caractère
+            if start is None:
+                opening = np.flatnonzero(depths == 1)
+                if len(opening):
+                    start = offset + int(pos[opening[0]]) + 1
+            commas = pos[(chars == ord(',')) & (depths == 1)] + offset
+            while targets and len(commas):
+                i = np.searchsorted(commas, targets[0])
+                if i == len(commas):
+                    break
+                cut = int(commas[i])
+                if not cuts or cut > cuts[-1]:
+                    cuts.append(cut)
+                targets.pop(0)
+            closing = np.flatnonzero((depths == 0) & (delta == -1))
+            if len(closing):
+                end = offset + int(pos[closing[0]])
+
+            if len(is_quote):
+                in_string = bool(quotes[-1] % 2)
+            if len(depths):
+                depth = int(depths[-1])
+            offset += n
 
-    def convert_decimal(obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return obj
-
-    buffer = []
-    all_columns = set()  # Collecter TOUTES les colonnes de TOUS les chunks
-    parquet_writer = None
-
-    with open(file_path, "r", encoding="utf-8") as f:
-        objects = ijson.kvitems(f, "")
-
-        for _, packet in objects:
-            if not isinstance(packet, dict):
-                continue
-
-            flat = {}
-            
-            # Vérifier si rxpk existe et n'est pas vide
-            has_rxpk = "rxpk" in packet and isinstance(packet["rxpk"], list) and len(packet["rxpk"]) > 0
-            
-            for k, v in packet.items():
-                if k == "rxpk" and has_rxpk:
-                    for rk, rv in packet["rxpk"][0].items():
-                        flat[rk] = convert_decimal(rv)
-                elif k == "stat" and isinstance(v, dict):
-                    for sk, sv in v.items():
-                        flat[sk] = convert_decimal(sv)
-                elif k not in ("rxpk", "stat"):
-                    flat[k] = convert_decimal(v)
-            
-            if has_rxpk:
-                all_columns.update(flat.keys())  # ← Ajouter TOUTES les colonnes rencontrées
-                buffer.append(flat)
-
-            if len(buffer) >= chunk_size:
-                df = pd.DataFrame(buffer)
-                
-                # S'assurer que TOUTES les colonnes sont présentes
-                for col in all_columns:
-                    if col not in df.columns:
-                        df[col] = None
-                
-                # Trier pour cohérence
-                df = df[sorted(all_columns)]
-                
-                table = pa.Table.from_pandas(df, preserve_index=False)
-
-                if parquet_writer is None:
-                    parquet_writer = pq.ParquetWriter(
-                        output_dir,
-                        table.schema,
-                        compression="zstd"
-                    )
-
-                parquet_writer.write_table(table)
-                buffer.clear()
-
-        # flush final
-        if buffer:
-            df = pd.DataFrame(buffer)
-            
-            for col in all_columns:
-                if col not in df.columns:
-                    df[col] = None
-            
-            df = df[sorted(all_columns)]
-
-            table = pa.Table.from_pandas(df, preserve_index=False)
-            
-            if parquet_writer is None:
-                parquet_writer = pq.ParquetWriter(
-                    output_dir,
-                    table.schema,
-                    compression="zstd"
-                )
-            
-            parquet_writer.write_table(table)
-
-        if parquet_writer:
-            parquet_writer.close()
\ No newline at end of file
+    if start is None or end is None:
+        raise ValueError(f"{file_path} ne contient pas un objet json valide")
+    cuts = [c for c in cuts if c < end]
+    bornes = [start - 1] + cuts + [end]
+    return [(bornes[i] + 1, bornes[i + 1]) for i in range(len(bornes) - 1)]
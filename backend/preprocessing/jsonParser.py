@@ -0,0 +1,130 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.jsonParser
+
+Choix du parseur json le plus rapide disponible, utilisé par le flatten et par les anciens chargeurs (clustering)
+- objet json en flux: ijson avec le backend C yajl2_c si possible, sinon le backend python
+  les nombres sont rendus en float directement (use_float), pas de Decimal à convertir ensuite
+- json entier ou NDJSON (une ligne = un paquet): orjson si installé, sinon json de la bibliothèque standard
+
+Fonctions:
+loads:
+    décode un document json (bytes ou str)
+is_ndjson:
+    détecte à partir du début d'un fichier s'il s'agit de NDJSON
+iter_packets:
+    rend les paquets d'un flux binaire (objet {id: paquet} ou NDJSON) un par un
+load_json:
+    charge un fichier json entier, ou la liste de ses lignes si c'est du NDJSON
+"""
+import json
+import ijson
+from .rawInput import open_raw, Prefixed
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    orjson = None
+    loads = json.loads
+
+def _ijson_backend():
+    for name in ("yajl2_c", "yajl2_cffi", "yajl2", "python"):
+        try:
+            return ijson.get_backend(name)
+        except ImportError:
+            continue
+    return ijson
+
+IJSON_BACKEND = _ijson_backend()
+SNIFF_SIZE = 64 * 1024
+
+def is_ndjson(head: bytes) -> bool:
+    """
+    Docstring for is_ndjson
+    La première ligne d'un NDJSON est un objet json complet suivi d'autres lignes,
+    alors que celle d'un objet json (indenté ou sur une seule ligne) ne se décode pas seule ou est le fichier entier
+
+    :param head: début du fichier (SNIFF_SIZE octets)
+    :type head: bytes
+    :rtype: bool
+    """
+    premiere, sep, reste = head.lstrip().partition(b"\n")
+    if not sep or not reste.strip():
+        return False
+    try:
+        return isinstance(loads(premiere), dict)
+    except ValueError:
+        return False
+
+def _iter_lines(lignes):
+    for ligne in lignes:
+        ligne = ligne.strip()
+        if not ligne:
+            continue
+        try:
+            yield loads(ligne)
+        except ValueError:
+            continue #ligne invalide ignorée, comme le faisaient les chargeurs json lines
+
+def iter_packets(f, ndjson: bool | None = None):
+    """
+    Docstring for iter_packets
+    Rend les paquets du flux binaire f un par un
+    objet json {id: paquet}: les valeurs de premier niveau, NDJSON: une ligne décodée par paquet
+
+    :param f: flux binaire (objet avec read)
+    :param ndjson: format du flux, None: détecté sur les premiers octets
+    :type ndjson: bool | None
+    :return: générateur de paquets (dict pour les paquets valides)
+    """
+    head = b""
+    while len(head) < SNIFF_SIZE:
+        morceau = f.read(SNIFF_SIZE - len(head))
+        if not morceau:
+            break
+        head += morceau
+    stream = Prefixed(head, f)
+    if ndjson is None:
+        ndjson = is_ndjson(head)
+    if ndjson:
+        reste = b""
+        while True:
+            morceau = stream.read(1024 * 1024)
+            if not morceau:
+                break
+            lignes = (reste + morceau).split(b"\n")
+            reste = lignes.pop()
+            yield from _iter_lines(lignes)
+        yield from _iter_lines([reste])
+        return
+    for _, packet in IJSON_BACKEND.kvitems(stream, "", use_float=True):
+        yield packet
+
+def load_json(path: str):
+    """
+    Docstring for load_json
+    Charge le fichier path (éventuellement compressé) en entier
+
+    :param path: chemin du fichier
+    :type path: str
+    :return: le document json décodé, ou la liste des objets des lignes valides si ce n'est pas un json valide (NDJSON)
+    """
+    with open_raw(path) as f:
+        content = f.read()
+    try:
+        return loads(content)
+    except ValueError:
+        return list(_iter_lines(content.splitlines()))
@@ -0,0 +1,176 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.manifest
+
+Catalogue des partitions du dataset: Data/_manifest.json (ignoré par les lectures du dataset comme tout fichier commençant par "_")
+Pour chaque partition: chemin du fichier, nombre de paquets, taille, @timestamp min et max, schéma des colonnes et hash du pied de page
+(taille, date de modification et métadonnées des row groups, statistiques comprises: change dès que le contenu change, sans relire les données)
+Mis à jour à chaque écriture de partition (cf store.py), y compris depuis les processus du pool: les mises à jour passent par un verrou
+et le fichier est remplacé d'un coup, une lecture voit toujours un catalogue complet
+
+Fonctions:
+partition_entry:
+    description d'un fichier de partition (lue dans son pied de page parquet)
+load:
+    catalogue, None s'il n'existe pas encore
+update:
+    remplace ou supprime l'entrée d'une partition
+write:
+    écrit un catalogue complet (reconstruction)
+rebuild:
+    recalcule tout le catalogue sous le verrou
+"""
+import contextlib
+import hashlib
+import json
+import os
+import pyarrow.parquet as pq
+try:
+    import fcntl
+except ImportError: #Windows: pas de verrou entre processus
+    fcntl = None
+
+MANIFEST_FILE = "_manifest.json"
+LOCK_FILE = "_manifest.lock"
+VERSION = 1
+
+def partition_key(year: int, month: int, Type: str) -> str:
+    return f"{int(year)}/{int(month)}/{Type}"
+
+def _hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    stat = os.stat(path)
+    h.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(path, "rb") as f: #fin du fichier parquet: pied de page, sa longueur (4 octets) puis "PAR1"
+        f.seek(-8, os.SEEK_END)
+        longueur = int.from_bytes(f.read(4), "little")
+        f.seek(-8 - longueur, os.SEEK_END)
+        h.update(f.read(longueur))
+    return h.hexdigest()
+
+def _bornes(metadata, colonne: str):
+    """
+    min et max de colonne d'après les statistiques des row groups, None si elles manquent
+    """
+    mini = maxi = None
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            if column.path_in_schema != colonne:
+                continue
+            stats = column.statistics
+            if stats is None or not stats.has_min_max:
+                return None, None
+            mini = stats.min if mini is None else min(mini, stats.min)
+            maxi = stats.max if maxi is None else max(maxi, stats.max)
+    return mini, maxi
+
+def partition_entry(path: str, year: int, month: int, Type: str, data_dir: str) -> dict:
+    """
+    Docstring for partition_entry
+    Tout vient du pied de page du fichier: aucune donnée n'est lue
+
+    :param path: fichier parquet de la partition
+    :type path: str
+    :rtype: dict
+    """
+    fichier = pq.ParquetFile(path)
+    mini, maxi = _bornes(fichier.metadata, "@timestamp")
+    return {
+        "path": os.path.relpath(path, data_dir).replace(os.sep, "/"),
+        "year": int(year),
+        "month": int(month),
+        "Type": Type,
+        "rows": fichier.metadata.num_rows,
+        "bytes": os.path.getsize(path),
+        "min_timestamp": mini.isoformat() if mini is not None else None,
+        "max_timestamp": maxi.isoformat() if maxi is not None else None,
+        "schema": [[field.name, str(field.type)] for field in fichier.schema_arrow],
+        "hash": _hash(path),
+    }
+
+def load(data_dir: str) -> dict | None:
+    """
+    Docstring for load
+
+    :return: {clé "année/mois/Type": entrée}, None si le catalogue n'existe pas ou n'est pas lisible
+    :rtype: dict | None
+    """
+    try:
+        with open(os.path.join(data_dir, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != VERSION:
+        return None
+    return manifest["partitions"]
+
+@contextlib.contextmanager
+def _locked(data_dir: str):
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(data_dir, LOCK_FILE), "a") as verrou:
+        if fcntl is not None:
+            fcntl.flock(verrou, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(verrou, fcntl.LOCK_UN)
+
+def _write(data_dir: str, partitions: dict):
+    tmp = os.path.join(data_dir, f".{MANIFEST_FILE}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": VERSION, "partitions": dict(sorted(partitions.items()))}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(data_dir, MANIFEST_FILE))
+
+def update(data_dir: str, key: str, entry: dict | None, rebuild=None):
+    """
+    Docstring for update
+
+    :param key: cf partition_key
+    :param entry: nouvelle entrée (cf partition_entry) ou None pour retirer la partition
+    :param rebuild: fonction sans argument qui rend toutes les entrées, appelée si le catalogue n'existe pas encore
+    """
+    with _locked(data_dir):
+        partitions = load(data_dir)
+        if partitions is None:
+            partitions = rebuild() if rebuild is not None else {}
+        if entry is None:
+            partitions.pop(key, None)
+        else:
+            partitions[key] = entry
+        _write(data_dir, partitions)
+
+def write(data_dir: str, partitions: dict):
+    """
+    Docstring for write
+    Remplace tout le catalogue
+    """
+    with _locked(data_dir):
+        _write(data_dir, partitions)
+
+def rebuild(data_dir: str, scan) -> dict:
+    """
+    Docstring for rebuild
+    Comme write, mais les entrées sont calculées sous le verrou: aucune mise à jour d'un autre processus n'est perdue entre-temps
+
+    :param scan: fonction sans argument qui rend toutes les entrées
+    :rtype: dict
+    """
+    with _locked(data_dir):
+        partitions = scan()
+        _write(data_dir, partitions)
+    return partitions
@@ -14,9 +14,16 @@
 """
 Docstring for backend.preprocessing.netId
 a pour but d'identifier de quel opérateur provient un paquet
+
+L'index des opérateurs est construit une seule fois à l'import: l'espace des DevAddr (32 bits) est découpé
+en intervalles disjoints triés, chacun attribué au préfixe le plus long qui le contient (/7, /15, /22, /25...)
+un paquet est ensuite rattaché à son opérateur avec un np.searchsorted, sans boucle python par paquet
 """
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import os
+from .RawParsing import string_buffer
 script_dir=os.path.dirname(os.path.abspath(__file__))
 def nwkId(DevAdd)->int:
     """
@@ -44,20 +51,70 @@ def splitPrefixLen(DevAddrPrefix:str):
 def shiftPrefix(Prefix,Longueur):
     return Prefix>>(32-Longueur)
 
+def buildOperatorIndex(file:str):
+    """
+    Docstring for buildOperatorIndex
+
+    :param file: csv des opérateurs (colonnes DevAddr Prefix et Operator)
+    :type file: str
+    :return: (bornes, opérateurs, noms) l'intervalle [bornes[i],bornes[i+1]) appartient à noms[opérateurs[i]] (-1: aucun)
+    :rtype: tuple
+    """
+    TableauOperateurs = pd.read_csv(file, sep=";", encoding="utf-8-sig")
+    prefixes=[splitPrefixLen(prefix) for prefix in TableauOperateurs["DevAddr Prefix"]]
+    noms=pa.array(TableauOperateurs["Operator"].astype(str).tolist(),type=pa.string())
+    debuts=[]
+    fins=[]
+    for prefix,longueur in prefixes:
+        taille=1<<(32-longueur)
+        debut=prefix&~(taille-1)&0xFFFFFFFF
+        debuts.append(debut)
+        fins.append(debut+taille) #exclu
+    bornes=np.unique(np.array([0]+debuts+fins,dtype=np.int64))
+    operateurs=np.full(len(bornes),-1,dtype=np.int64)
+    #du préfixe le plus court au plus long: le plus long (le plus précis) écrase les autres
+    for i in sorted(range(len(prefixes)),key=lambda i: prefixes[i][1]):
+        operateurs[np.searchsorted(bornes,debuts[i]):np.searchsorted(bornes,fins[i])]=i
+    return bornes,operateurs,noms
+
+BORNES,OPERATEURS,NOMS=buildOperatorIndex(os.path.join(script_dir,"operateursLoraWan.csv"))
+_HEX_LUT=np.full(256,255,dtype=np.uint8) #255: caractère invalide
+_HEX_LUT[np.frombuffer(b"0123456789abcdef",dtype=np.uint8)]=np.arange(16,dtype=np.uint8)
+_HEX_LUT[np.frombuffer(b"0123456789ABCDEF",dtype=np.uint8)]=np.arange(16,dtype=np.uint8)
+
+def devAddrToUint32(DevAdd:pd.Series)->tuple:
+    """
+    Docstring for devAddrToUint32
+
+    :param DevAdd: DevAddr en hexadécimal (8 caractères au plus, les zéros de tête peuvent manquer comme avec zfill)
+    :type DevAdd: pd.Series
+    :return: (valeurs uint32, valeur valide ou non)
+    :rtype: tuple
+    """
+    valid,offsets,buf=string_buffer(DevAdd)
+    buf=np.concatenate([np.zeros(8,dtype=np.uint8),buf]) #les 8 caractères qui finissent chaque ligne existent toujours
+    ends=offsets[1:]
+    lengths=ends-offsets[:-1]
+    #alignés à droite: les caractères qui précèdent la ligne sont des zéros de tête (comme avec zfill)
+    chiffres=_HEX_LUT[np.lib.stride_tricks.sliding_window_view(buf,8)[ends]]
+    dedans=np.arange(8)>=8-lengths[:,None]
+    valid=valid&(lengths>0)&(lengths<=8)&~((chiffres==255)&dedans).any(axis=1)
+    chiffres=np.where(dedans&(chiffres!=255),chiffres,0)
+    octets=np.ascontiguousarray((chiffres[:,0::2]<<4)|chiffres[:,1::2])
+    valeurs=octets.view(">u4").ravel().astype(np.uint32)
+    return valeurs,valid
+
 def addNwkOperator(df:pd.DataFrame)->pd.DataFrame:
-    df["NwkId"]=df["Dev_Add"].apply(nwkId)
-    file=os.path.join(script_dir,"operateursLoraWan.csv")
-    TableauOperateurs = pd.read_csv(file, sep=";", encoding="utf-8")
-    # Utilise zip pour séparer les tuples correctement
-    result = TableauOperateurs["DevAddr Prefix"].apply(splitPrefixLen)#je dois faire une série de tuples
-    TableauOperateurs["Prefix"] = result.apply(lambda x: x[0])
-    TableauOperateurs["longueurPrefix"] = result.apply(lambda x: x[1]) 
-    TableauOperateurs["comparaison"]=TableauOperateurs.apply(lambda ligne: ligne["Prefix"]>>(32-ligne["longueurPrefix"]),axis=1)
-    df["NwkId"] = pd.to_numeric(df["NwkId"], errors='coerce').astype('Int64') #conversion de la colonne problématique (quelques Dev_Addr sont vides)
-    #merge des tables pour associer mes clés (NwkId) aux Opérateurs
-    df=df.merge(TableauOperateurs[["comparaison","Operator"]],"left",
-                left_on="NwkId",
-                right_on="comparaison")
-    df.drop("comparaison",inplace=True,errors="ignore")
-    df.drop("NwkId",inplace=True,errors="ignore")
-    return df
\ No newline at end of file
+    """
+    Docstring for addNwkOperator
+
+    :param df: Dataframe avec la colonne Dev_Add
+    :type df: pd.DataFrame
+    :return: Dataframe avec la colonne Operator (même ordre de lignes, NA si DevAddr absent ou sans opérateur connu)
+    :rtype: DataFrame
+    """
+    valeurs,valid=devAddrToUint32(df["Dev_Add"])
+    operateurs=OPERATEURS[np.searchsorted(BORNES,valeurs,side="right")-1]
+    operateurs=pa.array(operateurs,mask=~(valid&(operateurs>=0)))
+    df["Operator"]=pd.array(NOMS.take(operateurs),dtype="string")
+    return df
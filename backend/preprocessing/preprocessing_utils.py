@@ -16,20 +16,75 @@ Fichier regroupant toutes les fonctions utiles au preprocessing des donnes
 
 By Charles Bouquet
 """
-from .flatten_datas import flatten_datas
 #from .query_elk import download_data
 from datetime import datetime
 from .txtUtils import write_log_removed
+from .rawInput import decompress_stream
+from .spill import spilled_partitions,spill_stream,flatten_to_spill,flatten_to_spill_parallel
+from .flatten_datas import present_columns
 from .RawParsing import addColAdr
 from .netId import addNwkOperator
+from .windowQuantiles import iqr_outliers,StreamingOutliers
+from .externalSort import rows_for_budget,iter_tables,external_sort,SORT_KEY
+from .store import write_partition,read_partition,iter_partition,PartitionWriter
+from .progress import report
+from .workers import process_pool
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
+import tempfile
+from itertools import chain
+from concurrent.futures import as_completed
 import matplotlib
 matplotlib.use('Agg') #backend non interactif
 import matplotlib.pyplot as plt
 #en forme de procédure pour la lisibilité
 
-def produce_dataset(df:pd.DataFrame,verbose:bool,undefined_toggle:bool,outlier_toggle:bool,duree,selected_attrs:list,fichier_sortie:str,Type:str):
+def packet_key(df:pd.DataFrame)->pd.Series:
+    """
+    Docstring for packet_key
+    Clé d'un paquet pour le dédoublonnage: hash de (@timestamp, GW_EUI, data)
+    Le même paquet reçu dans deux uploads différents a la même clé
+
+    :param df: DataFrame avec les colonnes @timestamp, GW_EUI et data
+    :type df: pd.DataFrame
+    :return: une clé (uint64) par ligne
+    :rtype: Series
+    """
+    cles=pd.DataFrame({
+        "@timestamp":pd.to_datetime(df["@timestamp"],errors="coerce",utc=True).dt.as_unit("ns").astype("int64"), #même résolution quel que soit le fichier
+        "GW_EUI":df["GW_EUI"].astype(object),
+        "data":df["data"].astype(object),
+    })
+    return pd.util.hash_pandas_object(cles,index=False)
+
+def merge_partition(df:pd.DataFrame,partition:tuple)->pd.DataFrame|None:
+    """
+    Docstring for merge_partition
+    Fusionne les nouveaux paquets avec ceux déjà enregistrés dans la partition (mode ajout)
+
+    :param df: nouveaux paquets (déjà nettoyés)
+    :type df: pd.DataFrame
+    :param partition: (année, mois, Type) de la partition existante
+    :type partition: tuple
+    :return: la partition complète à réécrire ou None si elle ne change pas (tous les paquets sont déjà présents)
+    :rtype: DataFrame | None
+    """
+    cles=packet_key(df)
+    df=df[~cles.duplicated().values] #doublons à l'intérieur du nouvel upload
+    cles=cles[~cles.duplicated()]
+    existant=read_partition(*partition)
+    if existant is None:
+        return df
+    nouveaux=df[~cles.isin(packet_key(existant)).values]
+    if nouveaux.empty:
+        return None
+    merged=pd.concat([existant,nouveaux],axis=0,join="outer",ignore_index=True)
+    return merged.sort_values("@timestamp",kind="stable",ignore_index=True)
+
+def produce_dataset(df:pd.DataFrame,verbose:bool,undefined_toggle:bool,outlier_toggle:bool,duree,selected_attrs:list,partition:tuple,append:bool=False,approx_quantiles:bool=False,logs:list|None=None):
     """
     
 
@@ -40,45 +95,173 @@ def produce_dataset(df:pd.DataFrame,verbose:bool,undefined_toggle:bool,outlier_t
     outlier_toggle: vire ou non les paquets qui ont des valeurs aberrantes
     duree: soit nombre de points pour la fenêtre glissante du calcul d'écart interquartile soit durée pour le faire (pour prendre en compte la potentielle saisonnalité des données)
     selected_attrs: la liste des attributs concernés par le nettoyage des outliers
-    fichier_sortie: chemin du fichier de sortie
+    partition: (année, mois, Type) de la partition de sortie dans Data (cf store.py)
+    append: fusionne avec la partition existante au lieu de l'écraser (les paquets déjà présents sont ignorés)
+    approx_quantiles: quartiles approchés (valeurs regroupées en classes), plus rapide pour les attributs avec beaucoup de valeurs distinctes
+    logs: si fourni, les messages de suppression y sont ajoutés au lieu d'être écrits dans logs/Removed.txt
     """
     if verbose:  print("Producing custom dataset") 
+    year,month,Type=partition
+    partition_name=f"{year}/{month} {Type}"
 
     
     if verbose: print(f"Selected attributes: {selected_attrs}") # VERBOSE affichage des attributs sélectionnés
     if undefined_toggle:
         initial_count = len(df)
         df.dropna(inplace=True,axis=0,subset=selected_attrs,how="any") #on veut trier uniquement sur les attributs renseignés
+        message=f"{Type}: Removed {initial_count - len(df)} packets with undefined values from {initial_count} initial packets.\n it is {(initial_count-len(df))*100/max(initial_count,1)} % \n\n"
         if verbose: 
-            message=f"{Type}: Removed {initial_count - len(df)} packets with undefined values from {initial_count} initial packets.\n it is {(initial_count-len(df))*100/initial_count} % \n\n"
             print(f"durée = {duree}") # VERBOSE affichage du contenu de la variable durée
             print(message) # VERBOSE affichage du nombre de paquets supprimés car attribut non défini
+        if logs is not None:
+            logs.append(message) #écrit en une fois par run_partitions
+        elif verbose:
             write_log_removed(message)
     #on marque les entrées aberrantes puis on les supprimera dans un 2nd temps
     #sinon on pourrait supprimer des valeurs qui n'étaient pas si aberrantes que ça
     df["outlier"]=False
     print(f"Index name: {df.index.name}")
     if outlier_toggle:
-        for attr in selected_attrs:
-            if pd.api.types.is_numeric_dtype(df[attr]):
-                #duree peut être soit une durée en temps "7d" soit un nombre de points
-                print("durée :",duree)
-                q1=df[attr].rolling(duree).quantile(0.25) #premier quartile  (fenêtre glissante)
-                q3=df[attr].rolling(duree).quantile(0.75)#dernier quartile (fenêtre glissante)
-                IQRange=q3-q1   #écart interquartile
-                df["outlier"]=(df["outlier"]) | (df[attr]<=(q1-1.5*IQRange)) | (df[attr]>=(q3+1.5*IQRange)) 
+        #duree peut être soit une durée en temps "7d" soit un nombre de points
+        print("durée :",duree)
+        report("outlier",partition=partition_name)
+        df=df.sort_index(kind="stable") #fenêtres glissantes sur les paquets dans l'ordre chronologique
+        #premier et dernier quartiles (fenêtre glissante) de tous les attributs numériques en une passe
+        df["outlier"]=iqr_outliers(df,selected_attrs,duree,approx_quantiles)
         df=df[~ df["outlier"]]
         
     if verbose: print(f"Remaining packets after processing: {len(df)}") # VERBOSE sauvegarde du dataset
     df.reset_index(inplace=True)
+    report("adr",partition=partition_name)
     df=addColAdr(df)
+    report("operator",partition=partition_name)
     df=addNwkOperator(df) #le merge ici MODIFIE l'index
     df.drop("outlier",axis=1,inplace=True)
     print(f"Colonnes avant sauvegarde: {df.columns.tolist()}")
-    df.to_parquet(fichier_sortie, engine="pyarrow", compression="zstd") #il faudra readJson avec orient="index"
+    if append:
+        merged=merge_partition(df,partition)
+        if merged is None:
+            print(f"{year}/{month} {Type} inchangé (aucun nouveau paquet)")
+            return df
+        df=merged
+    report("write",partition=partition_name)
+    write_partition(df,year,month,Type)
     print("custom_dataset.json generated successfully.") # VERBOSE terminé !
     return df #au cas où
 
+def _nullable_int_columns(files:list)->list:
+    """
+    Colonnes entières avec au moins une valeur manquante dans files (statistiques parquet):
+    pd.read_parquet les rend en float64, on fait la même chose morceau par morceau même si le morceau n'a pas de trou
+    """
+    colonnes=set()
+    for file in files:
+        metadata=pq.read_metadata(file)
+        for i in range(metadata.num_row_groups):
+            row_group=metadata.row_group(i)
+            for j in range(row_group.num_columns):
+                column=row_group.column(j)
+                if column.physical_type!="INT64":
+                    continue
+                stats=column.statistics
+                if stats is None or not stats.has_null_count or stats.null_count>0:
+                    colonnes.add(column.path_in_schema)
+    return sorted(colonnes)
+
+def produce_dataset_out_of_core(files:list,duree,selected_attrs:list,partition:tuple,memory_budget:int,append:bool=False,approx_quantiles:bool=False,logs:list|None=None,columns:list|None=None)->int:
+    """
+    Même traitement que produce_dataset(df,False,True,True,...) pour une partition qui ne tient pas en mémoire:
+    les fichiers applatis de la partition (cf spill.py) sont triés par @timestamp avec un tri externe,
+    puis chaque morceau trié passe dans le filtre des valeurs vides, le filtre d'outliers (la fin de la fenêtre glissante passe d'un morceau au suivant),
+    le décodage des entêtes et la recherche des opérateurs avant d'être écrit dans la partition
+    Résultat identique à produce_dataset quand les données tiennent en mémoire
+
+    files: fichiers parquet applatis de la partition, dans l'ordre d'entrée
+    memory_budget: mémoire (octets) pour un morceau, les morceaux font rows_for_budget lignes
+    columns: colonnes des fichiers à lire (None: toutes), cf present_columns
+    retourne le nombre de paquets de la partition écrite
+    """
+    year,month,Type=partition
+    partition_name=f"{year}/{month} {Type}"
+    rows=rows_for_budget(files,memory_budget)
+    float_cols=[colonne for colonne in _nullable_int_columns(files) if columns is None or colonne in columns]
+    outliers=StreamingOutliers(selected_attrs,duree,approx_quantiles)
+    initial_count=0
+    undefined_count=0
+    ts_unit=None
+    with tempfile.TemporaryDirectory(prefix="ooc_") as tmp_dir:
+        report("sort",partition=partition_name)
+        os.makedirs(os.path.join(tmp_dir,"runs"))
+        if append:
+            #clés des paquets déjà enregistrés (8 octets par paquet) pour ne garder que les nouveaux
+            cles_existantes=[packet_key(table.select(["@timestamp","GW_EUI","data"]).to_pandas()).to_numpy() for table in iter_partition(year,month,Type,rows)]
+            vues=np.unique(np.concatenate(cles_existantes)) if cles_existantes else np.zeros(0,dtype=np.uint64)
+            sortie=None #nouveaux paquets, fusionnés avec la partition à la fin
+            nouveaux_file=os.path.join(tmp_dir,"nouveaux.parquet")
+        else:
+            sortie=PartitionWriter(year,month,Type)
+        try:
+            for table in external_sort(iter_tables(files,rows,columns),os.path.join(tmp_dir,"runs"),rows):
+                df=table.drop_columns([SORT_KEY]).to_pandas()
+                if float_cols:
+                    df[float_cols]=df[float_cols].astype("float64")
+                df["@timestamp"]=pd.to_datetime(df["@timestamp"],errors="coerce",utc=True)
+                ts_unit=ts_unit or df["@timestamp"].dt.unit
+                df["@timestamp"]=df["@timestamp"].dt.as_unit(ts_unit)
+                df.set_index("@timestamp",inplace=True)
+                initial_count+=len(df)
+                df.dropna(inplace=True,axis=0,subset=selected_attrs,how="any")
+                undefined_count+=len(df)
+                report("outlier",partition=partition_name)
+                df=df[~ outliers.mask(df)]
+                df.reset_index(inplace=True)
+                report("adr",partition=partition_name)
+                df=addColAdr(df)
+                report("operator",partition=partition_name)
+                df=addNwkOperator(df)
+                if append:
+                    cles=packet_key(df).to_numpy()
+                    garder=~pd.Series(cles).duplicated().to_numpy() & ~np.isin(cles,vues)
+                    df=df[garder]
+                    vues=np.union1d(vues,cles)
+                    if df.empty:
+                        continue
+                    table=pa.Table.from_pandas(df,preserve_index=False)
+                    if sortie is None:
+                        sortie=pq.ParquetWriter(nouveaux_file,table.schema,compression="lz4")
+                    sortie.write_table(table.select(sortie.schema.names).cast(sortie.schema))
+                    continue
+                report("write",partition=partition_name)
+                sortie.write(df)
+        except BaseException:
+            if isinstance(sortie,PartitionWriter):
+                sortie.abort()
+            raise
+        if not append:
+            sortie.close()
+            nb=sortie.nb
+        elif sortie is None:
+            print(f"{partition_name} inchangé (aucun nouveau paquet)")
+            nb=None
+        else:
+            sortie.close()
+            #fusion triée (stable) de la partition existante puis des nouveaux paquets, comme merge_partition
+            report("write",partition=partition_name)
+            existant=iter_partition(year,month,Type,rows)
+            premier=next(existant,None)
+            schemas=[pq.read_schema(nouveaux_file)] if premier is None else [premier.schema,pq.read_schema(nouveaux_file)]
+            schema=pa.unify_schemas(schemas,promote_options="permissive")
+            sources=chain([] if premier is None else [premier],existant,iter_tables([nouveaux_file],rows))
+            os.makedirs(os.path.join(tmp_dir,"merge"))
+            with PartitionWriter(year,month,Type,schema=schema) as writer:
+                for table in external_sort(sources,os.path.join(tmp_dir,"merge"),rows):
+                    writer.write(table.drop_columns([SORT_KEY]))
+            nb=writer.nb
+    message=f"{Type}: Removed {initial_count - undefined_count} packets with undefined values from {initial_count} initial packets.\n it is {(initial_count-undefined_count)*100/max(initial_count,1)} % \n\n"
+    if logs is not None:
+        logs.append(message)
+    return nb
+
 
 
 def plot_timeSeries(df:pd.DataFrame,attrs:list,begin=None,end=None):
@@ -135,28 +318,108 @@ def split_df_by_month(df:pd.DataFrame):
     dic={(int(year),int(month)): sub for (year,month),sub in df.groupby([df.index.year,df.index.month])}
     return dic
 
-def prepare_data(rolling_interval,attrList:list,file):
+def prepare_data(rolling_interval,attrList:list,file,nb_workers:int=1,append:bool=False,memory_budget:int|None=None):
     """
     Crée des répertoires contenant les données rangées
+    Le json est applati et chaque paquet est rangé au fil de l'eau dans un fichier temporaire de sa partition (année, mois, Type) (cf spill.py),
+    puis chaque partition est nettoyée une fois complète: on n'a jamais plus d'une partition en mémoire par processus
+    nb_workers: si >1, le json est applati puis les partitions sont nettoyées en parallèle par nb_workers processus (None: tous les coeurs)
+    append: ajoute les paquets aux partitions existantes au lieu de les remplacer
+    memory_budget: mode hors mémoire (octets), aucune partition n'est chargée entière (cf produce_dataset_out_of_core)
     """
     #gte,lt=calcul_Gte_Lt(year,month)
     #file=download_data(gte,lt,year,month)
-    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory(prefix="spill_") as spill_dir:
+        report("flatten")
+        if nb_workers==1:
+            flatten_to_spill(file,spill_dir)
+        else:
+            flatten_to_spill_parallel(file,spill_dir,nb_workers)
+        prepare_spilled(rolling_interval,attrList,spill_dir,append,nb_workers,memory_budget)
 
-    flat_output_path=os.path.join(script_dir,"flattened","flat.parquet")
-    os.makedirs(os.path.join(script_dir,"flattened"),exist_ok=True)
-    flatten_datas(file,flat_output_path)
-    df=pd.read_parquet(flat_output_path)
-    df["@timestamp"]=pd.to_datetime(df["@timestamp"],errors="coerce",utc=True)
-    df.set_index("@timestamp",inplace=True)
-    for (year,month),monthlyDf in split_df_by_month(df).items():
-        file=flat_output_path
-        
-        dfs=sub_df_by_column(monthlyDf,"Type")
-        for Type,subDf in dfs.items():
-            os.makedirs(os.path.join(script_dir,"Data",str(year),str(month)),exist_ok=True)
-            outputFile=os.path.join(script_dir,"Data",str(year),str(month),Type+".parquet")
-            produce_dataset(subDf,False,True,True,rolling_interval,attrList,outputFile,Type)
+def prepare_stream(rolling_interval,attrList:list,stream,append:bool=False,memory_budget:int|None=None,nb_workers:int|None=1):
+    """
+    Même chose que prepare_data mais le json brut est lu au fil de l'eau dans stream (objet avec read)
+    Sert pour l'upload en streaming: le json n'est jamais écrit sur le disque
+    Le flux peut être compressé (gzip, zstd, xz, bz2), il est alors décompressé à la volée
+    nb_workers: le flux est applati par un seul processus, seules les partitions sont nettoyées en parallèle (cf run_partitions)
+    """
+    with tempfile.TemporaryDirectory(prefix="spill_") as spill_dir:
+        report("flatten")
+        spill_stream(decompress_stream(stream),spill_dir)
+        prepare_spilled(rolling_interval,attrList,spill_dir,append,nb_workers,memory_budget)
+
+def _produce_partition(key:tuple,source,rolling_interval,attrList:list,append:bool,memory_budget:int|None=None,columns:list|None=None)->tuple:
+    """
+    Travail d'un processus: nettoie et écrit une partition
+    source: DataFrame indexé par @timestamp ou liste de fichiers parquet applatis (cf spill.py)
+    memory_budget: si fourni, une partition en fichiers est traitée par morceaux (produce_dataset_out_of_core)
+    columns: colonnes des fichiers applatis à lire (None: toutes)
+    """
+    logs=[]
+    if memory_budget and not isinstance(source,pd.DataFrame):
+        nb=produce_dataset_out_of_core(source,rolling_interval,attrList,key,memory_budget,append,logs=logs,columns=columns)
+        return key,nb or 0,logs
+    if isinstance(source,pd.DataFrame):
+        df=source
+    else:
+        df=pd.concat([pd.read_parquet(f,columns=columns) for f in source],axis=0,ignore_index=True)
+        df["@timestamp"]=pd.to_datetime(df["@timestamp"],errors="coerce",utc=True)
+        df.set_index("@timestamp",inplace=True)
+    df=produce_dataset(df,False,True,True,rolling_interval,attrList,key,append,logs=logs)
+    return key,len(df),logs
+
+def _partition_size(source)->int:
+    if isinstance(source,pd.DataFrame):
+        return len(source)
+    return sum(os.path.getsize(f) for f in source)
+
+def run_partitions(partitions:dict,rolling_interval,attrList:list,append:bool=False,nb_workers:int|None=1,memory_budget:int|None=None,columns:list|None=None,verbose:bool=False):
+    """
+    Nettoie et écrit les partitions {(année, mois, Type): source} (cf _produce_partition)
+    Les partitions sont indépendantes: avec nb_workers>1 (None: tous les coeurs) elles sont réparties sur un pool de processus,
+    les plus grosses d'abord pour que la dernière à finir ne soit pas une grosse partition lancée en retard
+    verbose: les messages de suppression de chaque partition sont écrits ensemble dans logs/Removed.txt à la fin
+    (comme produce_dataset, rien n'est écrit sans verbose)
+    memory_budget: budget total du mode hors mémoire, partagé entre les processus
+    columns: colonnes des fichiers applatis à lire (None: toutes)
+    """
+    ordre=sorted(partitions,key=lambda key: _partition_size(partitions[key]),reverse=True)
+    total=len(ordre)
+    nb_processus=1 if nb_workers==1 or total<=1 else min(nb_workers or os.cpu_count() or 1,total)
+    if memory_budget:
+        memory_budget=memory_budget//nb_processus
+    logs={}
+    report("partitions",done=0,total=total) #fin de la lecture des paquets bruts
+    def progression(i,key,nb):
+        year,month,Type=key
+        print(f"[{i}/{total}] {year}/{month} {Type}: {nb} paquets écrits")
+        report("partitions",done=i,total=total)
+
+    if nb_processus==1:
+        for i,key in enumerate(ordre,1):
+            _,nb,logs[key]=_produce_partition(key,partitions[key],rolling_interval,attrList,append,memory_budget,columns)
+            progression(i,key,nb)
+    else:
+        with process_pool(nb_processus) as executor:
+            futures=[executor.submit(_produce_partition,key,partitions[key],rolling_interval,attrList,append,memory_budget,columns) for key in ordre]
+            for i,future in enumerate(as_completed(futures),1):
+                key,nb,logs[key]=future.result()
+                progression(i,key,nb)
+
+    messages=[f"{year}/{month} {message}" for (year,month,Type) in sorted(logs) for message in logs[(year,month,Type)]]
+    if verbose and messages:
+        write_log_removed("".join(messages))
+
+def prepare_spilled(rolling_interval,attrList:list,spill_dir:str,append:bool=False,nb_workers:int|None=1,memory_budget:int|None=None):
+    """
+    Range les données déjà réparties par partition dans spill_dir (cf spill.py)
+    Chaque partition est lue par le processus qui la traite: une seule partition par processus en mémoire
+    (ou un morceau de memory_budget octets en mode hors mémoire)
+    """
+    partitions=spilled_partitions(spill_dir)
+    colonnes=present_columns([file for files in partitions.values() for file in files],attrList) #colonnes vides dans tout le json écartées de toutes les partitions
+    run_partitions(partitions,rolling_interval,attrList,append,nb_workers,memory_budget,colonnes)
 
 def open_df_flattened(fichier:str)->pd.DataFrame:
     """
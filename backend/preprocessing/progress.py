@@ -0,0 +1,53 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.progress
+
+Avancement du prétraitement: les étapes appellent report, ce qui ne fait rien tant qu'aucun rapporteur n'est installé
+(utilisation en script) et transmet l'avancement au serveur quand le prétraitement tourne dans un job (cf server/jobs.py)
+
+Étapes: flatten, sort (mode hors mémoire), outlier, adr, operator, write (+ partitions: nombre de partitions terminées)
+
+Fonctions:
+set_reporter:
+    installe la fonction qui reçoit l'avancement (None pour l'enlever)
+get_reporter:
+    rapporteur installé (transmis aux processus des pools, cf workers.py)
+report:
+    signale le début d'une étape
+"""
+_reporter = None
+
+def set_reporter(reporter):
+    """
+    Docstring for set_reporter
+
+    :param reporter: fonction appelée avec un dict {"stage": ..., ...} ou None
+    """
+    global _reporter
+    _reporter = reporter
+
+def get_reporter():
+    return _reporter
+
+def report(stage: str, **infos):
+    """
+    Docstring for report
+
+    :param stage: étape qui commence
+    :type stage: str
+    :param infos: précisions (partition, done, total...)
+    """
+    if _reporter is not None:
+        _reporter({"stage": stage, **infos})
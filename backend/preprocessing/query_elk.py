@@ -1,97 +1,330 @@
-from datetime import datetime
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import scan
-#from elasticsearch_dsl import Search, Q, Date, Range, A 
-import json
+"""
+Docstring for preprocessing.query_elk
+
+Export des paquets depuis Elasticsearch
+Les hits sont récupérés par N slices en parallèle sur un point in time (PIT) triés par (@timestamp, _shard_doc),
+chaque hit est applati puis écrit directement en parquet: la mémoire utilisée est bornée par la taille
+d'une page et d'un chunk, quel que soit le nombre de paquets exportés
+
+Reprise: chaque chunk écrit est un fichier part-<slice>-<n>.parquet et la position de la slice (clé search_after
+et dernier @timestamp) est sauvegardée juste après dans _slice-<slice>.json. Relancer download_data avec les mêmes
+paramètres repart de là. Si le PIT a expiré entre temps, on en ouvre un nouveau et on repart du plus petit
+@timestamp atteint (les quelques doublons à la frontière sont supprimés par le mode append du preprocessing)
+
+Mode périodique: pull_new ne récupère que les paquets plus récents que le watermark de l'index
+(Download/_checkpoints/<index>.json) et les ajoute au dataset partitionné
+
+On parle directement l'API HTTP d'Elasticsearch (pas besoin du client elasticsearch),
+on peut donc tester l'export avec n'importe quel petit serveur HTTP qui imite _pit et _search
+
+Fonctions:
+pit_hits:
+    générateur des hits d'une slice (search_after)
+export_slice:
+    écrit une slice en parquet (paquets applatis) en sauvegardant sa position
+download_data:
+    exporte une période dans Download/<année>/<mois>/, reprend un export interrompu
+pull_new:
+    récupère les nouveaux paquets d'un index et les ajoute au dataset
+"""
 import os
+import json
+import tempfile
+import urllib.request
+import urllib.error
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from .flatten_datas import flatten_packet, RxpkBatchBuilder
+from .spill import spill_parquet
 
-def download_data(gte="2023-10-12T00:00:00",lt="2023-10-13T00:00:00",year="2023",month="octobre"):
-    es = Elasticsearch("http://abita.alias.inria.fr:9200")
-    script_dir = os.path.dirname(os.path.abspath(__file__))
+ES_URL = "http://abita.alias.inria.fr:9200"
+ES_INDEX = "loraproject1"
+SORT = [{"@timestamp": "asc"}, {"_shard_doc": "asc"}]
+script_dir = os.path.dirname(os.path.abspath(__file__))
+CHECKPOINT_DIR = os.path.join(script_dir, "Download", "_checkpoints")
 
-    query = {"query": {
-            "match_all": {}
-            }
-    }
+def _es_request(url: str, method: str, path: str, body: dict | None = None) -> dict:
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url.rstrip("/") + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            contenu = response.read()
+    except urllib.error.HTTPError as e:
+        #HTTPError garde la connexion et ne passe pas d'un processus à l'autre
+        raise OSError(f"Elasticsearch a répondu {e.code} à {method} {path}: {e.read()[:500]!r}") from None
+    return json.loads(contenu) if contenu else {}
 
-    query = {"query":{
-            "range":{
-                "@timestamp":{
-                    "gte": gte ,
-                    "lt": lt
-                    }
-                }
-            }
-    }
+def _load_json(fichier: str) -> dict | None:
+    if not os.path.exists(fichier):
+        return None
+    with open(fichier, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-    index = "loraproject1"
+def _save_json(fichier: str, contenu: dict):
+    #écriture atomique: un crash pendant l'écriture ne corrompt pas le checkpoint
+    tmp = fichier + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(contenu, f)
+    os.replace(tmp, fichier)
 
+def _slice_file(path: str, slice_id: int) -> str:
+    return os.path.join(path, f"_slice-{slice_id:05d}.json")
 
-    #resp = es.search(index=index, query=query, from_=1, size=10000)
+def _new_slice_state() -> dict:
+    return {"search_after": None, "timestamp": None, "parts": 0, "nb": 0, "nb_reboot": 0, "done": False}
 
+def open_pit(url: str, index: str, keep_alive: str = "5m") -> str:
+    return _es_request(url, "POST", f"/{index}/_pit?keep_alive={keep_alive}")["id"]
 
-    res = dict()
+def close_pit(url: str, pit_id: str):
+    try:
+        _es_request(url, "DELETE", "/_pit", {"id": pit_id})
+    except OSError:
+        pass #le PIT expirera de lui même
 
-    nb=0
+def pit_alive(url: str, pit_id: str, keep_alive: str = "5m") -> bool:
+    try:
+        _es_request(url, "POST", "/_search", {"pit": {"id": pit_id, "keep_alive": keep_alive}, "size": 0})
+        return True
+    except OSError:
+        return False
+
+def pit_hits(url: str, pit_id: str, query: dict, slice_id: int = 0, nb_slices: int = 1, search_after: list | None = None,
+             size: int = 10000, keep_alive: str = "5m"):
+    """
+    Docstring for pit_hits
+    Parcourt une slice d'un PIT avec search_after et rend les hits un par un (une seule page en mémoire)
+
+    :param url: url d'Elasticsearch
+    :type url: str
+    :param pit_id: id du point in time (ouvert avec open_pit)
+    :type pit_id: str
+    :param query: requête (partie "query" du corps de _search)
+    :type query: dict
+    :param slice_id: numéro de la slice
+    :type slice_id: int
+    :param nb_slices: nombre total de slices (1: pas de découpage)
+    :type nb_slices: int
+    :param search_after: clé de tri du dernier hit déjà traité (None: depuis le début)
+    :type search_after: list | None
+    :param size: nombre de hits par page
+    :type size: int
+    """
+    body = {"pit": {"id": pit_id, "keep_alive": keep_alive}, "size": size, "query": query, "sort": SORT}
+    if nb_slices > 1:
+        body["slice"] = {"id": slice_id, "max": nb_slices}
+    while True:
+        if search_after is not None:
+            body["search_after"] = search_after
+        resp = _es_request(url, "POST", "/_search", body)
+        body["pit"]["id"] = resp.get("pit_id", body["pit"]["id"]) #l'id du PIT peut changer d'une réponse à l'autre
+        hits = resp.get("hits", {}).get("hits", [])
+        if not hits:
+            return
+        yield from hits
+        search_after = hits[-1]["sort"]
+
+def export_slice(url: str, pit_id: str, query: dict, slice_id: int, nb_slices: int, path: str,
+                 chunk_size: int = 100_000, keep_alive: str = "5m") -> tuple:
+    """
+    Docstring for export_slice
+    Exporte une slice dans path (paquets applatis au schéma RXPK_SCHEMA), un fichier par chunk
+    La position est sauvegardée après chaque chunk, une slice interrompue reprend au chunk suivant
+
+    :return: (nombre de paquets écrits, nombre de RebootGW ignorés)
+    :rtype: tuple
+    """
+    state_file = _slice_file(path, slice_id)
+    state = _load_json(state_file) or _new_slice_state()
+    if state["done"]:
+        return state["nb"], state["nb_reboot"]
+    builder = RxpkBatchBuilder()
+    dernier = None
     nb_reboot = 0
-    resp = scan(client=es, query=query, index=index, scroll="5m", size=10000)
 
-    for h in resp:
-        if nb == 0:
-            print(h)
+    def checkpoint():
+        nonlocal nb_reboot
+        if len(builder):
+            nom = f"part-{slice_id:05d}-{state['parts']:05d}.parquet"
+            tmp = os.path.join(path, "." + nom) #ignoré par read_parquet tant qu'il n'est pas renommé
+            state["nb"] += len(builder)
+            pq.write_table(pa.Table.from_batches([builder.flush()]), tmp, compression="zstd")
+            os.replace(tmp, os.path.join(path, nom))
+            state["parts"] += 1
+        if dernier is not None:
+            state["search_after"] = dernier["sort"]
+            state["timestamp"] = dernier.get("_source", {}).get("@timestamp", state["timestamp"])
+        state["nb_reboot"] += nb_reboot
+        nb_reboot = 0
+        _save_json(state_file, state)
 
-        d= h["_source"]
+    for hit in pit_hits(url, pit_id, query, slice_id, nb_slices, state["search_after"], keep_alive=keep_alive):
+        dernier = hit
+        d = hit.get("_source")
+        if not isinstance(d, dict):
+            continue
         if "RebootGW" in d:
             nb_reboot += 1
-        else:
-            nb += 1
-            gw = d["GW_EUI"]
-            ts = d["@timestamp"]
-            res[ts] = res.get(ts, [])
-            res[ts].append(d)
-
-            if nb%10000 == 0:
-                print(nb//10000, "* 10 000 éléments")
-            if nb%1000000 == 0:
-                print(nb,"éléments => création fichier")
-                with open(f"res_{nb//1000000}.json", "w") as f:
-                    json.dump(res, f, sort_keys=True, indent=4)
-                res=dict()
-
-    print(nb,"-",len(res),"éléments au total (nb_reboot =",nb_reboot,")")
-
-    path=os.path.join(script_dir,f"./Download/{year}")
-    os.makedirs(path,exist_ok=True)
-    filepath=os.path.join(path,month)
-    with open(filepath, "w") as f:
-        json.dump(res, f, sort_keys=True, indent=4)
-    
-    return filepath
+            continue
+        flat = flatten_packet(d)
+        if flat is None:
+            continue
+        builder.append(flat)
+        if len(builder) >= chunk_size:
+            checkpoint()
+            print(f"slice {slice_id}: {state['nb']} éléments")
+    state["done"] = True
+    checkpoint()
+    return state["nb"], state["nb_reboot"]
 
-"""
-tranche = 1000
-res = []
+def _truncate_parts(path: str, depuis: str) -> dict:
+    """
+    Retire des fichiers exportés les paquets dont @timestamp >= depuis (ils vont être réexportés)
+    :return: {numéro de slice: nombre de paquets gardés}
+    """
+    limite = pd.Timestamp(depuis)
+    limite = limite.tz_localize("UTC") if limite.tzinfo is None else limite
+    gardes = {}
+    for nom in sorted(os.listdir(path)):
+        if not (nom.startswith("part-") and nom.endswith(".parquet")):
+            continue
+        fichier = os.path.join(path, nom)
+        table = pq.read_table(fichier)
+        avant = (pd.to_datetime(table.column("@timestamp").to_pandas(), errors="coerce", utc=True) < limite).to_numpy()
+        if not avant.any():
+            os.remove(fichier)
+            continue
+        if not avant.all():
+            tmp = os.path.join(path, "." + nom)
+            pq.write_table(table.filter(pa.array(avant)), tmp, compression="zstd")
+            os.replace(tmp, fichier)
+        slice_id = int(nom.split("-")[1])
+        gardes[slice_id] = gardes.get(slice_id, 0) + int(avant.sum())
+    return gardes
+
+def download_data(gte="2023-10-12T00:00:00", lt="2023-10-13T00:00:00", year="2023", month="octobre",
+                  nb_slices: int = 4, url: str = ES_URL, index: str = ES_INDEX, output_dir: str | None = None,
+                  resume: bool = True, keep_alive: str = "5m") -> str:
+    """
+    Docstring for download_data
+    Exporte les paquets dont @timestamp est dans [gte, lt[ avec nb_slices slices en parallèle
+    Si un export avec les mêmes paramètres a été interrompu dans output_dir, il est repris (sauf resume=False)
 
+    :param output_dir: répertoire de sortie, Download/<année>/<mois> par défaut
+    :type output_dir: str | None
+    :return: répertoire contenant les fichiers parquet (se lit avec pd.read_parquet ou spill.spill_parquet)
+    :rtype: str
+    """
+    path = output_dir or os.path.join(script_dir, "Download", str(year), str(month))
+    os.makedirs(path, exist_ok=True)
+    run_file = os.path.join(path, "_checkpoint.json")
+    params = {"index": index, "gte": gte, "lt": lt, "nb_slices": nb_slices}
+    run = _load_json(run_file) if resume else None
 
+    if run is None or run["params"] != params:
+        for f in os.listdir(path):
+            if f.endswith(".parquet") or f.endswith(".json"):
+                os.remove(os.path.join(path, f))
+        run = {"params": params, "gte": gte, "pit": open_pit(url, index, keep_alive), "done": False}
+        _save_json(run_file, run)
+    elif run["done"]:
+        print("export déjà terminé:", path)
+        return path
+    elif not pit_alive(url, run["pit"], keep_alive):
+        #les clés search_after et le découpage en slices ne valent que pour leur PIT: tout paquet antérieur au plus petit
+        #@timestamp atteint par une slice non finie est déjà exporté, la suite est supprimée des fichiers puis réexportée
+        etats = [_load_json(_slice_file(path, i)) or _new_slice_state() for i in range(nb_slices)]
+        reprises = [etat["timestamp"] for etat in etats if not etat["done"]]
+        if reprises:
+            if None not in reprises:
+                run["gte"] = min(reprises, key=pd.Timestamp)
+            gardes = _truncate_parts(path, run["gte"])
+            for i, etat in enumerate(etats):
+                etat.update(search_after=None, timestamp=None, done=False, nb=gardes.get(i, 0)) #parts inchangé: pas de nom de fichier réutilisé
+                _save_json(_slice_file(path, i), etat)
+        run["pit"] = open_pit(url, index, keep_alive)
+        _save_json(run_file, run)
+        print("PIT expiré, reprise à partir de", run["gte"])
+    else:
+        print("reprise de l'export:", path)
 
-for i in range(nb//tranche):
-    start = i*tranche
-    end = min((i+1)*tranche, nb)
-      
-    print(f"From {start} to {end}")
+    query = {
+        "range": {
+            "@timestamp": {
+                "gte": run["gte"],
+                "lt": lt
+            }
+        }
+    }
 
+    with ProcessPoolExecutor(max_workers=nb_slices) as executor:
+        futures = [executor.submit(export_slice, url, run["pit"], query, i, nb_slices, path, keep_alive=keep_alive)
+                   for i in range(nb_slices)]
+        resultats = [future.result() for future in futures]
+    close_pit(url, run["pit"])
+    run["done"] = True
+    _save_json(run_file, run)
 
-    slice = s[start:end]
+    nb = sum(r[0] for r in resultats)
+    nb_reboot = sum(r[1] for r in resultats)
+    print(nb, "éléments au total (nb_reboot =", nb_reboot, ")")
+    return path
 
+def pull_new(rolling_interval, attrList: list, since: str | None = None, overlap: timedelta = timedelta(minutes=5),
+             nb_slices: int = 4, url: str = ES_URL, index: str = ES_INDEX) -> int:
+    """
+    Docstring for pull_new
+    Récupère les paquets de index plus récents que son watermark et les ajoute au dataset (preprocessing en mode append)
+    A appeler périodiquement (cron...), un appel interrompu reprend la même période au suivant
 
-    for hit in slice.scan():    
-        res.append(hit.to_dict())
-    
-    print(len(res))
-"""
+    :param since: date de départ si l'index n'a pas encore de watermark
+    :type since: str | None
+    :param overlap: marge relue avant le watermark pour les paquets indexés en retard (les doublons sont supprimés)
+    :type overlap: timedelta
+    :return: nombre de paquets récupérés
+    :rtype: int
+    """
+    from .preprocessing_utils import prepare_spilled
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    checkpoint_file = os.path.join(CHECKPOINT_DIR, index + ".json")
+    checkpoint = _load_json(checkpoint_file) or {}
+    periode = checkpoint.get("pending")
+    if periode is None:
+        watermark = checkpoint.get("watermark") or since
+        if watermark is None:
+            raise ValueError(f"Pas de watermark pour l'index {index}: donner since pour la première récupération")
+        gte = (pd.Timestamp(watermark) - overlap).isoformat()
+        lt = datetime.now(timezone.utc).isoformat()
+        periode = checkpoint["pending"] = {"gte": gte, "lt": lt}
+        _save_json(checkpoint_file, checkpoint)
+
+    path = os.path.join(CHECKPOINT_DIR, index)
+    download_data(periode["gte"], periode["lt"], nb_slices=nb_slices, url=url, index=index, output_dir=path)
+    parts = sorted(os.path.join(path, f) for f in os.listdir(path) if f.startswith("part-") and f.endswith(".parquet"))
+    nb = 0
+    if parts:
+        with tempfile.TemporaryDirectory(prefix="spill_") as spill_dir: #une partition à la fois en mémoire, comme un upload
+            nb = spill_parquet(parts, spill_dir)
+            prepare_spilled(rolling_interval, attrList, spill_dir, append=True)
+        derniers = [etat["timestamp"] for etat in (_load_json(_slice_file(path, i)) for i in range(nb_slices))
+                    if etat and etat["timestamp"]]
+        if derniers:
+            checkpoint["last_timestamp"] = max(derniers, key=pd.Timestamp)
+
+    checkpoint["watermark"] = periode["lt"]
+    del checkpoint["pending"]
+    _save_json(checkpoint_file, checkpoint)
+    for f in os.listdir(path):
+        os.remove(os.path.join(path, f))
+    print(nb, "nouveaux paquets pour", index, "jusqu'à", periode["lt"])
+    return nb
 
 if __name__=="__main__":
     #tests
-
+    #lancer le script EN TANT QUE MODULE, sinon ça ne fonctionnera pas
     download_data()
-    pass
\ No newline at end of file
+    pass
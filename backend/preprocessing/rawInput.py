@@ -0,0 +1,141 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.rawInput
+
+Ouverture des json bruts éventuellement compressés (gzip, zstd, xz, bz2)
+La compression est détectée grâce aux premiers octets (magic bytes) et pas à l'extension,
+la décompression se fait au fil de la lecture: rien de décompressé n'est écrit sur le disque
+
+Classes:
+Prefixed:
+    flux dont les premiers octets, déjà lus pour l'inspecter, sont rendus à nouveau
+Fonctions:
+detect_compression:
+    renvoie le format de compression à partir des premiers octets
+open_raw:
+    ouvre un fichier brut en binaire, décompressé si besoin
+decompress_stream:
+    même chose pour un flux déjà ouvert (upload en cours)
+"""
+import bz2
+import gzip
+import lzma
+
+MAGIC_BYTES = {
+    "gzip": b"\x1f\x8b",
+    "zstd": b"\x28\xb5\x2f\xfd",
+    "xz": b"\xfd7zXZ\x00",
+    "bz2": b"BZh",
+}
+HEAD_SIZE = max(len(magic) for magic in MAGIC_BYTES.values())
+
+def detect_compression(head: bytes) -> str | None:
+    """
+    Docstring for detect_compression
+
+    :param head: premiers octets du fichier (au moins HEAD_SIZE)
+    :type head: bytes
+    :return: "gzip", "zstd", "xz", "bz2" ou None si le fichier n'est pas compressé
+    :rtype: str | None
+    """
+    for kind, magic in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return kind
+    return None
+
+def _zstd_open(fileobj):
+    try:
+        from compression import zstd #bibliothèque standard à partir de python 3.14
+        return zstd.ZstdFile(fileobj)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Fichier compressé en zstd mais ni compression.zstd (python>=3.14) ni zstandard ne sont disponibles")
+    if isinstance(fileobj, str):
+        return zstandard.open(fileobj, "rb")
+    return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+
+_OPENERS = {
+    "gzip": lambda f: gzip.GzipFile(filename=f) if isinstance(f, str) else gzip.GzipFile(fileobj=f),
+    "xz": lzma.LZMAFile,
+    "bz2": bz2.BZ2File,
+    "zstd": _zstd_open,
+}
+
+class Prefixed:
+    """
+    Docstring for Prefixed
+    Remet devant le flux les octets déjà lus pour l'inspecter (compression, cf decompress_stream, format json, cf jsonParser)
+    """
+    def __init__(self, head: bytes, f):
+        self.head = head
+        self.f = f
+
+    def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            return b""
+        if self.head:
+            if size is None or size < 0:
+                out, self.head = self.head + self.f.read(), b""
+            else:
+                out, self.head = self.head[:size], self.head[size:]
+            return out
+        return self.f.read(size)
+
+    def close(self):
+        close = getattr(self.f, "close", None)
+        if close:
+            close()
+
+def _read_head(f) -> bytes:
+    head = b""
+    while len(head) < HEAD_SIZE:
+        morceau = f.read(HEAD_SIZE - len(head))
+        if not morceau:
+            break
+        head += morceau
+    return head
+
+def open_raw(file_path: str):
+    """
+    Docstring for open_raw
+    Ouvre le json brut en binaire, en le décompressant à la volée s'il est compressé
+
+    :param file_path: chemin du fichier
+    :type file_path: str
+    :return: objet fichier binaire (à fermer)
+    """
+    with open(file_path, "rb") as f:
+        kind = detect_compression(_read_head(f))
+    if kind is None:
+        return open(file_path, "rb")
+    return _OPENERS[kind](file_path)
+
+def decompress_stream(f):
+    """
+    Docstring for decompress_stream
+    Enveloppe un flux binaire déjà ouvert (n'importe quel objet avec read, ex: QueueReader) pour le décompresser si besoin
+
+    :param f: flux binaire
+    :return: flux binaire décompressé
+    """
+    head = _read_head(f)
+    stream = Prefixed(head, f)
+    kind = detect_compression(head)
+    if kind is None:
+        return stream
+    return _OPENERS[kind](stream)
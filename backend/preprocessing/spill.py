@@ -0,0 +1,179 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.spill
+
+Répartition des paquets applatis par partition (année, mois, Type) dans des fichiers parquet temporaires
+au fur et à mesure de l'applatissement: on n'a jamais besoin d'avoir tout le json applati en mémoire,
+seulement une partition à la fois au moment du nettoyage
+
+Arborescence: <spill_dir>/<année>/<mois>/<Type>/<writer_id>.parquet
+plusieurs processus peuvent remplir le même spill_dir tant qu'ils ont des writer_id différents
+
+Classes:
+PartitionSpiller:
+    écrit des RecordBatch applatis dans les fichiers de leur partition
+Fonctions:
+spill_stream:
+    applatit un flux json directement dans un spill_dir
+flatten_to_spill:
+    applatit un json brut directement dans un spill_dir
+flatten_to_spill_parallel:
+    même chose sur plusieurs processus, une plage du json brut par processus
+spill_parquet:
+    range dans un spill_dir des paquets déjà applatis (export Elasticsearch)
+spilled_partitions:
+    liste les partitions d'un spill_dir et leurs fichiers
+"""
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .flatten_datas import iter_flattened_batches, find_shard_offsets, ShardReader, RXPK_SCHEMA
+from .jsonParser import is_ndjson, SNIFF_SIZE
+from .rawInput import open_raw, detect_compression, HEAD_SIZE
+from .workers import process_pool
+
+
+class PartitionSpiller:
+    """
+    Docstring for PartitionSpiller
+    Garde un ParquetWriter ouvert par partition rencontrée
+    """
+    def __init__(self, spill_dir: str, writer_id: str = "0", schema: pa.Schema = RXPK_SCHEMA):
+        self.spill_dir = spill_dir
+        self.writer_id = str(writer_id)
+        self.schema = schema
+        self.writers = {}
+        self.nb = 0
+
+    def write(self, batch: pa.RecordBatch):
+        timestamps = pd.to_datetime(batch.column("@timestamp").to_pandas(), errors="coerce", utc=True)
+        cles = pd.DataFrame({
+            "year": timestamps.dt.year,
+            "month": timestamps.dt.month,
+            "Type": batch.column("Type").to_pandas(),
+        })
+        # les paquets sans date ou sans type sont ignorés comme dans le groupby de prepare_data
+        for (year, month, Type), indices in cles.groupby(["year", "month", "Type"]).indices.items():
+            key = (int(year), int(month), Type)
+            writer = self.writers.get(key)
+            if writer is None:
+                chemin = os.path.join(self.spill_dir, str(key[0]), str(key[1]), Type)
+                os.makedirs(chemin, exist_ok=True)
+                writer = pq.ParquetWriter(os.path.join(chemin, self.writer_id + ".parquet"), self.schema, compression="zstd")
+                self.writers[key] = writer
+            writer.write_batch(batch.take(pa.array(indices)))
+            self.nb += len(indices)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def spill_stream(f, spill_dir: str, writer_id: str = "0", chunk_size: int = 100_000, ndjson: bool | None = None) -> int:
+    """
+    Docstring for spill_stream
+    Applatit les paquets du flux f et les range par partition dans spill_dir au fil de la lecture
+
+    :return: nombre de paquets rangés
+    :rtype: int
+    """
+    with PartitionSpiller(spill_dir, writer_id) as spiller:
+        for batch in iter_flattened_batches(f, chunk_size, ndjson):
+            spiller.write(batch)
+    return spiller.nb
+
+def flatten_to_spill(file: str, spill_dir: str, writer_id: str = "0", chunk_size: int = 100_000) -> int:
+    """
+    Docstring for flatten_to_spill
+    Applatit le json brut file (éventuellement compressé) et range les paquets par partition dans spill_dir
+
+    :return: nombre de paquets rangés
+    :rtype: int
+    """
+    with open_raw(file) as f:
+        return spill_stream(f, spill_dir, writer_id, chunk_size)
+
+def _spill_shard(file: str, start: int, end: int, spill_dir: str, writer_id: str, chunk_size: int) -> int:
+    """
+    Travail d'un processus: applatit une plage du json brut dans spill_dir
+    """
+    with ShardReader(file, start, end) as f:
+        return spill_stream(f, spill_dir, writer_id, chunk_size, ndjson=False)
+
+def flatten_to_spill_parallel(file: str, spill_dir: str, nb_workers: int = None, chunk_size: int = 100_000) -> int:
+    """
+    Docstring for flatten_to_spill_parallel
+    Le json brut est découpé en nb_workers plages indépendantes (cf find_shard_offsets), chaque processus range ses paquets dans spill_dir
+    (writer_id = numéro de la plage, les fichiers d'une partition se relisent donc dans l'ordre du json)
+
+    :return: nombre de paquets rangés
+    :rtype: int
+    """
+    nb_workers = nb_workers or os.cpu_count() or 1
+    with open(file, "rb") as f:
+        head = f.read(SNIFF_SIZE)
+    if detect_compression(head[:HEAD_SIZE]) is not None or is_ndjson(head):
+        # flux compressé ou NDJSON: pas de découpage en plages d'octets (le découpage sur les virgules de premier niveau ne s'applique pas au NDJSON)
+        return flatten_to_spill(file, spill_dir, chunk_size=chunk_size)
+    shards = find_shard_offsets(file, nb_workers)
+    with process_pool(nb_workers) as executor:
+        futures = [executor.submit(_spill_shard, file, start, end, spill_dir, f"{i:05d}", chunk_size)
+                   for i, (start, end) in enumerate(shards)]
+        total = sum(future.result() for future in futures)
+    print(f"{total} paquets applatis en {len(shards)} shards")
+    return total
+
+def spill_parquet(files: list, spill_dir: str, writer_id: str = "0", chunk_size: int = 100_000) -> int:
+    """
+    Docstring for spill_parquet
+    Range par partition des fichiers parquet de paquets déjà applatis (au schéma RXPK_SCHEMA, cf query_elk.export_slice),
+    chunk_size paquets à la fois: l'export n'est jamais chargé entier
+
+    :param files: fichiers parquet, rangés dans cet ordre
+    :type files: list
+    :return: nombre de paquets rangés
+    :rtype: int
+    """
+    with PartitionSpiller(spill_dir, writer_id) as spiller:
+        for file in files:
+            for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_size):
+                spiller.write(batch)
+    return spiller.nb
+
+def spilled_partitions(spill_dir: str) -> dict:
+    """
+    Docstring for spilled_partitions
+
+    :param spill_dir: répertoire rempli par des PartitionSpiller
+    :type spill_dir: str
+    :return: {(année, mois, Type): [fichiers]}
+    :rtype: dict
+    """
+    partitions = {}
+    for root, dirs, files in os.walk(spill_dir):
+        files = sorted(f for f in files if f.endswith(".parquet"))
+        if not files:
+            continue
+        year, month, Type = os.path.relpath(root, spill_dir).split(os.sep)
+        partitions[(int(year), int(month), Type)] = [os.path.join(root, f) for f in files]
+    return partitions
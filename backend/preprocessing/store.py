@@ -0,0 +1,529 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.store
+
+Données nettoyées rangées en dataset parquet partitionné façon hive:
+Data/year=<année>/month=<mois>/Type=<type de paquet>/part-0.parquet
+(le type est encodé dans le chemin, ex: Type=Confirmed%20Data%20Up)
+Les colonnes de partition ne sont pas écrites dans les fichiers, elles sont reconstruites à partir du chemin à la lecture
+et un filtre sur year, month ou Type ne lit que les répertoires concernés
+Les identifiants et caractéristiques textuelles (CATEGORICAL_COLUMNS) sont écrits en colonnes dictionnaire:
+chaque valeur distincte n'est stockée qu'une fois et la lecture les rend directement en pandas Categorical
+Les mesures ont un type compact déclaré (COMPACT_TYPES), relu sans conversion en float64 grâce aux types pandas nullables (cf pandas_dtype)
+Chaque partition est triée par @timestamp et découpée en row groups de ROW_GROUP_ROWS lignes, avec statistiques et page index:
+une lecture d'une plage de dates (une semaine dans un mois) ne décode que les row groups qui la recouvrent
+Chaque écriture met à jour le catalogue Data/_manifest.json (cf manifest.py): les lectures choisissent leurs fichiers
+d'après le catalogue, sans parcourir l'arborescence ni ouvrir les partitions hors de la demande
+Une lecture de plusieurs fichiers (une année...) se fait en une passe: les fichiers sont lus en parallèle par READ_THREADS threads
+(le lecteur parquet libère le GIL) dans une seule table arrow au schéma unifié, convertie une fois en pandas
+
+Fonctions:
+storage_schema:
+    schéma d'écriture (colonnes de CATEGORICAL_COLUMNS en dictionnaire, types de COMPACT_TYPES)
+pandas_dtype:
+    type pandas des petits entiers et booléens à la lecture
+plain_strings:
+    redonne des chaînes simples aux colonnes dictionnaire
+partition_filter:
+    expression de filtre sur les colonnes de partition
+time_filter:
+    expression de filtre sur une plage de dates (partitions et row groups)
+dataset_filter:
+    partition_filter, time_filter et prédicats simples sur les colonnes réunis
+partition_dir:
+    répertoire d'une partition
+write_partition:
+    remplace (ou crée) une partition
+PartitionWriter:
+    remplace une partition par des morceaux écrits au fur et à mesure (mode hors mémoire)
+read_partition:
+    relit une partition pour la fusion en mode ajout
+iter_partition:
+    relit une partition par morceaux
+open_dataset:
+    dataset de toutes les données rangées
+catalog:
+    entrées du catalogue (reconstruit s'il n'existe pas encore)
+resync_catalog:
+    reconstruit le catalogue d'après les fichiers présents
+plan_partitions:
+    entrées du catalogue qui correspondent à une demande
+unified_schema:
+    schéma commun à plusieurs fichiers de partition
+open_planned:
+    dataset limité aux fichiers de plan_partitions, au schéma unifié
+migrate_legacy_layout:
+    convertit l'ancienne arborescence Data/<année>/<mois>/<Type>.parquet
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from . import manifest
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data")
+PARTITION_SCHEMA = pa.schema([("year", pa.int16()), ("month", pa.int8()), ("Type", pa.string())])
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+PARTITION_COLUMNS = PARTITION_SCHEMA.names
+CATEGORICAL_COLUMNS = ["GW_EUI", "Dev_Add", "Dev_EUI", "Type", "Coding_rate", "modu", "datr", "Operator"]
+DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+SORT_COLUMN = "@timestamp"
+READ_THREADS = min(32, (os.cpu_count() or 1) * 2) #fichiers lus en même temps: lecture disque et décodage se recouvrent
+ROW_GROUP_ROWS = 64 * 1024 #quelques jours de paquets par row group pour un mois chargé: assez petit pour élaguer, assez gros pour la compression
+#freq reste en float64: 868.1 n'existe pas en float32 et la fréquence sert de valeur exacte (catégorie, comparaisons)
+COMPACT_TYPES = {
+    "SF": pa.int8(),
+    "rfch": pa.int8(),
+    "chan": pa.int8(),
+    "rssi": pa.int16(),
+    "size": pa.int16(),
+    "Bandwidth": pa.int32(),
+    "lsnr": pa.float32(),
+    "Airtime": pa.float32(),
+    "BitRate": pa.float32(),
+    "adr": pa.bool_(),
+}
+_NULLABLE_DTYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.uint8(): pd.UInt8Dtype(),
+    pa.uint16(): pd.UInt16Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+}
+
+def storage_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    Docstring for storage_schema
+    Les colonnes texte de CATEGORICAL_COLUMNS deviennent des colonnes dictionnaire, celles de COMPACT_TYPES prennent leur type déclaré,
+    les autres ne changent pas (la conversion d'une valeur hors des bornes du type échoue au lieu de la tronquer)
+
+    :param schema: schéma des données à écrire
+    :type schema: pa.Schema
+    :rtype: pa.Schema
+    """
+    fields = []
+    for field in schema:
+        if field.name in CATEGORICAL_COLUMNS and (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)):
+            field = field.with_type(DICTIONARY_TYPE)
+        elif field.name in COMPACT_TYPES:
+            field = field.with_type(COMPACT_TYPES[field.name])
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+def pandas_dtype(arrow_type: pa.DataType):
+    """
+    Docstring for pandas_dtype
+    types_mapper de to_pandas: sans lui un petit entier avec une valeur manquante devient float64 et un booléen devient object
+
+    :return: type pandas nullable pour les petits entiers et les booléens, None (conversion par défaut) sinon
+    """
+    return _NULLABLE_DTYPES.get(arrow_type)
+
+def plain_strings(table: pa.Table) -> pa.Table:
+    """
+    Docstring for plain_strings
+    Relecture pour le prétraitement (mode ajout): les colonnes dictionnaire redeviennent des chaînes,
+    comme les nouveaux paquets auxquels elles sont comparées et concaténées
+
+    :rtype: pa.Table
+    """
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+    return table
+
+def _write_options(schema: pa.Schema) -> dict:
+    """
+    Options parquet communes à write_partition et PartitionWriter: le tri par @timestamp est déclaré dans les métadonnées
+    """
+    return {
+        "compression": "zstd",
+        "write_page_index": True,
+        "sorting_columns": pq.SortingColumn.from_ordering(schema, [(SORT_COLUMN, "ascending")], null_placement="at_end"),
+    }
+
+def _sort_by_time(table: pa.Table) -> pa.Table:
+    return table.take(pc.sort_indices(table, [(SORT_COLUMN, "ascending")])) #tri stable, dates manquantes à la fin comme sort_index
+
+def partition_filter(year: int | None = None, month: int | None = None, categories=None):
+    """
+    Docstring for partition_filter
+
+    :param year: année ou None (toutes)
+    :param month: mois ou None (tous)
+    :param categories: types de paquets ou None/vide (tous)
+    :return: expression pyarrow, None si aucune restriction
+    """
+    conditions = []
+    if year:
+        conditions.append(ds.field("year") == int(year))
+    if month:
+        conditions.append(ds.field("month") == int(month))
+    if categories:
+        conditions.append(ds.field("Type").isin(list(categories))) #égalité exacte: plus de "Confirmed Data Up" trouvé dans "Unconfirmed Data Up"
+    return _and(conditions)
+
+def _and(conditions: list):
+    filtre = None
+    for condition in conditions:
+        if condition is not None:
+            filtre = condition if filtre is None else filtre & condition
+    return filtre
+
+def time_filter(start=None, end=None):
+    """
+    Docstring for time_filter
+    Paquets de start (inclus) à end (exclu): la condition sur year et month écarte les partitions hors de la plage,
+    celle sur @timestamp écarte les row groups dont les statistiques min/max sont hors de la plage (partitions triées, cf write_partition)
+
+    :param start: début (date ou chaîne lisible par pd.Timestamp, UTC si sans fuseau) ou None
+    :param end: fin exclue ou None
+    :return: expression pyarrow, None si aucune borne
+    """
+    conditions = []
+    annee, mois = ds.field("year"), ds.field("month")
+    if start is not None:
+        start = _utc(start)
+        conditions.append((annee > start.year) | ((annee == start.year) & (mois >= start.month)))
+        conditions.append(ds.field(SORT_COLUMN) >= pa.scalar(start, type=pa.timestamp("us", tz="UTC")))
+    if end is not None:
+        end = _utc(end)
+        conditions.append((annee < end.year) | ((annee == end.year) & (mois <= end.month)))
+        conditions.append(ds.field(SORT_COLUMN) < pa.scalar(end, type=pa.timestamp("us", tz="UTC")))
+    return _and(conditions)
+
+def dataset_filter(year: int | None = None, month: int | None = None, categories=None, start=None, end=None, filters=None):
+    """
+    Docstring for dataset_filter
+
+    :param filters: prédicats au format de pyarrow.parquet (ex: [("SF", "==", 7), ("GW_EUI", "in", {"a", "b"})]) ou None,
+        vérifiés sur les statistiques des row groups avant d'être appliqués ligne à ligne
+    :return: expression pyarrow, None si aucune restriction
+    """
+    return _and([
+        partition_filter(year, month, categories),
+        time_filter(start, end),
+        pq.filters_to_expression(filters) if filters else None,
+    ])
+
+def _utc(date) -> pd.Timestamp:
+    date = pd.Timestamp(date)
+    return date.tz_localize("UTC") if date.tzinfo is None else date.tz_convert("UTC") #les partitions sont découpées en mois UTC
+
+def partition_dir(year: int, month: int, Type: str, data_dir: str = DATA_DIR) -> str:
+    """
+    Répertoire de la partition, encodé comme le fait write_dataset (ex: year=2023/month=1/Type=Confirmed%20Data%20Up)
+    """
+    chemin, _ = PARTITIONING.format((ds.field("year") == int(year)) & (ds.field("month") == int(month)) & (ds.field("Type") == Type))
+    return os.path.join(data_dir, chemin)
+
+def _clear_partition(dossier: str, garder: str | None = None):
+    if not os.path.isdir(dossier):
+        return
+    for file in os.listdir(dossier):
+        if file != garder:
+            os.remove(os.path.join(dossier, file))
+
+def _record_partition(year: int, month: int, Type: str, data_dir: str):
+    """
+    Met l'entrée de la partition à jour dans le catalogue (la retire si la partition est vide)
+    """
+    path = os.path.join(partition_dir(year, month, Type, data_dir), "part-0.parquet")
+    entry = manifest.partition_entry(path, year, month, Type, data_dir) if os.path.exists(path) else None
+    manifest.update(data_dir, manifest.partition_key(year, month, Type), entry, rebuild=lambda: _scan_partitions(data_dir))
+
+def write_partition(df: pd.DataFrame, year: int, month: int, Type: str, data_dir: str = DATA_DIR):
+    """
+    Docstring for write_partition
+    Écrit df comme contenu complet de la partition (year, month, Type), trié par @timestamp, l'ancien contenu de la partition est supprimé
+
+    :param df: paquets nettoyés, @timestamp en colonne
+    :type df: pd.DataFrame
+    """
+    table = pa.Table.from_pandas(df.drop(columns=PARTITION_COLUMNS, errors="ignore"), preserve_index=False)
+    table = _sort_by_time(table.cast(storage_schema(table.schema)))
+    n = table.num_rows
+    if n == 0:
+        _clear_partition(partition_dir(year, month, Type, data_dir)) #write_dataset n'écrit rien et ne supprimerait pas l'ancien contenu
+        _record_partition(year, month, Type, data_dir)
+        return
+    table = table.append_column("year", pa.array([year] * n, pa.int16()))
+    table = table.append_column("month", pa.array([month] * n, pa.int8()))
+    table = table.append_column("Type", pa.array([Type] * n, pa.string()))
+    ds.write_dataset(
+        table,
+        data_dir,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching", #seule cette partition est remplacée, les autres processus écrivent les leurs
+        file_options=ds.ParquetFileFormat().make_write_options(**_write_options(table.drop_columns(PARTITION_COLUMNS).schema)),
+        preserve_order=True, #sinon les batchs peuvent être écrits dans le désordre et le tri est perdu
+        min_rows_per_group=ROW_GROUP_ROWS,
+        max_rows_per_group=ROW_GROUP_ROWS,
+    )
+    _record_partition(year, month, Type, data_dir)
+
+class PartitionWriter:
+    """
+    Docstring for PartitionWriter
+    Écrit une partition morceau par morceau dans un fichier caché (ignoré par les lectures),
+    qui ne remplace l'ancien contenu de la partition qu'à la fermeture: une lecture de la partition pendant l'écriture (mode ajout) reste possible
+    Le schéma est celui du premier morceau (ou schema), les suivants y sont convertis
+    (colonnes de CATEGORICAL_COLUMNS en dictionnaire, cf storage_schema)
+    Les morceaux doivent arriver triés par @timestamp (cf externalSort.py): ils sont écrits tels quels,
+    regroupés en row groups de ROW_GROUP_ROWS lignes (au plus ROW_GROUP_ROWS lignes en attente entre deux écritures)
+    """
+    def __init__(self, year: int, month: int, Type: str, schema: pa.Schema | None = None, data_dir: str = DATA_DIR):
+        self.partition = (year, month, Type)
+        self.data_dir = data_dir
+        self.dossier = partition_dir(year, month, Type, data_dir)
+        self.tmp = os.path.join(self.dossier, ".part-0.parquet.tmp")
+        if schema is not None:
+            schema = storage_schema(pa.schema([field for field in schema if field.name not in PARTITION_COLUMNS], metadata=schema.metadata))
+        self.schema = schema
+        self.writer = None
+        self.attente = []
+        self.nb_attente = 0
+        self.nb = 0
+
+    def _flush(self, tout: bool):
+        table = pa.concat_tables(self.attente)
+        garde = 0 if tout else table.num_rows % ROW_GROUP_ROWS #le reste attend le morceau suivant pour former un row group complet
+        if table.num_rows > garde:
+            self.writer.write_table(table.slice(0, table.num_rows - garde), row_group_size=ROW_GROUP_ROWS)
+        self.attente = [table.slice(table.num_rows - garde)] if garde else []
+        self.nb_attente = garde
+
+    def write(self, data):
+        """
+        :param data: DataFrame (@timestamp en colonne) ou pa.Table
+        """
+        if isinstance(data, pd.DataFrame):
+            data = pa.Table.from_pandas(data, preserve_index=False)
+        data = data.drop_columns([c for c in PARTITION_COLUMNS if c in data.column_names])
+        if self.writer is None:
+            os.makedirs(self.dossier, exist_ok=True)
+            if self.schema is None:
+                self.schema = storage_schema(data.schema)
+            self.writer = pq.ParquetWriter(self.tmp, self.schema, **_write_options(self.schema))
+        self.attente.append(data.select(self.schema.names).cast(self.schema))
+        self.nb_attente += data.num_rows
+        self.nb += data.num_rows
+        if self.nb_attente >= ROW_GROUP_ROWS:
+            self._flush(False)
+
+    def close(self):
+        if self.writer is None:
+            _clear_partition(self.dossier) #partition vide, comme write_partition
+            _record_partition(*self.partition, self.data_dir)
+            return
+        if self.attente:
+            self._flush(True)
+        self.writer.close()
+        self.writer = None
+        _clear_partition(self.dossier, os.path.basename(self.tmp))
+        os.replace(self.tmp, os.path.join(self.dossier, "part-0.parquet"))
+        _record_partition(*self.partition, self.data_dir)
+
+    def abort(self):
+        self.attente = []
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def open_dataset(data_dir: str = DATA_DIR) -> ds.Dataset:
+    """
+    Docstring for open_dataset
+
+    :return: dataset des données rangées (vide si rien n'a encore été rangé)
+    :rtype: ds.Dataset
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    return ds.dataset(data_dir, format="parquet", partitioning=PARTITIONING) #fichiers commençant par "." ou "_" ignorés
+
+def _scan_partitions(data_dir: str) -> dict:
+    """
+    Entrées du catalogue de toutes les partitions présentes, en parcourant l'arborescence (reconstruction uniquement)
+    Un fichier illisible (en cours d'écriture par un autre processus) est ignoré: son écrivain l'ajoutera au catalogue en finissant
+    """
+    partitions = {}
+    for dossier, _, fichiers in os.walk(data_dir):
+        if "part-0.parquet" not in fichiers:
+            continue
+        cles = ds.get_partition_keys(PARTITIONING.parse("/" + os.path.relpath(dossier, data_dir).replace(os.sep, "/") + "/"))
+        try:
+            entree = manifest.partition_entry(os.path.join(dossier, "part-0.parquet"), cles["year"], cles["month"], cles["Type"], data_dir)
+        except (OSError, pa.ArrowInvalid):
+            continue
+        partitions[manifest.partition_key(cles["year"], cles["month"], cles["Type"])] = entree
+    return partitions
+
+def catalog(data_dir: str = DATA_DIR) -> dict:
+    """
+    Docstring for catalog
+
+    :return: {clé "année/mois/Type": entrée} (cf manifest.partition_entry), le catalogue est reconstruit une fois s'il n'existe pas
+    :rtype: dict
+    """
+    partitions = manifest.load(data_dir)
+    if partitions is None:
+        partitions = _scan_partitions(data_dir)
+        manifest.write(data_dir, partitions)
+    return partitions
+
+def resync_catalog(data_dir: str = DATA_DIR) -> dict:
+    """
+    Docstring for resync_catalog
+    Reconstruit le catalogue d'après les fichiers présents, après un prétraitement interrompu:
+    une partition supprimée avant d'être réécrite (ou à moitié écrite) disparaît du catalogue
+
+    :return: nouvelles entrées du catalogue
+    :rtype: dict
+    """
+    return manifest.rebuild(data_dir, lambda: _scan_partitions(data_dir))
+
+def plan_partitions(year: int | None = None, month: int | None = None, categories=None, start=None, end=None, data_dir: str = DATA_DIR) -> list:
+    """
+    Docstring for plan_partitions
+    Choix des partitions à lire d'après le catalogue seul: les partitions vides
+    et celles dont les dates min/max sont hors de [start, end[ ne sont jamais ouvertes
+
+    :return: entrées du catalogue, triées par clé
+    :rtype: list
+    """
+    start = _utc(start) if start is not None else None
+    end = _utc(end) if end is not None else None
+    entrees = []
+    for key, entree in sorted(catalog(data_dir).items()):
+        if entree["rows"] == 0:
+            continue
+        if year and entree["year"] != int(year) or month and entree["month"] != int(month):
+            continue
+        if categories and entree["Type"] not in categories:
+            continue
+        if start is not None and entree["max_timestamp"] is not None and pd.Timestamp(entree["max_timestamp"]) < start:
+            continue
+        if end is not None and entree["min_timestamp"] is not None and pd.Timestamp(entree["min_timestamp"]) >= end:
+            continue
+        entrees.append(entree)
+    return entrees
+
+def unified_schema(fichiers: list) -> pa.Schema:
+    """
+    Docstring for unified_schema
+    Les mois écrits avant l'ajout d'une colonne ou avant COMPACT_TYPES n'ont pas le même schéma:
+    chaque schéma est ramené aux types déclarés (storage_schema) puis ils sont réunis, une colonne absente d'un fichier y est lue nulle
+    Seuls les pieds de page sont lus, en parallèle
+
+    :param fichiers: fichiers parquet (au moins un)
+    :type fichiers: list
+    :return: schéma commun, suivi des colonnes de partition
+    :rtype: pa.Schema
+    """
+    with ThreadPoolExecutor(max_workers=min(READ_THREADS, len(fichiers))) as pool:
+        schemas = [storage_schema(schema) for schema in pool.map(pq.read_schema, fichiers)]
+    schema = pa.unify_schemas(schemas, promote_options="permissive") #entiers élargis au plus grand type, sinon erreur plutôt qu'une colonne object
+    for field in PARTITION_SCHEMA:
+        if field.name not in schema.names:
+            schema = schema.append(field)
+    return schema
+
+def open_planned(entrees: list, data_dir: str = DATA_DIR) -> ds.Dataset:
+    """
+    Docstring for open_planned
+    Sans schéma donné, le dataset prendrait celui du premier fichier: une colonne absente de ce fichier serait ignorée partout
+
+    :param entrees: entrées de plan_partitions (au moins une)
+    :return: dataset de ces seuls fichiers au schéma unifié (cf unified_schema), avec les colonnes de partition year, month et Type
+    :rtype: ds.Dataset
+    """
+    fichiers = [os.path.join(data_dir, entree["path"]) for entree in entrees]
+    return ds.dataset(fichiers, schema=unified_schema(fichiers), format="parquet", partitioning=PARTITIONING, partition_base_dir=data_dir)
+
+def read_partition(year: int, month: int, Type: str, data_dir: str = DATA_DIR) -> pd.DataFrame | None:
+    """
+    Docstring for read_partition
+
+    :return: contenu de la partition (avec la colonne Type, sans year ni month, texte en chaînes simples), None si elle n'existe pas
+    :rtype: DataFrame | None
+    """
+    dataset = open_dataset(data_dir)
+    filtre = partition_filter(year, month, (Type,))
+    if not any(True for _ in dataset.get_fragments(filter=filtre)):
+        return None
+    table = dataset.to_table(filter=filtre).drop_columns(["year", "month"])
+    return plain_strings(table).to_pandas()
+
+def iter_partition(year: int, month: int, Type: str, batch_size: int, data_dir: str = DATA_DIR):
+    """
+    Docstring for iter_partition
+
+    :return: générateur de pa.Table d'au plus batch_size lignes (avec la colonne Type, sans year ni month, texte en chaînes simples), rien si la partition n'existe pas
+    """
+    dataset = open_dataset(data_dir)
+    filtre = partition_filter(year, month, (Type,))
+    for batch in dataset.to_batches(filter=filtre, batch_size=batch_size):
+        if batch.num_rows:
+            yield plain_strings(pa.Table.from_batches([batch]).drop_columns(["year", "month"]))
+
+def migrate_legacy_layout(data_dir: str = DATA_DIR) -> int:
+    """
+    Docstring for migrate_legacy_layout
+    Réécrit les fichiers de l'ancienne arborescence Data/<année>/<mois>/<Type>.parquet dans les partitions hive
+    puis les supprime, ne fait rien si tout est déjà au nouveau format
+
+    :return: nombre de fichiers convertis
+    :rtype: int
+    """
+    nb = 0
+    if not os.path.isdir(data_dir):
+        return nb
+    for annee in os.listdir(data_dir):
+        if not annee.isdigit():
+            continue #répertoires year=... déjà au bon format
+        for mois in os.listdir(os.path.join(data_dir, annee)):
+            dossier = os.path.join(data_dir, annee, mois)
+            if not mois.isdigit() or not os.path.isdir(dossier):
+                continue
+            for file in os.listdir(dossier):
+                if not file.endswith(".parquet"):
+                    continue
+                ancien = os.path.join(dossier, file)
+                write_partition(pq.read_table(ancien).to_pandas(), int(annee), int(mois), file[:-len(".parquet")], data_dir)
+                os.remove(ancien)
+                nb += 1
+            if not os.listdir(dossier):
+                os.rmdir(dossier)
+        if not os.listdir(os.path.join(data_dir, annee)):
+            os.rmdir(os.path.join(data_dir, annee))
+    if nb:
+        print(f"{nb} partitions converties au format year=/month=/Type=")
+    return nb
@@ -0,0 +1,128 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.streamIngest
+
+Permet de brancher un upload HTTP (asynchrone, par morceaux) sur le flatten (synchrone, qui lit un fichier)
+sans écrire le json brut sur le disque
+
+Classes:
+QueueReader:
+    flux binaire alimenté par morceaux depuis un autre thread (ou un autre processus), lu par ijson
+
+Fonctions:
+is_input_error:
+    l'erreur vient-elle du contenu envoyé (json invalide, compression corrompue) plutôt que du serveur
+"""
+import lzma
+import queue
+import zlib
+import ijson
+
+
+class QueueReader:
+    """
+    Docstring for QueueReader
+    Objet fichier (read) dont le contenu arrive par morceaux via put
+    Le producteur (la route d'upload) appelle put puis finish, le consommateur (le flatten, dans un thread) appelle read
+    La file est bornée: si le traitement est plus lent que le réseau, l'upload est ralenti au lieu de remplir la RAM
+    source: file existante (ex: multiprocessing.Queue remplie par le serveur quand le traitement tourne dans un job)
+    """
+    def __init__(self, maxsize: int = 64, source=None):
+        self.queue = source if source is not None else queue.Queue(maxsize)
+        self.buffer = b""
+        self.eof = False
+        self.closed = False #le consommateur a arrêté de lire (erreur pendant le traitement)
+
+    def put_nowait(self, chunk: bytes) -> bool:
+        """
+        Ajoute un morceau sans bloquer, renvoie False si la file est pleine
+        """
+        try:
+            self.queue.put_nowait(chunk)
+            return True
+        except queue.Full:
+            return False
+
+    def put(self, chunk: bytes) -> bool:
+        """
+        Ajoute un morceau (bloquant), renvoie False si le consommateur ne lit plus
+        """
+        while not self.closed:
+            try:
+                self.queue.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def finish(self):
+        """
+        Signale la fin de l'upload
+        """
+        self.put(None)
+
+    def read(self, size: int = -1) -> bytes:
+        if size == 0 or (self.eof and not self.buffer):
+            return b""
+        if size is None or size < 0:
+            morceaux = [self.buffer]
+            self.buffer = b""
+            while not self.eof:
+                self._next()
+                morceaux.append(self.buffer)
+                self.buffer = b""
+            return b"".join(morceaux)
+        if not self.buffer:
+            self._next()
+        out, self.buffer = self.buffer[:size], self.buffer[size:]
+        return out
+
+    def _next(self):
+        chunk = self.queue.get()
+        if chunk is None:
+            self.eof = True
+        else:
+            self.buffer = chunk
+
+    def close(self):
+        self.closed = True
+
+
+def _zstd_errors() -> tuple:
+    erreurs = []
+    try:
+        from compression import zstd
+        erreurs.append(zstd.ZstdError)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        erreurs.append(zstandard.ZstdError)
+    except ImportError:
+        pass
+    return tuple(erreurs)
+
+INPUT_ERRORS = (ValueError, EOFError, ijson.JSONError, lzma.LZMAError, zlib.error) + _zstd_errors() #ValueError comprend json et UnicodeDecodeError
+
+
+def is_input_error(e: BaseException) -> bool:
+    """
+    Docstring for is_input_error
+    Une erreur de gzip ou bz2 sur un flux corrompu est un OSError sans errno, contrairement aux erreurs du disque
+
+    :return: True si e vient des données reçues (réponse 400), False pour une erreur interne (500)
+    :rtype: bool
+    """
+    return isinstance(e, INPUT_ERRORS) or (isinstance(e, OSError) and e.errno is None)
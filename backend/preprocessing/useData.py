@@ -15,83 +15,127 @@
 """
 By Charles Bouquet
 Docstring for preprocessing.useData
-Sert à importer les données enregistrées en json dans le système de fichiers
-erreurs soulevées: ValueError pour toutes les fonctions sauf Ouvre_Json_Mois_Categorie: FileNotFoundError 
-Pour chaque fonction, on suppose que le fichier cherché existe, ça revient à l'utilisateur des fonctions de faire un try except au cas où
+Sert à importer les données rangées dans le dataset parquet partitionné Data/year=/month=/Type= (cf store.py)
+Chaque fonction lit le dataset avec un filtre sur les partitions: seuls les fichiers de l'année, du mois et des catégories demandés sont ouverts
+La liste des fichiers vient du catalogue Data/_manifest.json tenu à jour par le prétraitement (cf manifest.py), sans parcourir l'arborescence
+Les colonnes de CATEGORICAL_COLUMNS (identifiants, Type, modulation...) sont rendues en pandas Categorical aux catégories triées
+et les mesures gardent leur type compact (Int8, Int16, float32, boolean: cf COMPACT_TYPES dans store.py)
+Plusieurs fichiers (une année...) sont lus en parallèle dans une seule table arrow au schéma unifié, convertie une seule fois en pandas:
+une colonne qui change de type d'un mois à l'autre ne devient pas object
+erreurs soulevées: FileNotFoundError si aucune partition ne correspond à l'année, au mois et aux catégories demandés
+(une plage de dates sans paquet donne un DataFrame vide)
+Pour chaque fonction, on suppose que les données cherchées existent, ça revient à l'utilisateur des fonctions de faire un try except au cas où
 Fonctions:
 open_processed_df:
     ouvre juste un df en fonction de comment il a été enregistré
-Ouvre_Json_Util:
-    Code réutilisé à plusieurs endroits pour ouvrir plusieurs JSON et concaténer les DF
+Ouvre_Dataset:
+    Code réutilisé partout: lit les partitions correspondant à l'année, au mois et aux catégories (None: toutes)
 Ouvre_Json_Annee:
-    Ouvre tous les JSON d'une année donnée (quel que soit le mois et le type de paquet)
+    Ouvre toutes les données d'une année donnée (quel que soit le mois et le type de paquet)
 Ouvre_Json_Mois:
-    Ouvre tous les JSON d'un mois donné (quel que soit le mois et le type de paquet)
+    Ouvre toutes les données d'un mois donné (quel que soit le type de paquet)
 Ouvre_Json_Mois_Categorie:
-    Ouvre le JSON spécifié (d'un mois précis et d'un type de paquet précis)
-Ouvre_Json_Cat_Util:
-    Code réutilisé dans les deux fonctions suivantes pour ouvrir les JSON d'un chemin et d'une catégorie donnée
+    Ouvre la partition spécifiée (d'un mois précis et d'un type de paquet précis)
 Ouvre_Json_Categorie:
-    Renvoie un Dataframe à partir de tous les JSON de la Catégorie correspondante (quels que soient les mois ou les années)
+    Renvoie un Dataframe à partir de toutes les données de la Catégorie correspondante (quels que soient les mois ou les années)
 Ouvre_Json_Categorie_Annee:
-    Renvoie un Dataframe à partir de tous les JSON de l'année et de la Catégorie correspondante (quel que soit le mois)
+    Renvoie un Dataframe à partir de toutes les données de l'année et de la Catégorie correspondante (quel que soit le mois)
+Periodes_Disponibles:
+    (année, mois) qui ont des données, d'après le catalogue
+Colonnes:
+    colonnes disponibles, d'après le catalogue
 """
 import pandas as pd
-import os
-from cachetools import TTLCache, cached
-import sys
-cache = TTLCache(maxsize=1_000_000_000, ttl=120,getsizeof=sys.getsizeof) #TTL de 120 secondes, max 1 Go éléments mémorisés cache nécessaire pour accélérer les algos
-#peu intéressant d'optimiser comme c'est surtout des essais de différentes méthodes
+from .store import plan_partitions, open_planned, catalog, dataset_filter, pandas_dtype, CATEGORICAL_COLUMNS, READ_THREADS
+from .datasetCache import DatasetCache
+CACHE_BYTES = 1 << 30 #1 Gio de DataFrames mémorisés, cache nécessaire pour accélérer les algos
+cache = DatasetCache(CACHE_BYTES) #entrées relues dès que le hash d'un fichier lu change dans le catalogue, cf datasetCache.py
 
-def open_processed_df(file:str)->pd.DataFrame:
+def open_processed_df(df:pd.DataFrame)->pd.DataFrame:
     """
     Docstring for open_processed_df
-    Ouvre le fichier spécifié en tant que dataframe
+    Remet en forme les données lues dans le dataset
 
-    :param file: chemin du fichier
-    :type file: str
-    :return: Dataframe correspondant au json choisi
+    :param df: données lues (colonnes de partition year et month comprises)
+    :type df: DataFrame
+    :return: Dataframe indexé par @timestamp, comme au moment du nettoyage
     :rtype: DataFrame
     """
-    df=pd.read_parquet(file,"pyarrow")
-    if not df.empty:
-        df["time"]=pd.to_datetime(df["time"], errors="coerce", utc=True)
+    df=df.drop(columns=["year","month"],errors="ignore") #déjà dans l'index, absentes des données d'origine
+    for colonne in df.columns.intersection(CATEGORICAL_COLUMNS):
+        if isinstance(df[colonne].dtype,pd.CategoricalDtype): #catégories dans l'ordre des valeurs: les mêmes quel que soit l'ordre de lecture des fichiers
+            df[colonne]=df[colonne].cat.reorder_categories(sorted(df[colonne].cat.categories))
+    if "@timestamp" in df.columns: #aussi pour un résultat vide (plage de dates sans paquet): mêmes colonnes et même index
+        if "time" in df.columns: #absente si elle n'a pas été demandée (cf columns de Ouvre_Dataset)
+            df["time"]=pd.to_datetime(df["time"], errors="coerce", utc=True)
         df["@timestamp"]=pd.to_datetime(df["@timestamp"], errors="coerce", utc=True,unit="ms")
         df.set_index("@timestamp",inplace=True) #Pandas autorise d'avoir des index non uniques donc ça ne posera pas problème quoi qu'il arrive
     return df
-@cached(cache) #cache pour accès plus rapide
-def Ouvre_Json_Util(path)->pd.DataFrame:
+
+def _en_pandas(table)->pd.DataFrame:
+    categoriques=[colonne for colonne in CATEGORICAL_COLUMNS if colonne in table.column_names] #Type vient du chemin (chaîne), les autres sont déjà en dictionnaire
+    return open_processed_df(table.to_pandas(categories=categoriques,types_mapper=pandas_dtype)) #un seul dictionnaire par colonne pour toutes les partitions lues
+
+def _lit_dataset(dataset,filtre,columns:list|None)->pd.DataFrame:
+    return _en_pandas(dataset.to_table(filter=filtre,columns=columns,use_threads=True,fragment_readahead=READ_THREADS)) #seules les colonnes demandées sont lues, plusieurs fichiers à la fois
+
+def _hashable(filters)->tuple|None:
+    if not filters:
+        return None
+    return tuple((colonne,op,frozenset(valeur) if isinstance(valeur,(set,list,tuple)) else valeur) for colonne,op,valeur in filters)
+
+def Ouvre_Dataset(year:int=None,month:int=None,categories:tuple=None,columns=None,start=None,end=None,filters=None)->pd.DataFrame:
     """
-    Docstring for Ouvre_Json_Util
-    Ouvre des JSON globalement, utilisé dans les autres fonctions uniquement
+    Docstring for Ouvre_Dataset
+    Lit les partitions demandées, sans parcourir l'arborescence: le filtre sur year, month et Type élimine les autres fichiers
+    Le résultat est mémorisé dans cache tant que les fichiers lus ne changent pas, chaque appel reçoit sa propre copie (copy-on-write)
+    Avec columns, seules ces colonnes sont lues (une entrée du cache avec plus de colonnes suffit)
+    start, end et filters sont vérifiés sur les partitions puis sur les statistiques des row groups: seuls les row groups qui peuvent contenir des paquets voulus sont lus
 
-    :param path: Description
-    :return: Description
+    :param year: année ou None (toutes)
+    :type year: int
+    :param month: mois ou None (tous)
+    :type month: int
+    :param categories: types de paquets exacts ou None (tous)
+    :type categories: tuple
+    :param columns: colonnes voulues ou None (toutes), @timestamp est toujours lu (index), les colonnes inconnues sont ignorées
+    :param start: début de la plage (inclus) ou None, UTC si sans fuseau
+    :param end: fin de la plage (exclue) ou None
+    :param filters: prédicats simples, ex: [("SF", "==", 7), ("GW_EUI", "in", {"a", "b"})] (cf dataset_filter)
+    :type filters: list
+    :return: données correspondantes (vides mais avec les mêmes colonnes et types si aucune partition n'a de paquet dans [start, end[)
     :rtype: DataFrame
+    :raises FileNotFoundError: aucune partition pour year, month et categories
     """
-    list_df=[]
-    for root,dirs,files in os.walk(path):
-        for file in files:
-            file=os.path.join(root,file)
-            tempDf=open_processed_df(file)
-            if (tempDf.empty or tempDf.isna().all(axis=None)) and len(list_df)>0:
-                continue #on ne veut pas ajouter notre DataFrame s'il n'y a rien dedans
-            list_df.append(tempDf)
-    df=pd.concat(list_df,axis=0,join='outer')
-    return df
+    entrees=plan_partitions(year,month,categories,start,end) #catalogue seul: ni parcours de l'arborescence ni ouverture des partitions écartées
+    hors_plage=not entrees
+    if hors_plage:
+        entrees=plan_partitions(year,month,categories) #seules les dates les excluent: résultat vide, pas d'erreur
+        if not entrees:
+            raise FileNotFoundError(f"aucune donnée pour year={year} month={month} categories={categories}")
+    dataset=open_planned(entrees)
+    lues=None
+    if columns is not None:
+        columns=frozenset(columns)
+        lues=[colonne for colonne in dataset.schema.names if colonne in columns or colonne=="@timestamp"] #ordre du dataset quelle que soit la demande
+        columns=frozenset(lues)
+    if hors_plage:
+        vide=dataset.schema.empty_table() #schéma unifié des partitions: pieds de page lus, aucune donnée
+        return _en_pandas(vide.select(lues) if lues is not None else vide)
+    filtre=dataset_filter(year,month,categories,start,end,filters)
+    signature=tuple((entree["path"],entree["hash"]) for entree in entrees)
+    return cache.get((year,month,categories,start,end,_hashable(filters)),columns,signature,lambda: _lit_dataset(dataset,filtre,lues))
 
-def Ouvre_Tous_Json()->pd.DataFrame:
+def Ouvre_Tous_Json(columns=None)->pd.DataFrame:
     """
     Docstring for Ouvre_Tous_Json
     Ouvre toutes les données enregistrées
     :return: Description
     :rtype: DataFrame
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    path=os.path.join(script_dir,"Data")
-    return Ouvre_Json_Util(path)
+    return Ouvre_Dataset(columns=columns)
 
-def Ouvre_Json_Annee(annee:int)->pd.DataFrame:
+def Ouvre_Json_Annee(annee:int,columns=None)->pd.DataFrame:
     """
     Docstring for Ouvre_Json
     Ouvre toutes les catégories de l'année sélectionnée
@@ -99,22 +143,15 @@ def Ouvre_Json_Annee(annee:int)->pd.DataFrame:
     :param annee: annee que l'on veut importer
     :type annee: int
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    path=os.path.join(script_dir,"Data",str(annee))
-    return Ouvre_Json_Util(path)
+    return Ouvre_Dataset(annee,columns=columns)
     
-def Ouvre_Json_Mois_Toutes_Annees(mois:int)->pd.DataFrame:
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    root=os.path.join(script_dir,"Data")
-    temp=[Ouvre_Json_Mois(annee,mois) for annee in os.listdir(root)]
-    return pd.concat(temp,axis=0,join="outer")
+def Ouvre_Json_Mois_Toutes_Annees(mois:int,columns=None)->pd.DataFrame:
+    return Ouvre_Dataset(None,mois,columns=columns)
+
+def Ouvre_Json_Cat_Mois_Toutes_Annees(mois:int,categorie:str,columns=None):
+    return Ouvre_Dataset(None,mois,(categorie,),columns)
 
-def Ouvre_Json_Cat_Mois_Toutes_Annees(mois:int,categorie:str):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    root=os.path.join(script_dir,"Data")
-    temp=[Ouvre_Json_Mois_Categorie(annee,mois,categorie) for annee in os.listdir(root)]
-    return pd.concat(temp,axis=0,join="outer")
-def Ouvre_Json_Mois(annee:int,mois:int)->pd.DataFrame:
+def Ouvre_Json_Mois(annee:int,mois:int,columns=None)->pd.DataFrame:
     """
     Docstring for Ouvre_Json_Mois
     Ouvre toutes les catégories du mois sélectionné
@@ -123,11 +160,9 @@ def Ouvre_Json_Mois(annee:int,mois:int)->pd.DataFrame:
     :param mois: mois choisi (de 1 à 12)
     :type mois: int
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    path=os.path.join(script_dir,"Data",str(annee),str(mois))
-    return Ouvre_Json_Util(path)
+    return Ouvre_Dataset(annee,mois,columns=columns)
 
-def Ouvre_Json_Mois_Categorie(annee:int,mois:int,Categorie:str)->pd.DataFrame:
+def Ouvre_Json_Mois_Categorie(annee:int,mois:int,Categorie:str,columns=None)->pd.DataFrame:
     """
     Docstring for Ouvre_Json_Mois_Categorie
     Importe dans un Dataframe les données correspondants à l'année, au mois et à la catégorie sélectionnés
@@ -141,53 +176,24 @@ def Ouvre_Json_Mois_Categorie(annee:int,mois:int,Categorie:str)->pd.DataFrame:
     :return: le dataframe correspondant aux données sélectionées
     :rtype: DataFrame
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    file=os.path.join(script_dir,"Data",str(annee),str(mois),Categorie+".parquet")
-    df=open_processed_df(file)
-    return df
-@cached(cache) #cache pour accès plus rapide
-def Ouvre_Json_Cat_Util(path:str,cat:str)->pd.DataFrame: 
-    """
-    Docstring for Ouvre_Json_Cat_Util
-    Fonction globalement utilisée pour ouvrir des json en fonction d'une catégorie
-
-    :param path: chemin du répertoire où on cherche
-    :type path: str
-    :param cat: Catégorie choisie
-    :type cat: str
-    :return: DataFrame des données trouvées
-    :rtype: DataFrame
-    """
-    list_df=[]
-    for root,dirs,files in os.walk(path):
-        for file in files:
-            if cat in file:#on veut que le nom du fichier contienne le nom de la catégorie
-                file=os.path.join(root,file)
-                tempDf=open_processed_df(file)
-                if (tempDf.empty or tempDf.isna().all(axis=None)) and len(list_df)>0:
-                    continue #on ne veut pas ajouter notre DataFrame s'il n'y a rien dedans
-                list_df.append(tempDf)
-    df=pd.concat(list_df,axis=0,join='outer')
-    return df
+    return Ouvre_Dataset(annee,mois,(Categorie,),columns)
 
-def Ouvre_Json_Categorie(Categorie:str)->pd.DataFrame:
+def Ouvre_Json_Categorie(Categorie:str,columns=None)->pd.DataFrame:
     """
     Docstring for Ouvre_Json_Categorie
-    Importe dans un Dataframe tous les JSON de la catégorie choisie
+    Importe dans un Dataframe toutes les données de la catégorie choisie
 
     :param Categorie: Catégorie choisie (par exemple Confirmed Data Up)
     :type Categorie: str
     :return: données correspondantes à la catégorie choisie
     :rtype: DataFrame
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    path=os.path.join(script_dir,"Data")
-    return Ouvre_Json_Cat_Util(path,Categorie)
+    return Ouvre_Dataset(None,None,(Categorie,),columns)
 
-def Ouvre_Json_Categorie_Annee(annee:int,Categorie:str)->pd.DataFrame:
+def Ouvre_Json_Categorie_Annee(annee:int,Categorie:str,columns=None)->pd.DataFrame:
     """
     Docstring for Ouvre_Json_Categorie_Annee
-    Importe en DataFrame tous les json de la catégorie et de l'année choisis
+    Importe en DataFrame toutes les données de la catégorie et de l'année choisis
 
     :param annee: année choisie
     :type annee: int
@@ -196,11 +202,9 @@ def Ouvre_Json_Categorie_Annee(annee:int,Categorie:str)->pd.DataFrame:
     :return: Données correspondantes
     :rtype: DataFrame
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    path=os.path.join(script_dir,"Data",str(annee))
-    return Ouvre_Json_Cat_Util(path,Categorie)
+    return Ouvre_Dataset(annee,None,(Categorie,),columns)
 
-def Ouvre_Tous_Json_Cat(cat:str)->pd.DataFrame:
+def Ouvre_Tous_Json_Cat(cat:str,columns=None)->pd.DataFrame:
     """
     Docstring for Ouvre_Tous_Json_Cat
     
@@ -209,55 +213,63 @@ def Ouvre_Tous_Json_Cat(cat:str)->pd.DataFrame:
     :return: Données correspondantes
     :rtype: DataFrame
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    path=os.path.join(script_dir,"Data")
-    return Ouvre_Json_Cat_Util(path,cat)
+    return Ouvre_Json_Categorie(cat,columns)
+
+def Periodes_Disponibles()->list:
+    """
+    Docstring for Periodes_Disponibles
+    Lu dans le catalogue, sans ouvrir de fichier
+
+    :return: (année, mois) qui ont des données, triés
+    :rtype: list
+    """
+    return sorted({(entree["year"],entree["month"]) for entree in catalog().values() if entree["rows"]})
 
-@cached(cache) #cache pour accès plus rapide
-def Choose_Open(year:int=None,month:int=None,categories:tuple=None)->pd.DataFrame: 
-    #à tester quand je serai branché sur secteur et pas dans un train
+def Colonnes(year:int=None,month:int=None)->list:
+    """
+    Docstring for Colonnes
+    Colonnes du DataFrame que rendrait Choose_Open(year,month) (sans @timestamp qui est l'index), lues dans le catalogue
+
+    :return: noms des colonnes
+    :rtype: list
+    :raises FileNotFoundError: aucune partition ne correspond
+    """
+    entrees=plan_partitions(year or None,month or None)
+    if not entrees:
+        raise FileNotFoundError(f"aucune donnée pour year={year} month={month}")
+    colonnes=[]
+    for entree in entrees:
+        colonnes+=[nom for nom,_ in entree["schema"] if nom not in colonnes and nom!="@timestamp"]
+    if "Type" not in colonnes:
+        colonnes.append("Type") #colonne de partition, absente des fichiers (comme year et month, qui ne sont pas rendues)
+    return colonnes
+
+def Choose_Open(year:int=None,month:int=None,categories:tuple=None,columns=None,start=None,end=None,filters=None)->pd.DataFrame: 
     """
     Docstring for Choose_Open
     
-    Choisis la meilleure fonction à utiliser en fonction des paramètres fournis
+    Lit les données correspondant aux paramètres fournis en un seul parcours filtré du dataset
+    (toutes les catégories demandées d'un coup, plus de concaténation fichier par fichier)
     :param year: année ou None
     :type year: int
-    :param month: mois ou None
+    :param month: mois ou None (possible sans année: ce mois-là de toutes les années)
     :type month: int
     :param categories: Liste des catégories ou None ou liste vide
     :type categories: list
+    :param columns: colonnes utilisées par l'analyse ou None (toutes), @timestamp est toujours l'index
+    :type columns: list
+    :param start: début de la plage de dates (inclus) ou None, plus fin que year et month (ex: "2023-01-09", les 6 dernières heures...)
+    :param end: fin de la plage de dates (exclue) ou None
+    :param filters: prédicats simples sur les colonnes, ex: [("SF", "==", 7)] ou [("GW_EUI", "in", {"a", "b"})]
+    :type filters: list
     :return: Description
     :rtype: DataFrame
     """
     try:
-        if (year and month and categories):
-            temp=[Ouvre_Json_Mois_Categorie(year,month,cat) for cat in categories]
-            df=pd.concat(temp,axis=0,join='outer')
-            return df
-        elif (not year and not month and not categories):
-            return Ouvre_Tous_Json() #on a rien donc on ouvre tout
-        elif (year and month and not categories):
-            return Ouvre_Json_Mois(year,month)
-        elif (year and not month and not categories):
-            return Ouvre_Json_Annee(year)
-        elif (year and not month and categories):
-            temp=[Ouvre_Json_Categorie_Annee(year,cat) for cat in categories]
-            return pd.concat(temp,axis=0,join="outer")
-        elif (not year and not month and categories):
-            temp=[Ouvre_Tous_Json_Cat(cat) for cat in categories]
-            return pd.concat(temp,axis=0,join="outer")
-        elif (not year and month and categories):
-            temp=[Ouvre_Json_Cat_Mois_Toutes_Annees(month,categorie) for categorie in categories]
-            return pd.concat(temp,axis=0,join="outer")
-        elif (not year and month and not categories):
-            return Ouvre_Json_Mois_Toutes_Annees(month)
-        #normalement tous les cas possibles sont gérés, je ne peux pas avoir month sans avoir year
+        return Ouvre_Dataset(year or None,month or None,tuple(categories) if categories else None,columns,start,end,filters)
     except FileNotFoundError:
         print("fichier non trouvé")
         raise 
-    except ValueError:
-        print("fichier non trouvé")
-        raise 
 
 
 if __name__=="__main__":
@@ -0,0 +1,219 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.windowQuantiles
+
+Quantiles sur fenêtre glissante pour le filtre d'outliers (écart interquartile) de produce_dataset
+Les bornes des fenêtres sont calculées une seule fois (nombre de points ou durée) et partagées par tous les attributs,
+Q1 et Q3 de chaque attribut sont ensuite obtenus en une passe vectorisée grâce à une wavelet matrix:
+la k-ième plus petite valeur de n'importe quelle plage [début,fin) se lit en O(log K) (K: nombre de valeurs distinctes),
+indépendamment de la taille de la fenêtre, et toutes les lignes sont traitées en même temps par numpy
+
+Mêmes résultats que pandas rolling(duree).quantile(q) (interpolation linéaire, min_periods par défaut),
+le mode approché (approx=True) regroupe les valeurs en nb_bins classes quand il y a trop de valeurs distinctes
+
+Classes:
+WaveletMatrix:
+    k-ième plus petit code sur des plages de lignes
+StreamingOutliers:
+    iqr_outliers morceau par morceau, la fin de la dernière fenêtre est gardée d'un morceau au suivant
+Fonctions:
+window_bounds:
+    bornes [début,fin) de la fenêtre de chaque ligne et nombre minimal de points
+rolling_quantiles:
+    quantiles glissants de plusieurs attributs
+iqr_outliers:
+    masque des outliers (hors de [Q1-1.5*IQR, Q3+1.5*IQR]) sur les attributs numériques
+"""
+import numpy as np
+import pandas as pd
+
+
+class WaveletMatrix:
+    """
+    Docstring for WaveletMatrix
+    Construite sur des codes entiers (0..K-1), un niveau par bit: chaque niveau garde le nombre de zéros
+    avant chaque position (rank0) puis range les codes de façon stable, zéros d'abord
+    """
+    def __init__(self, codes: np.ndarray, nb_bits: int):
+        self.nb_bits = max(int(nb_bits), 1)
+        self.dtype = np.int32 if len(codes) < 2**31 else np.int64
+        self.ranks = []
+        self.zeros = []
+        cur = codes.astype(self.dtype, copy=False)
+        for level in range(self.nb_bits - 1, -1, -1):
+            zero = ((cur >> level) & 1) == 0
+            rank0 = np.empty(len(cur) + 1, dtype=self.dtype)
+            rank0[0] = 0
+            np.cumsum(zero, out=rank0[1:])
+            self.ranks.append(rank0)
+            self.zeros.append(self.dtype(rank0[-1]))
+            cur = np.concatenate([cur[zero], cur[~zero]])
+
+    def kth(self, starts: np.ndarray, ends: np.ndarray, k: np.ndarray) -> np.ndarray:
+        """
+        k-ième plus petit code (k à partir de 0) de chaque plage [starts,ends), pour toutes les lignes à la fois
+        """
+        s = starts.astype(self.dtype)
+        e = ends.astype(self.dtype)
+        k = k.astype(self.dtype)
+        code = np.zeros(len(s), dtype=self.dtype)
+        for rank0, zeros in zip(self.ranks, self.zeros):
+            zs = rank0[s]
+            ze = rank0[e]
+            nb_zeros = ze - zs
+            droite = k >= nb_zeros
+            code <<= 1
+            code |= droite
+            #à droite: on saute les zéros de la plage et on se place parmi les uns (après tous les zéros du niveau)
+            np.subtract(k, nb_zeros, out=k, where=droite)
+            s = np.where(droite, s - zs + zeros, zs)
+            e = np.where(droite, e - ze + zeros, ze)
+        return code
+
+def window_bounds(index: pd.Index, duree) -> tuple:
+    """
+    Docstring for window_bounds
+
+    :param index: index du DataFrame (DatetimeIndex trié pour une fenêtre en durée)
+    :type index: pd.Index
+    :param duree: nombre de points (int) ou durée ("7d", "1h"...)
+    :return: (débuts, fins, min_periods) fenêtre de la ligne i: [débuts[i], fins[i])
+    :rtype: tuple
+
+    comme pandas: nombre de points w -> les w dernières lignes, min_periods=w
+    durée d -> les lignes dans ]t-d, t], min_periods=1
+    """
+    n = len(index)
+    ends = np.arange(1, n + 1, dtype=np.int64)
+    if isinstance(duree, (int, np.integer)):
+        return np.maximum(ends - int(duree), 0), ends, int(duree)
+    if not isinstance(index, pd.DatetimeIndex):
+        raise ValueError("une fenêtre en durée demande un index de dates")
+    if not index.is_monotonic_increasing:
+        raise ValueError("index must be monotonic") #même erreur que pandas rolling
+    ts = index.as_unit("ns").asi8
+    starts = np.searchsorted(ts, ts - pd.Timedelta(duree).value, side="right").astype(np.int64)
+    return starts, ends, 1
+
+def _codes(values: np.ndarray, approx: bool, nb_bins: int) -> tuple:
+    """
+    valeurs -> (codes, valeur de chaque code)
+    exact: codes des valeurs distinctes triées, approché: nb_bins classes de même largeur (centre de classe)
+    """
+    if approx:
+        vmin = values.min()
+        vmax = values.max()
+        if vmax > vmin:
+            largeur = (vmax - vmin) / nb_bins
+            codes = np.minimum(((values - vmin) / largeur).astype(np.int64), nb_bins - 1)
+            return codes, vmin + (np.arange(nb_bins) + 0.5) * largeur
+    uniques, codes = np.unique(values, return_inverse=True)
+    return codes.astype(np.int64), uniques
+
+def rolling_quantiles(df: pd.DataFrame, attrs: list, duree, quantiles=(0.25, 0.75), approx: bool = False, nb_bins: int = 4096) -> dict:
+    """
+    Docstring for rolling_quantiles
+
+    :param df: données (triées par date pour une fenêtre en durée)
+    :type df: pd.DataFrame
+    :param attrs: attributs numériques
+    :type attrs: list
+    :param duree: nombre de points ou durée de la fenêtre
+    :param quantiles: quantiles voulus
+    :param approx: regroupe les valeurs en nb_bins classes (plus rapide si beaucoup de valeurs distinctes, résultat approché)
+    :type approx: bool
+    :return: {attr: [pd.Series d'un quantile, même index que df]}
+    :rtype: dict
+    """
+    starts, ends, min_periods = window_bounds(df.index, duree)
+    nobs = ends - starts
+    assez = nobs >= min_periods
+    nobs = np.maximum(nobs, 1)
+    resultat = {}
+    for attr in attrs:
+        values = df[attr].to_numpy(dtype=np.float64, na_value=np.nan)
+        if np.isnan(values).any():
+            #les NaN changent le nombre de points de chaque fenêtre: on laisse faire pandas
+            rolling = df[attr].rolling(duree)
+            resultat[attr] = [rolling.quantile(q) for q in quantiles]
+            continue
+        codes, valeurs = _codes(values, approx, nb_bins)
+        matrix = WaveletMatrix(codes, int(codes.max()).bit_length() if len(codes) else 1)
+        #même calcul que pandas (roll_quantile, interpolation linéaire): valeurs de rang idx et idx+1
+        idx_with_fraction = [q * (nobs - 1) for q in quantiles]
+        idx = [iwf.astype(np.int64) for iwf in idx_with_fraction]
+        rangs = np.concatenate([np.minimum(i + 1, nobs - 1) for i in idx] + idx)
+        n = len(df)
+        m = len(quantiles)
+        codes_kth = matrix.kth(np.tile(starts, 2 * m), np.tile(ends, 2 * m), rangs)
+        series = []
+        for j in range(m):
+            vhigh = valeurs[codes_kth[j * n:(j + 1) * n]]
+            vlow = valeurs[codes_kth[(m + j) * n:(m + j + 1) * n]]
+            fraction = idx_with_fraction[j] != idx[j]
+            out = np.where(fraction, vlow + (vhigh - vlow) * (idx_with_fraction[j] - idx[j]), vlow)
+            series.append(pd.Series(np.where(assez, out, np.nan), index=df.index))
+        resultat[attr] = series
+    return resultat
+
+def iqr_outliers(df: pd.DataFrame, attrs: list, duree, approx: bool = False) -> np.ndarray:
+    """
+    Docstring for iqr_outliers
+
+    :param df: données (triées par date pour une fenêtre en durée)
+    :type df: pd.DataFrame
+    :param attrs: attributs concernés, ceux qui ne sont pas numériques sont ignorés
+    :type attrs: list
+    :param duree: nombre de points ou durée de la fenêtre glissante
+    :return: masque des paquets aberrants pour au moins un attribut
+    :rtype: np.ndarray
+    """
+    numeriques = [attr for attr in attrs if pd.api.types.is_numeric_dtype(df[attr])]
+    outlier = np.zeros(len(df), dtype=bool)
+    for attr, (q1, q3) in rolling_quantiles(df, numeriques, duree, (0.25, 0.75), approx).items():
+        IQRange = q3 - q1   #écart interquartile
+        x = df[attr]
+        outlier |= ((x <= (q1 - 1.5 * IQRange)) | (x >= (q3 + 1.5 * IQRange))).to_numpy(dtype=bool, na_value=False)
+    return outlier
+
+class StreamingOutliers:
+    """
+    Docstring for StreamingOutliers
+    Même masque que iqr_outliers sur l'ensemble des données, calculé sur des morceaux successifs (triés par date, dans l'ordre):
+    les lignes du morceau précédent qui peuvent encore être dans la fenêtre d'une ligne du morceau suivant
+    (les w-1 dernières, ou celles de moins de duree avant la dernière date) sont gardées et placées devant le morceau suivant
+    """
+    def __init__(self, attrs: list, duree, approx: bool = False):
+        self.attrs = attrs
+        self.duree = duree
+        self.approx = approx
+        self.tail = None
+
+    def mask(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        :param df: morceau suivant, index de dates trié et postérieur au morceau précédent
+        :return: masque des outliers du morceau
+        """
+        if len(df) == 0:
+            return np.zeros(0, dtype=bool)
+        chunk = df[self.attrs]
+        window = chunk if self.tail is None else pd.concat([self.tail, chunk])
+        outlier = iqr_outliers(window, self.attrs, self.duree, self.approx)[len(window) - len(chunk):]
+        if isinstance(self.duree, (int, np.integer)):
+            self.tail = window.iloc[max(len(window) - int(self.duree) + 1, 0):] if self.duree > 1 else window.iloc[:0]
+        else:
+            debut = window.index.searchsorted(window.index[-1] - pd.Timedelta(self.duree), side="right")
+            self.tail = window.iloc[debut:]
+        return outlier
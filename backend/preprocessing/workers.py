@@ -0,0 +1,67 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for preprocessing.workers
+
+Pools de processus du prétraitement (plages du json brut, partitions)
+L'annulation d'un job (cf server/jobs.py) envoie SIGTERM à tout son groupe de processus: chacun doit dérouler sa pile
+(finally, répertoires temporaires, fichiers .tmp des partitions) puis s'arrêter
+Les processus d'un pool n'héritent du gestionnaire de signal et du rapporteur d'avancement (cf progress.py) qu'avec fork,
+pas avec forkserver (méthode par défaut depuis python 3.14) ni spawn: process_pool les installe dans chaque processus du pool
+
+Fonctions:
+stop_on_sigterm:
+    SIGTERM lève SystemExit dans le processus courant
+process_pool:
+    ProcessPoolExecutor dont les processus s'arrêtent proprement sur SIGTERM, quelle que soit la méthode de démarrage
+"""
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from . import progress
+
+def _stop(signum, frame):
+    #un pool cassé (un de ses processus vient de s'arrêter) renvoie SIGTERM aux autres: le nettoyage ne doit pas être interrompu
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise SystemExit(128 + signum) #la pile est déroulée: finally et gestionnaires de contexte s'exécutent
+
+def stop_on_sigterm():
+    signal.signal(signal.SIGTERM, _stop)
+
+def _init_worker(reporter):
+    stop_on_sigterm()
+    progress.set_reporter(reporter)
+
+def _run_task(fn, *args, **kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except SystemExit as e:
+        #ProcessPoolExecutor renverrait l'exception puis passerait à la tâche suivante: le processus quitte le pool
+        os._exit(e.code if isinstance(e.code, int) else 1)
+
+class _Pool(ProcessPoolExecutor):
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(_run_task, fn, *args, **kwargs)
+
+def process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Docstring for process_pool
+    Les tâches d'un processus qui reçoit SIGTERM sont interrompues (SystemExit), le processus quitte ensuite le pool:
+    les tâches en attente échouent (BrokenProcessPool) au lieu d'être lancées après l'annulation
+
+    :param max_workers: nombre de processus
+    :type max_workers: int
+    :rtype: ProcessPoolExecutor
+    """
+    return _Pool(max_workers=max_workers, initializer=_init_worker, initargs=(progress.get_reporter(),))
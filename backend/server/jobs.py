@@ -0,0 +1,275 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for backend.server.jobs
+
+Prétraitements lancés en arrière-plan: chaque job tourne dans son propre processus,
+la boucle d'évènements d'uvicorn n'est jamais bloquée et les autres routes (stats...) restent disponibles pendant le calcul
+Le processus du job envoie son avancement (cf preprocessing/progress.py) dans une file lue à chaque demande de statut
+Un job peut aussi lire le json brut au fil d'un upload (submit_stream): le serveur lui passe les morceaux reçus par une autre file
+
+Classes:
+JobConflict:
+    un prétraitement tourne déjà sur le même fichier brut (ou un upload en cours de prétraitement)
+PreprocessingJob:
+    un prétraitement et son état
+JobManager:
+    lance, suit et annule les jobs
+"""
+import multiprocessing as mp
+import os
+import queue
+import signal
+import time
+import uuid
+
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+CANCELLED = "cancelled"
+STREAM_QUEUE_SIZE = 64 #morceaux d'upload en attente au plus: un traitement lent ralentit l'upload au lieu de remplir la RAM
+MAX_FINISHED = 100 #jobs terminés gardés pour les demandes de statut, les plus anciens sont oubliés
+MAX_WORKERS = 8 #processus par job au plus quand le nombre n'est pas fixé: chacun a une partition en mémoire
+
+
+class JobConflict(Exception):
+    """
+    Docstring for JobConflict
+    Un job non terminé utilise déjà ce fichier brut, ou un job d'upload peut écrire les mêmes partitions
+    """
+
+
+def _run_job(events, rolling_interval, attrList: list, file: str | None, append: bool, memory_budget: int | None, nb_workers: int, chunks=None):
+    """
+    Corps du processus d'un job: prétraitement complet, l'avancement et le résultat partent dans events
+    Sans file, le json brut arrive par morceaux dans chunks (None: fin de l'upload)
+    nb_workers: processus qui applatissent le json et nettoient les partitions (cf prepare_data)
+    Une annulation (SIGTERM) termine le job proprement puis resynchronise le catalogue des partitions avec les fichiers présents
+    """
+    from preprocessing.workers import stop_on_sigterm
+    stop_on_sigterm() #SystemExit: la pile est déroulée (répertoires temporaires...), les processus des pools installent le même gestionnaire (cf process_pool)
+    if hasattr(os, "setsid"):
+        os.setsid() #groupe de processus à part: l'annulation arrête aussi les processus des pools (et le serveur forkserver)
+    from preprocessing import prepare_data, prepare_stream
+    from preprocessing.progress import set_reporter
+    from preprocessing.store import resync_catalog
+    from preprocessing.streamIngest import QueueReader, is_input_error
+    set_reporter(events.put)
+    try:
+        if file is None:
+            prepare_stream(rolling_interval, attrList, QueueReader(source=chunks), append, memory_budget, nb_workers)
+        else:
+            prepare_data(rolling_interval, attrList, file, nb_workers, append, memory_budget)
+    except SystemExit:
+        resync_catalog() #une partition supprimée par write_dataset avant l'arrêt ne doit plus y figurer
+        raise
+    except Exception as e:
+        events.put({"state": ERROR, "error": f"{type(e).__name__}: {e}", "input_error": is_input_error(e)})
+    else:
+        events.put({"state": DONE})
+
+
+class PreprocessingJob:
+    """
+    Docstring for PreprocessingJob
+    """
+    def __init__(self, file: str | None, process, events, chunks=None):
+        self.id = uuid.uuid4().hex
+        self.file = file #None: json brut reçu par upload (cf send)
+        self.process = process
+        self.events = events
+        self.chunks = chunks
+        self.state = RUNNING
+        self.stage = "queued"
+        self.partition = None
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.input_error = False #l'erreur vient du json reçu et pas du serveur
+        self.started = time.time()
+        self.ended = None
+
+    def poll(self) -> bool:
+        """
+        Lit les messages arrivés depuis le dernier appel
+        :return: True si le job vient de se terminer avec succès
+        """
+        if self.state != RUNNING:
+            return False
+        alive = self.process.is_alive() #avant de vider la file: un processus fini a déjà tout envoyé
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if "state" in event:
+                self.state = event["state"]
+                self.error = event.get("error")
+                self.input_error = event.get("input_error", False)
+            elif event["stage"] == "partitions":
+                self.done, self.total = event["done"], event["total"]
+            else:
+                self.stage = event["stage"]
+                self.partition = event.get("partition")
+        if self.state == RUNNING and not alive:
+            #arrêt sans message (tué, manque de mémoire...)
+            self.state = ERROR
+            self.error = f"processus arrêté (code {self.process.exitcode})"
+        if self.state != RUNNING:
+            self.ended = time.time()
+            self.process.join()
+            return self.state == DONE
+        return False
+
+    def reading(self) -> bool:
+        """
+        :return: True tant que le job lit encore le json brut (les erreurs de format ne sont pas encore toutes connues)
+        """
+        return self.state == RUNNING and self.total == 0 and self.stage in ("queued", "flatten")
+
+    def send(self, chunk: bytes | None) -> bool:
+        """
+        Passe un morceau de l'upload au processus du job (None: fin de l'upload), bloquant si sa file est pleine
+        :return: False si le processus ne lit plus (arrêté)
+        """
+        while self.process.is_alive():
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def cancel(self):
+        if self.state != RUNNING:
+            return
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except ProcessLookupError: #setsid pas encore appelé: pas encore de groupe, ni de pool
+                self.process.terminate()
+        else:
+            self.process.terminate()
+        self.process.join()
+        self.state = CANCELLED
+        self.ended = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "stage": self.stage,
+            "partition": self.partition,
+            "partitions_done": self.done,
+            "partitions_total": self.total,
+            "error": self.error,
+            "elapsed": round((self.ended or time.time()) - self.started, 1),
+        }
+
+
+class JobManager:
+    """
+    Docstring for JobManager
+    Un seul job à la fois par fichier brut, les MAX_FINISHED derniers jobs terminés restent consultables
+    """
+    def __init__(self, on_success=None, nb_workers: int | None = None):
+        """
+        :param on_success: appelée (sans argument) dans le serveur quand un job réussit, par exemple pour vider le cache des données
+        :param nb_workers: processus par job (None: un par coeur, MAX_WORKERS au plus)
+        """
+        self.context = mp.get_context("spawn") #pas de fork d'un serveur multi-threadé
+        self.jobs = {}
+        self.on_success = on_success
+        self.nb_workers = nb_workers or min(os.cpu_count() or 1, MAX_WORKERS)
+
+    def _poll(self, job: PreprocessingJob):
+        if job.poll() and self.on_success is not None:
+            self.on_success()
+
+    def _evict(self):
+        finished = sorted((job for job in self.jobs.values() if job.state != RUNNING), key=lambda job: job.ended)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del self.jobs[job.id]
+
+    def busy(self, file: str | None) -> bool:
+        """
+        :param file: fichier brut, None pour n'importe quel job
+        :return: True si un job non terminé utilise file
+        """
+        file = os.path.realpath(file) if file is not None else None
+        for job in self.jobs.values():
+            self._poll(job)
+            if job.state == RUNNING and (file is None or job.file == file):
+                return True
+        return False
+
+    def _uploading(self) -> bool:
+        return any(job.state == RUNNING and job.file is None for job in self.jobs.values())
+
+    def submit(self, rolling_interval, attrList: list, file: str, append: bool = False, memory_budget: int | None = None) -> PreprocessingJob:
+        """
+        Docstring for submit
+        Lance le prétraitement de file dans un nouveau processus et rend la main tout de suite
+
+        :param memory_budget: mode hors mémoire (octets), cf prepare_data
+        :raises JobConflict: un prétraitement de file est déjà en cours
+        """
+        if self.busy(file):
+            raise JobConflict(f"Un prétraitement de {os.path.basename(file)} est déjà en cours")
+        if self._uploading(): #busy vient de mettre à jour l'état de tous les jobs
+            raise JobConflict("Un prétraitement de données envoyées par upload est en cours")
+        self._evict()
+        events = self.context.Queue()
+        process = self.context.Process(target=_run_job, args=(events, rolling_interval, list(attrList), file, append, memory_budget, self.nb_workers), daemon=False) #non daemon: prepare_data peut lancer son propre pool de processus
+        process.start()
+        job = PreprocessingJob(os.path.realpath(file), process, events)
+        self.jobs[job.id] = job
+        return job
+
+    def submit_stream(self, rolling_interval, attrList: list, append: bool = False, memory_budget: int | None = None) -> PreprocessingJob:
+        """
+        Docstring for submit_stream
+        Lance un prétraitement dont le json brut arrive par upload: l'appelant passe les morceaux avec job.send puis job.send(None)
+        Les partitions touchées ne sont connues qu'à la lecture: le job est en conflit avec tous les autres
+
+        :raises JobConflict: un autre prétraitement est en cours
+        """
+        if self.busy(None):
+            raise JobConflict("Un prétraitement est déjà en cours")
+        self._evict()
+        events = self.context.Queue()
+        chunks = self.context.Queue(STREAM_QUEUE_SIZE)
+        chunks.cancel_join_thread() #morceaux jamais lus (job arrêté): le serveur ne doit pas attendre pour eux à sa fermeture
+        process = self.context.Process(target=_run_job, args=(events, rolling_interval, list(attrList), None, append, memory_budget, self.nb_workers, chunks), daemon=False)
+        process.start()
+        job = PreprocessingJob(None, process, events, chunks)
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> PreprocessingJob:
+        """
+        :raises KeyError: job inconnu
+        """
+        job = self.jobs[job_id]
+        self._poll(job)
+        return job
+
+    def cancel(self, job_id: str) -> PreprocessingJob:
+        """
+        Arrête le job (et ses processus), la partition en cours d'écriture peut être incomplète
+        :raises KeyError: job inconnu
+        """
+        job = self.get(job_id)
+        job.cancel()
+        return job
@@ -16,10 +16,15 @@ Docstring for backend.server.main
 
 Server HTTP FastAPI pour l'application 
 """
-from fastapi import FastAPI,UploadFile,File,HTTPException
+from fastapi import FastAPI,UploadFile,File,HTTPException,Request,Query
+from typing import List, Literal
+import asyncio
 import os
 from server.models.preprocessing import PreprocessRequest
-from preprocessing import prepare_data
+from preprocessing.rawInput import detect_compression,HEAD_SIZE
+from preprocessing.store import migrate_legacy_layout
+from preprocessing.useData import cache
+from server.jobs import JobManager,JobConflict,ERROR
 from server.routes import stats, clustering, regression,trends
 #Initialisation
 app = FastAPI()
@@ -35,6 +40,8 @@ raw_data_dir=os.path.join(parent_dir,"preprocessing","Raw")
 os.makedirs(image_dir,exist_ok=True)
 os.makedirs(data_dir,exist_ok=True)
 os.makedirs(raw_data_dir,exist_ok=True)
+migrate_legacy_layout(data_dir) #anciennes données Data/<année>/<mois>/<Type>.parquet
+jobs=JobManager(on_success=cache.clear) #libère tout de suite les données remplacées (le cache les relirait de toute façon au prochain accès)
 
 
 async def root():
@@ -42,16 +49,24 @@ async def root():
 
 @app.post("/api/upload")
 async def uploadFile(file:UploadFile = File(...)): #syntaxe pour récupérer un fichier avec Fastapi
+    #un fichier compressé (gzip, zstd, xz, bz2) est enregistré tel quel, il sera décompressé à la volée lors du flatten
     path=os.path.join(raw_data_dir,"raw.json")
+    if jobs.busy(path):
+        raise HTTPException(status_code=409,detail="Un prétraitement du fichier précédent est en cours")
+    compression=None
     with open(path,"wb") as f:
+        premier=True
         while True:
             partie=await file.read(1024*1024) #lecture de 1 Mio à la fois pour ne pas prendre toute la RAM pour écrire un JSON
             if not partie:
                 break
+            if premier:
+                compression=detect_compression(partie[:HEAD_SIZE])
+                premier=False
             f.write(partie)
+    return {"status":"ok","compression":compression}
 
-@app.post("/api/preprocessing")
-async def preprocessing(data:PreprocessRequest):
+def check_preprocess_request(data:PreprocessRequest):
     if not data.attrList:
         raise HTTPException(
             status_code=400,
@@ -71,10 +86,80 @@ async def preprocessing(data:PreprocessRequest):
                 status_code=400,
                 detail="rollingInterval invalide pour le mode durée"
             )
+
+@app.post("/api/upload/stream",status_code=202)
+async def uploadStream(request:Request,
+                       rollingIntervalType:Literal["nb", "Duree"],
+                       rollingInterval:str,
+                       attrList:List[str]=Query(default=[]),
+                       append:bool=False,
+                       memoryBudget:int|None=None):
+    """
+    Upload + prétraitement en un seul appel: le corps de la requête est le json brut (pas de multipart), éventuellement compressé
+    il est décompressé et applati au fur et à mesure qu'il arrive par un job (cf server/jobs.py), sans passer par Raw/raw.json
+    La réponse arrive une fois le json entièrement lu: 400 s'il est invalide, sinon l'identifiant du job dont le nettoyage
+    des partitions se suit (et s'annule) comme celui de /api/preprocessing
+    ex: curl -T raw.json "http://localhost:8000/api/upload/stream?rollingIntervalType=nb&rollingInterval=30&attrList=rssi&attrList=lsnr"
+    """
+    if rollingIntervalType == "nb" and rollingInterval.isdigit():
+        rollingInterval=int(rollingInterval)
+    data=PreprocessRequest(rollingIntervalType=rollingIntervalType,rollingInterval=rollingInterval,attrList=attrList,append=append,memoryBudget=memoryBudget)
+    check_preprocess_request(data)
+
+    try:
+        budget=data.memoryBudget*1024*1024 if data.memoryBudget else None
+        job=jobs.submit_stream(data.rollingInterval,data.attrList,data.append,budget)
+    except JobConflict as e:
+        raise HTTPException(status_code=409,detail=str(e))
+    try:
+        async for partie in request.stream():
+            if partie and not await asyncio.to_thread(job.send,partie):
+                break #le traitement s'est arrêté (erreur), inutile de lire la suite
+    except BaseException:
+        await asyncio.to_thread(jobs.cancel,job.id) #upload interrompu: un json tronqué ne doit pas être rangé
+        raise
+    await asyncio.to_thread(job.send,None)
+    while jobs.get(job.id).reading():
+        await asyncio.sleep(0.1)
+    if job.state == ERROR:
+        raise HTTPException(status_code=400 if job.input_error else 500,detail=f"Fichier invalide: {job.error}" if job.input_error else job.error)
+    return {"status":"ok","job_id":job.id}
+
+@app.post("/api/preprocessing",status_code=202)
+async def preprocessing(data:PreprocessRequest):
+    """
+    Lance le prétraitement de Raw/raw.json dans un processus à part et renvoie tout de suite l'identifiant du job
+    l'avancement se suit avec GET /api/preprocessing/{job_id}
+    """
+    check_preprocess_request(data)
     
     file=os.path.join(raw_data_dir,"raw.json")
+    if not os.path.exists(file):
+        raise HTTPException(status_code=404,detail="Aucun fichier envoyé")
+    try:
+        budget=data.memoryBudget*1024*1024 if data.memoryBudget else None
+        job=jobs.submit(data.rollingInterval,data.attrList,file,data.append,budget)
+    except JobConflict as e:
+        raise HTTPException(status_code=409,detail=str(e))
     
-    prepare_data(data.rollingInterval,data.attrList,file)
-    
-    return {"status":"ok","message":"Prétraitement terminé"}
+    return {"status":"ok","job_id":job.id}
+
+@app.get("/api/preprocessing/{job_id}")
+async def preprocessing_status(job_id:str):
+    """
+    État du job: state (running, done, error, cancelled), étape en cours (flatten, split, outlier, adr, operator, write)
+    et nombre de partitions terminées
+    """
+    try:
+        return jobs.get(job_id).to_dict()
+    except KeyError:
+        raise HTTPException(status_code=404,detail="Job inconnu")
+
+@app.post("/api/preprocessing/{job_id}/cancel")
+async def preprocessing_cancel(job_id:str):
+    try:
+        job=await asyncio.to_thread(jobs.cancel,job_id) #attend l'arrêt du processus sans bloquer le serveur
+    except KeyError:
+        raise HTTPException(status_code=404,detail="Job inconnu")
+    return job.to_dict()
         
\ No newline at end of file
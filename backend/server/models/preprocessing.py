@@ -5,3 +5,5 @@ class PreprocessRequest(BaseModel):
     rollingIntervalType: Literal["nb", "Duree"]
     rollingInterval: str | int
     attrList: List[str]
+    append: bool = False #ajoute aux données existantes au lieu de les remplacer
+    memoryBudget: int | None = None #mode hors mémoire: mémoire en Mio pour le nettoyage des partitions
@@ -0,0 +1,46 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for tests.conftest
+
+Les tests importent les paquets du backend comme le serveur (preprocessing, server...): python -m pytest depuis backend/
+
+Fixtures:
+data_dir:
+    répertoire Data temporaire à la place de preprocessing/Data
+"""
+import inspect
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing import store
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    Répertoire Data temporaire: les fonctions de store.py l'utilisent comme data_dir par défaut
+    (la valeur par défaut est fixée à l'import, il faut la remplacer fonction par fonction)
+    """
+    dossier = str(tmp_path / "Data")
+    for fonction in [*vars(store).values(), store.PartitionWriter.__init__]:
+        if inspect.isfunction(fonction) and fonction.__module__ == store.__name__ and store.DATA_DIR in (fonction.__defaults__ or ()):
+            defauts = tuple(dossier if defaut is store.DATA_DIR else defaut for defaut in fonction.__defaults__)
+            monkeypatch.setattr(fonction, "__defaults__", defauts)
+    monkeypatch.setattr(store, "DATA_DIR", dossier)
+    return dossier
@@ -0,0 +1,131 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for tests.test_datasetCache
+
+Projection (colonnes), budget en octets et invalidation par signature du cache de useData
+"""
+import numpy as np
+import pandas as pd
+
+from preprocessing.datasetCache import DatasetCache, _nbytes
+
+MARS = ("year=2023/month=3/Type=Join%20Request/part-0.parquet", "h1")
+AVRIL = ("year=2023/month=4/Type=Join%20Request/part-0.parquet", "h2")
+
+
+def donnees(n: int = 1000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"rssi": rng.normal(-90, 8, n), "lsnr": rng.normal(0, 5, n), "SF": rng.integers(7, 13, n)})
+
+
+class Lecteur:
+    """
+    load de DatasetCache.get qui compte ses appels
+    """
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.appels = 0
+
+    def __call__(self, columns=None):
+        self.appels += 1
+        return self.df if columns is None else self.df[list(columns)]
+
+
+def test_colonnes_servies_par_une_entree_plus_large():
+    cache = DatasetCache(1 << 30)
+    lecteur = Lecteur(donnees())
+    tout = cache.get("mars", None, (MARS,), lecteur)
+    deux = cache.get("mars", frozenset({"rssi", "lsnr"}), (MARS,), lecteur)
+    une = cache.get("mars", frozenset({"SF"}), (MARS,), lecteur)
+    assert lecteur.appels == 1
+    assert list(deux.columns) == ["rssi", "lsnr"]
+    pd.testing.assert_frame_equal(une, tout[["SF"]])
+
+
+def test_entree_plus_large_remplace_les_projections():
+    cache = DatasetCache(1 << 30)
+    lecteur = Lecteur(donnees())
+    cache.get("mars", frozenset({"rssi"}), (MARS,), lambda: lecteur({"rssi"}))
+    cache.get("mars", frozenset({"rssi", "lsnr"}), (MARS,), lambda: lecteur({"rssi", "lsnr"}))
+    assert len(cache) == 1 #la projection sur rssi est contenue dans la nouvelle entrée
+    cache.get("mars", frozenset({"rssi"}), (MARS,), lambda: lecteur({"rssi"}))
+    cache.get("mars", frozenset({"SF"}), (MARS,), lambda: lecteur({"SF"}))
+    assert lecteur.appels == 3
+    assert len(cache) == 2
+
+
+def test_copie_pour_chaque_appelant():
+    cache = DatasetCache(1 << 30)
+    lecteur = Lecteur(donnees())
+    df = cache.get("mars", None, (MARS,), lecteur)
+    df["rssi"] = 0.0
+    df.loc[0, "lsnr"] = 100.0
+    df["nouvelle"] = 1
+    pd.testing.assert_frame_equal(cache.get("mars", None, (MARS,), lecteur), donnees())
+    assert lecteur.appels == 1
+
+
+def test_eviction_sous_le_budget():
+    taille = _nbytes(donnees())
+    cache = DatasetCache(2 * taille + taille // 2) #deux entrées au plus
+    lecteurs = {mois: Lecteur(donnees(seed=i)) for i, mois in enumerate(["janvier", "fevrier", "mars"])}
+    cache.get("janvier", None, (MARS,), lecteurs["janvier"])
+    cache.get("fevrier", None, (MARS,), lecteurs["fevrier"])
+    cache.get("janvier", None, (MARS,), lecteurs["janvier"]) #janvier devient la plus récente
+    cache.get("mars", None, (MARS,), lecteurs["mars"])
+    assert len(cache) == 2
+    assert cache.nbytes == 2 * taille <= cache.max_bytes
+    cache.get("janvier", None, (MARS,), lecteurs["janvier"])
+    cache.get("fevrier", None, (MARS,), lecteurs["fevrier"]) #la moins récente est partie
+    assert [lecteur.appels for lecteur in lecteurs.values()] == [1, 2, 1]
+
+
+def test_entree_plus_grosse_que_le_budget():
+    cache = DatasetCache(_nbytes(donnees()) // 2)
+    lecteur = Lecteur(donnees())
+    pd.testing.assert_frame_equal(cache.get("mars", None, (MARS,), lecteur), donnees())
+    cache.get("mars", None, (MARS,), lecteur)
+    assert lecteur.appels == 2
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_invalidation_quand_la_signature_change():
+    cache = DatasetCache(1 << 30)
+    lecteur = Lecteur(donnees())
+    cache.get("mars", None, (MARS,), lecteur)
+    cache.get("mars", None, ((MARS[0], "h1 réécrit"),), lecteur)
+    assert lecteur.appels == 2
+    assert len(cache) == 1
+
+
+def test_invalidation_des_autres_cles():
+    """
+    Une partition réécrite rend obsolètes toutes les entrées qui l'ont lue, pas seulement celle de la clé demandée
+    """
+    cache = DatasetCache(1 << 30)
+    lecteur = Lecteur(donnees())
+    cache.get("mars", None, (MARS,), lecteur)
+    cache.get("mars rssi", frozenset({"rssi"}), (MARS,), lambda: lecteur({"rssi"}))
+    cache.get("printemps", None, (MARS, AVRIL), lecteur)
+    cache.get("avril", None, (AVRIL,), lecteur)
+    assert len(cache) == 4
+    taille_avril = cache.entries[("avril", None)][2]
+    cache.get("mars", None, ((MARS[0], "h1 réécrit"),), lecteur)
+    assert set(cache.entries) == {("mars", None), ("avril", None)}
+    assert cache.nbytes == taille_avril + cache.entries[("mars", None)][2]
+    appels = lecteur.appels
+    cache.get("avril", None, (AVRIL,), lecteur)
+    assert lecteur.appels == appels
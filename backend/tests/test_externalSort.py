@@ -0,0 +1,153 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for tests.test_externalSort
+
+Tri externe comparé au tri en mémoire (sort_index stable), et mode hors mémoire comparé à produce_dataset
+"""
+import base64
+import io
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from preprocessing.externalSort import sort_runs, merge_runs, external_sort, SORT_KEY
+from preprocessing.preprocessing_utils import _produce_partition
+from preprocessing.spill import spill_stream, spilled_partitions
+from preprocessing.flatten_datas import present_columns
+from preprocessing.store import read_partition
+
+
+def lignes(n: int, seed: int, nb_dates: int) -> pd.DataFrame:
+    """
+    n lignes sur nb_dates dates distinctes (beaucoup de dates égales si nb_dates est petit), quelques dates invalides
+    pos: position d'entrée, pour vérifier l'ordre à date égale
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp("2023-01-01", tz="UTC") + pd.to_timedelta(rng.integers(0, nb_dates, n), unit="s")
+    timestamps = pd.Series(dates.strftime("%Y-%m-%dT%H:%M:%SZ"))
+    timestamps[rng.random(n) < 0.01] = "pas une date"
+    return pd.DataFrame({"@timestamp": timestamps, "pos": np.arange(n), "rssi": rng.normal(-90, 8, n)})
+
+
+def morceaux(df: pd.DataFrame, seed: int) -> list:
+    """
+    Découpe df en pa.Table de tailles inégales (dont des tables vides)
+    """
+    rng = np.random.default_rng(seed)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    bornes = np.unique(np.concatenate([[0, len(df)], rng.integers(0, len(df), 12)]))
+    return [table.slice(debut, fin - debut) for debut, fin in zip(bornes[:-1], bornes[1:])] + [table.slice(0, 0)]
+
+
+def tri_en_memoire(df: pd.DataFrame) -> pd.DataFrame:
+    index = pd.to_datetime(df["@timestamp"], errors="coerce", utc=True)
+    return df.set_index(index).sort_index(kind="stable").reset_index(drop=True)
+
+
+@pytest.mark.filterwarnings("ignore:Could not infer format") #morceau qui commence par une date invalide
+@pytest.mark.parametrize("n,nb_dates", [(1, 1), (500, 3), (3000, 50), (3000, 100_000)])
+@pytest.mark.parametrize("rows", [1, 7, 256, 10_000])
+def test_external_sort_comme_tri_en_memoire(tmp_path, n, nb_dates, rows):
+    df = lignes(n, seed=n + nb_dates, nb_dates=nb_dates)
+    sortie = list(external_sort(morceaux(df, rows), str(tmp_path), rows))
+    trie = pa.concat_tables(sortie).to_pandas()
+    cles = trie.pop(SORT_KEY).to_numpy()
+    assert (np.diff(cles) >= 0).all()
+    pd.testing.assert_frame_equal(trie, tri_en_memoire(df))
+
+
+def test_sort_runs_inegaux(tmp_path):
+    df = lignes(2000, seed=1, nb_dates=20)
+    tables = morceaux(df, seed=1)
+    runs = sort_runs(tables, str(tmp_path), 300)
+    tailles = [pq.read_metadata(run).num_rows for run in runs]
+    assert sum(tailles) == len(df)
+    assert len(set(tailles)) > 1 #les runs suivent les morceaux d'entrée: au moins 300 lignes sauf le dernier
+    assert all(taille >= 300 for taille in tailles[:-1])
+    contenu = []
+    for run in runs:
+        table = pq.read_table(run).to_pandas()
+        assert table[SORT_KEY].is_monotonic_increasing
+        contenu.append(table)
+    #même multiensemble de lignes que l'entrée
+    pd.testing.assert_frame_equal(pd.concat(contenu).drop(columns=SORT_KEY).sort_values("pos").reset_index(drop=True), df)
+
+
+@pytest.mark.parametrize("rows_per_chunk", [1, 10, 5000])
+def test_merge_runs_dates_egales(tmp_path, rows_per_chunk):
+    """
+    Toutes les lignes à la même date: l'ordre des runs puis l'ordre dans chaque run est conservé
+    """
+    df = lignes(1500, seed=2, nb_dates=1)
+    df["@timestamp"] = "2023-01-01T00:00:00Z"
+    runs = sort_runs(morceaux(df, seed=2), str(tmp_path), 100)
+    sortie = pa.concat_tables(list(merge_runs(runs, rows_per_chunk))).to_pandas()
+    np.testing.assert_array_equal(sortie["pos"].to_numpy(), df["pos"].to_numpy())
+
+
+def paquets_bruts(n: int, seed: int, debut: str = "2023-03-01") -> bytes:
+    """
+    json brut de n paquets sur un mois: dates répétées, valeurs manquantes et quelques valeurs aberrantes
+    """
+    rng = np.random.default_rng(seed)
+    secondes = np.sort(rng.integers(0, 27 * 86400 // 60, n)) * 60
+    dates = pd.Timestamp(debut, tz="UTC") + pd.to_timedelta(secondes, unit="s")
+    types = ["Confirmed Data Up", "Unconfirmed Data Up"]
+    brut = {}
+    for i in rng.permutation(n):
+        rx = {"freq": 868.1, "rssi": int(rng.integers(-120, -40)), "lsnr": round(float(rng.normal(0, 5)), 1),
+              "data": base64.b64encode(bytes([0x40, 1, 2, 3, 4, 0x80, 5, 0, 1]) + rng.bytes(8)).decode()}
+        if rng.random() < 0.05:
+            del rx["rssi"]
+        if rng.random() < 0.01:
+            rx["lsnr"] = float(rng.choice([80.0, -90.0]))
+        brut[f"id{i}"] = {"@timestamp": dates[i].strftime("%Y-%m-%dT%H:%M:%SZ"), "Type": types[i % 2],
+                          "GW_EUI": "ab"[int(rng.integers(2))], "Dev_Add": "01020304", "rxpk": [rx]}
+    return json.dumps(brut).encode()
+
+
+def partitions_ecrites(spill_dir: str, attrs: list, duree, append: bool, memory_budget) -> dict:
+    partitions = spilled_partitions(spill_dir)
+    colonnes = present_columns([f for fichiers in partitions.values() for f in fichiers], attrs)
+    for key, fichiers in partitions.items():
+        _produce_partition(key, fichiers, duree, attrs, append, memory_budget, colonnes)
+    return {key: read_partition(*key) for key in partitions}
+
+
+@pytest.mark.parametrize("duree", [30, "1h"])
+def test_out_of_core_comme_en_memoire(tmp_path, data_dir, duree):
+    """
+    memory_budget minuscule: morceaux de rows_for_budget(minimum) lignes, beaucoup de runs et de morceaux par partition
+    """
+    attrs = ["rssi", "lsnr"]
+    for i, brut in enumerate([paquets_bruts(5000, seed=3), paquets_bruts(2000, seed=4, debut="2023-03-20")]):
+        spill_stream(io.BytesIO(brut), str(tmp_path / f"spill{i}"))
+    resultats = []
+    for memory_budget in (None, 1):
+        shutil.rmtree(data_dir, ignore_errors=True)
+        premier = partitions_ecrites(str(tmp_path / "spill0"), attrs, duree, False, memory_budget)
+        ajout = partitions_ecrites(str(tmp_path / "spill1"), attrs, duree, True, memory_budget)
+        resultats.append((premier, ajout))
+    (premier, ajout), (premier_ooc, ajout_ooc) = resultats
+    for attendu, obtenu in [(premier, premier_ooc), (ajout, ajout_ooc)]:
+        assert attendu.keys() == obtenu.keys()
+        for key in attendu:
+            assert len(attendu[key]) > 0
+            pd.testing.assert_frame_equal(obtenu[key], attendu[key])
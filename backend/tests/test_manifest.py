@@ -0,0 +1,163 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for tests.test_manifest
+
+Le catalogue Data/_manifest.json doit toujours décrire les fichiers présents sur le disque:
+après une écriture, un ajout, une annulation (resync_catalog) et la migration de l'ancienne arborescence
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytest
+
+from preprocessing import manifest, store
+from preprocessing.store import write_partition, PartitionWriter, catalog, resync_catalog, migrate_legacy_layout
+
+
+def paquets(n: int, debut: str, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "@timestamp": pd.Timestamp(debut, tz="UTC") + pd.to_timedelta(np.sort(rng.integers(0, 86400, n)), unit="s"),
+        "GW_EUI": rng.choice(["a", "b"], n),
+        "rssi": rng.integers(-120, -40, n),
+        "lsnr": rng.normal(0, 5, n).round(1),
+    })
+
+
+def verifie_catalogue(data_dir: str) -> dict:
+    """
+    Catalogue écrit identique à celui qu'on reconstruit en parcourant les fichiers, chaque entrée décrit son fichier
+    """
+    partitions = manifest.load(data_dir)
+    assert partitions is not None
+    assert partitions == store._scan_partitions(data_dir)
+    for entree in partitions.values():
+        chemin = os.path.join(data_dir, entree["path"])
+        assert os.path.exists(chemin)
+        assert entree["rows"] == pq.read_metadata(chemin).num_rows
+        assert entree["bytes"] == os.path.getsize(chemin)
+    return partitions
+
+
+def test_ecriture(data_dir):
+    write_partition(paquets(500, "2023-03-02"), 2023, 3, "Confirmed Data Up")
+    write_partition(paquets(300, "2023-04-10"), 2023, 4, "Join Request")
+    partitions = verifie_catalogue(data_dir)
+    assert sorted(partitions) == ["2023/3/Confirmed Data Up", "2023/4/Join Request"]
+    entree = partitions["2023/3/Confirmed Data Up"]
+    assert entree["rows"] == 500
+    assert pd.Timestamp(entree["min_timestamp"]) >= pd.Timestamp("2023-03-02", tz="UTC")
+    assert pd.Timestamp(entree["max_timestamp"]) < pd.Timestamp("2023-03-03", tz="UTC")
+
+
+def test_ajout(data_dir):
+    """
+    Ajout hors mémoire: la partition est réécrite par PartitionWriter, partition vide retirée du catalogue
+    """
+    write_partition(paquets(500, "2023-03-02"), 2023, 3, "Confirmed Data Up")
+    write_partition(paquets(100, "2023-03-05"), 2023, 3, "Join Request")
+    avant = verifie_catalogue(data_dir)
+    with PartitionWriter(2023, 3, "Confirmed Data Up") as writer:
+        writer.write(paquets(500, "2023-03-02"))
+        writer.write(paquets(200, "2023-03-03", seed=1))
+    apres = verifie_catalogue(data_dir)
+    assert apres["2023/3/Confirmed Data Up"]["rows"] == 700
+    assert apres["2023/3/Join Request"] == avant["2023/3/Join Request"]
+    write_partition(paquets(0, "2023-03-05"), 2023, 3, "Join Request")
+    assert list(verifie_catalogue(data_dir)) == ["2023/3/Confirmed Data Up"]
+
+
+def test_catalogue_absent(data_dir):
+    write_partition(paquets(50, "2023-03-02"), 2023, 3, "Confirmed Data Up")
+    os.remove(os.path.join(data_dir, manifest.MANIFEST_FILE))
+    assert list(catalog()) == ["2023/3/Confirmed Data Up"]
+    verifie_catalogue(data_dir)
+
+
+def test_annulation_pendant_ecriture(data_dir, monkeypatch):
+    """
+    SystemExit (SIGTERM d'une annulation) entre l'écriture du fichier et la mise à jour du catalogue,
+    puis écriture hors mémoire interrompue: resync_catalog remet le catalogue d'accord avec les fichiers
+    """
+    write_partition(paquets(500, "2023-03-02"), 2023, 3, "Confirmed Data Up")
+    write_partition(paquets(100, "2023-03-05"), 2023, 3, "Join Request")
+
+    def annule(*args):
+        raise SystemExit(143)
+    with monkeypatch.context() as patch:
+        patch.setattr(store, "_record_partition", annule)
+        with pytest.raises(SystemExit):
+            write_partition(paquets(800, "2023-03-02", seed=1), 2023, 3, "Confirmed Data Up")
+        with pytest.raises(SystemExit):
+            write_partition(paquets(0, "2023-03-05"), 2023, 3, "Join Request")
+
+    writer = PartitionWriter(2023, 4, "Confirmed Data Up")
+    writer.write(paquets(100, "2023-04-01")) #processus tué: ni close ni abort
+    writer.writer.close()
+    assert os.path.exists(writer.tmp)
+
+    perime = manifest.load(data_dir)
+    assert perime != store._scan_partitions(data_dir)
+    partitions = resync_catalog()
+    assert list(partitions) == ["2023/3/Confirmed Data Up"]
+    assert partitions["2023/3/Confirmed Data Up"]["rows"] == 800
+    assert verifie_catalogue(data_dir) == partitions
+
+
+def test_migration_ancienne_arborescence(data_dir):
+    anciens = {(2023, 3, "Confirmed Data Up"): 400, (2023, 3, "Join Request"): 50, (2024, 1, "Confirmed Data Up"): 120}
+    for (year, month, Type), n in anciens.items():
+        dossier = os.path.join(data_dir, str(year), str(month))
+        os.makedirs(dossier, exist_ok=True)
+        paquets(n, f"{year}-{month:02d}-02").to_parquet(os.path.join(dossier, f"{Type}.parquet"))
+    write_partition(paquets(10, "2023-05-02"), 2023, 5, "Join Request") #déjà au nouveau format
+
+    assert migrate_legacy_layout() == len(anciens)
+    partitions = verifie_catalogue(data_dir)
+    assert {cle: entree["rows"] for cle, entree in partitions.items()} == {
+        "2023/3/Confirmed Data Up": 400, "2023/3/Join Request": 50, "2024/1/Confirmed Data Up": 120, "2023/5/Join Request": 10}
+    assert not os.path.exists(os.path.join(data_dir, "2023"))
+    assert not os.path.exists(os.path.join(data_dir, "2024"))
+    assert migrate_legacy_layout() == 0
+
+
+def test_hash_change_quand_la_partition_est_reecrite(data_dir):
+    df = paquets(500, "2023-03-02")
+    write_partition(df, 2023, 3, "Confirmed Data Up")
+    avant = catalog()["2023/3/Confirmed Data Up"]["hash"]
+    df.loc[10, "lsnr"] = 0.0 #même nombre de lignes, même schéma
+    write_partition(df, 2023, 3, "Confirmed Data Up")
+    apres = verifie_catalogue(data_dir)["2023/3/Confirmed Data Up"]["hash"]
+    assert apres != avant
+
+
+def test_hash_suit_le_pied_de_page(tmp_path):
+    """
+    Même taille et même date de modification: le hash change quand même si les statistiques changent
+    """
+    chemins = [str(tmp_path / f"{i}.parquet") for i in range(2)]
+    table = pa.Table.from_pandas(paquets(200, "2023-03-02"))
+    for chemin, decalage in zip(chemins, [0.0, 1.0]): #sans compression ni dictionnaire: même taille
+        lsnr = pc.add(table.column("lsnr"), decalage)
+        pq.write_table(table.set_column(table.schema.get_field_index("lsnr"), "lsnr", lsnr), chemin, compression="none", use_dictionary=False)
+    assert os.path.getsize(chemins[0]) == os.path.getsize(chemins[1])
+    stat = os.stat(chemins[0])
+    os.utime(chemins[1], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert manifest._hash(chemins[0]) != manifest._hash(chemins[1])
+    assert manifest._hash(chemins[0]) == manifest._hash(chemins[0])
@@ -0,0 +1,123 @@
+# Copyright 2025 Charles Bouquet
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Docstring for tests.test_windowQuantiles
+
+iqr_outliers et StreamingOutliers comparés au filtre d'origine écrit avec pandas rolling(duree).quantile
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocessing.windowQuantiles import iqr_outliers, rolling_quantiles, StreamingOutliers
+
+ATTRS = ["rssi", "lsnr"]
+FENETRES = [5, 50, "30s", "10min"]
+
+
+def pandas_outliers(df: pd.DataFrame, attrs: list, duree) -> np.ndarray:
+    """
+    Filtre de référence: même calcul que produce_dataset avant windowQuantiles
+    """
+    outlier = np.zeros(len(df), dtype=bool)
+    for attr in attrs:
+        rolling = df[attr].rolling(duree)
+        q1 = rolling.quantile(0.25)
+        q3 = rolling.quantile(0.75)
+        IQRange = q3 - q1
+        x = df[attr]
+        outlier |= ((x <= (q1 - 1.5 * IQRange)) | (x >= (q3 + 1.5 * IQRange))).to_numpy(dtype=bool, na_value=False)
+    return outlier
+
+
+def paquets(n: int = 2000, seed: int = 0, egalites: bool = False, nan: bool = False) -> pd.DataFrame:
+    """
+    Paquets triés par date, avec des dates répétées et des valeurs aberrantes
+    egalites: valeurs entières (beaucoup de valeurs égales dans chaque fenêtre)
+    nan: un paquet sur dix sans valeur
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp("2023-01-01", tz="UTC") + pd.to_timedelta(np.cumsum(rng.integers(0, 20, n)), unit="s")
+    df = pd.DataFrame({
+        "rssi": rng.normal(-90, 8, n),
+        "lsnr": rng.normal(5, 3, n),
+    }, index=pd.DatetimeIndex(dates, name="@timestamp"))
+    aberrants = rng.choice(n, n // 50, replace=False)
+    df.iloc[aberrants, 0] += rng.choice([-60, 60], len(aberrants))
+    if egalites:
+        df = df.round(0)
+    if nan:
+        df.iloc[rng.choice(n, n // 10, replace=False), 1] = np.nan
+    return df
+
+
+@pytest.mark.parametrize("duree", FENETRES)
+@pytest.mark.parametrize("egalites", [False, True])
+def test_rolling_quantiles_comme_pandas(duree, egalites):
+    df = paquets(egalites=egalites)
+    for attr, (q1, q3) in rolling_quantiles(df, ATTRS, duree).items():
+        rolling = df[attr].rolling(duree)
+        pd.testing.assert_series_equal(q1, rolling.quantile(0.25), check_names=False)
+        pd.testing.assert_series_equal(q3, rolling.quantile(0.75), check_names=False)
+
+
+@pytest.mark.parametrize("duree", FENETRES)
+@pytest.mark.parametrize("egalites", [False, True])
+@pytest.mark.parametrize("nan", [False, True])
+def test_iqr_outliers_comme_pandas(duree, egalites, nan):
+    df = paquets(egalites=egalites, nan=nan)
+    attendu = pandas_outliers(df, ATTRS, duree)
+    assert attendu.any()
+    np.testing.assert_array_equal(iqr_outliers(df, ATTRS, duree), attendu)
+
+
+def test_iqr_outliers_ignore_les_colonnes_non_numeriques():
+    df = paquets()
+    df["GW_EUI"] = "b827ebfffe"
+    np.testing.assert_array_equal(iqr_outliers(df, ATTRS + ["GW_EUI"], 50), pandas_outliers(df, ATTRS, 50))
+
+
+@pytest.mark.parametrize("duree", FENETRES)
+@pytest.mark.parametrize("egalites", [False, True])
+@pytest.mark.parametrize("nan", [False, True])
+@pytest.mark.parametrize("taille", [1, 3, 7, 64, 499])
+def test_streaming_comme_pandas(duree, egalites, nan, taille):
+    """
+    Morceaux plus petits que la fenêtre, de taille quelconque: les fenêtres chevauchent une ou plusieurs limites de morceaux
+    """
+    df = paquets(600, seed=1, egalites=egalites, nan=nan)
+    streaming = StreamingOutliers(ATTRS, duree)
+    masque = np.concatenate([streaming.mask(df.iloc[i:i + taille]) for i in range(0, len(df), taille)])
+    np.testing.assert_array_equal(masque, pandas_outliers(df, ATTRS, duree))
+
+
+def test_streaming_limite_entre_dates_egales():
+    """
+    Morceaux coupés au milieu de paquets de même date: toutes les lignes de cette date restent dans la fenêtre suivante
+    """
+    df = paquets(600, seed=2, egalites=True)
+    df.index = df.index.floor("min")
+    limites = [0] + [i for i in range(1, len(df)) if df.index[i] == df.index[i - 1]][::25] + [len(df)]
+    for duree in ["1min", "5min", 20]:
+        streaming = StreamingOutliers(ATTRS, duree)
+        masque = np.concatenate([streaming.mask(df.iloc[debut:fin]) for debut, fin in zip(limites, limites[1:])])
+        np.testing.assert_array_equal(masque, pandas_outliers(df, ATTRS, duree))
+
+
+def test_streaming_morceau_vide():
+    df = paquets(100)
+    streaming = StreamingOutliers(ATTRS, "30s")
+    assert len(streaming.mask(df.iloc[:0])) == 0
+    masque = np.concatenate([streaming.mask(df.iloc[:40]), streaming.mask(df.iloc[40:40]), streaming.mask(df.iloc[40:])])
+    np.testing.assert_array_equal(masque, pandas_outliers(df, ATTRS, "30s"))
@@ -69,7 +69,7 @@ export function UploadForm(){
         <Dropzone
         onDrop={acceptedFiles => sendFile(acceptedFiles[0])}
         multiple={false}
-        accept={{ 'application/json': ['.json'] }}
+        accept={{ 'application/json': ['.json'], 'application/gzip': ['.gz'], 'application/zstd': ['.zst'], 'application/x-xz': ['.xz'], 'application/x-bzip2': ['.bz2'] }}
       >
         {({ getRootProps, getInputProps }) => (
           <section>
@@ -107,8 +107,19 @@ export function UploadForm(){
 }
 
 
+const etapes={ //étapes envoyées par le job de prétraitement
+  queued:"En attente",
+  flatten:"Applatissement du fichier",
+  sort:"Tri par date (hors mémoire)",
+  outlier:"Suppression des outliers",
+  adr:"Décodage des entêtes LoRaWAN",
+  operator:"Recherche des opérateurs",
+  write:"Écriture",
+}
+
 export function DateUploadForm({ setProcessed, processed }){
   const [isLoading,setIsLoading]=useState(false)
+  const [job,setJob]=useState(null)
   const [rollingInterval,setRollingInterval]=useState(0)
   const [rollingIntervalType,setRollingIntervalType]=useState("")
   const [attrList,setAttrList]=useState([])
@@ -137,6 +148,9 @@ const attributs=["Airtime","BitRate","rssi","lsnr"] //rajouter des attributs ici
       return ;
     }
     setIsLoading(true)
+    setErreur("")
+    setJob(null)
+    if (typeof setProcessed === 'function') setProcessed(false)
     const response=await fetch("http://localhost:8000/api/preprocessing",{
       method:"POST",
       credentials:"include",
@@ -155,16 +169,47 @@ const attributs=["Airtime","BitRate","rssi","lsnr"] //rajouter des attributs ici
       setIsLoading(false)
       const errData = await response.json().catch(() => ({}))
       console.log("Erreur response:", errData)
-      setErreur(errData.error || `Erreur ${response.status}`)
+      setErreur(errData.detail || errData.error || `Erreur ${response.status}`)
+      return ;
     }
-    else{
+    const { job_id }=await response.json()
+    //le prétraitement tourne en arrière-plan sur le serveur: on suit son avancement
+    while (true){
+      await new Promise(r => setTimeout(r, 1000))
+      const statut=await fetch(`http://localhost:8000/api/preprocessing/${job_id}`,{credentials:"include"})
+      if (!statut.ok){
+        setIsLoading(false)
+        setJob(null)
+        setErreur(`Erreur ${statut.status}`)
+        return ;
+      }
+      const etat=await statut.json()
+      setJob(etat)
+      if (etat.state==="running") continue
       setIsLoading(false)
-      console.log("Prétraitement réussi")
-      setErreur("")
-      if (typeof setProcessed === 'function') setProcessed(true)
+      if (etat.state==="done"){
+        console.log("Prétraitement réussi")
+        setErreur("")
+        if (typeof setProcessed === 'function') setProcessed(true)
+      }
+      else if (etat.state==="error"){
+        setErreur(etat.error || "Erreur lors du prétraitement")
+      }
+      else{
+        setErreur("Prétraitement annulé")
+      }
+      return ;
     }
   }
 
+  async function cancelJob(){
+    if (!job) return ;
+    await fetch(`http://localhost:8000/api/preprocessing/${job.job_id}/cancel`,{
+      method:"POST",
+      credentials:"include",
+    })
+  }
+
   return(
 
 <>
@@ -271,9 +316,21 @@ className="w-full px-4 py-2 border border-gray-300 rounded-lg
     </div>
   )}
     {isLoading && (
-            <p className="text-gray-700 font-medium bg-gray-100 border border-gray-200 rounded-lg px-4 py-2 mt-2">
-                Chargement...
-            </p>
+            <div className="text-gray-700 font-medium bg-gray-100 border border-gray-200 rounded-lg px-4 py-2 mt-2">
+                <p>
+                  {job ? etapes[job.stage] || job.stage : "Chargement"}...
+                  {job && job.partition && ` (${job.partition})`}
+                </p>
+                {job && job.partitions_total>0 && (
+                  <p className="text-sm">Partitions traitées: {job.partitions_done}/{job.partitions_total}</p>
+                )}
+                {job && (
+                  <button
+                  onClick={()=>cancelJob()}
+                  className="mt-2 bg-red-600 hover:bg-red-700 text-white text-sm font-semibold py-1 px-3 rounded-lg transition">
+                    Annuler</button>
+                )}
+            </div>
         )}
 
     {erreur && (